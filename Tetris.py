@@ -17,12 +17,24 @@
 # music6 C64 - Dies Irae, TheOuterLinux, https://opengameart.org/content/c64-mozart-dies-irae
 # music7.ogg Sonata 8, Kim Lightyear, Bernd Krueger https://opengameart.org/content/sonata-8-chiptune-beethoven
 # music8.ogg "Twister Tetris" by poinl, https://opengameart.org/content/twister-tetris
-import copy
-import random, sys
-from random import randrange as rand
+import argparse
+import sys
+import time
 import pygame as pg
 import os
-from os import path, listdir
+from os import path
+from engine import config, tetrisEngine, gameRules, listBoard, DROP, INSTA_FALL
+from bitboard import bitBoard
+from render import tileAtlas, textCache, border_color, draw_cell
+from controls import inputMap, ENGINE_ACTIONS
+from assets import assetManager
+from audio import audioMixer, init_mixer
+from replay import replay, replayRecorder
+from ai import placementAI
+from profiler import frameProfiler
+from animations import animationPlayer
+from scores import scoreStore, game_record
+from snapshot import gameHistory
 
 main_folder = path.dirname(__file__) #comment out when using pyinstaller hates this when packaging into an executable for some reason.
 #main_folder = '' #uncomment out when using pyinstaller
@@ -30,15 +42,6 @@ game_folder = path.join(main_folder, 'assets')
 snd_folder = path.join(game_folder, 'sounds')
 music_folder = path.join(game_folder, 'music')
 
-# The configuration
-config = {
-	'cell_size':	20,
-	'cols':		10,
-	'rows':		20,
-	'delay':	750,
-	'maxfps':	30
-}
-
 EFFECTS_SOUNDS = {'rotate': 'rotate.ogg', 'set': 'set.ogg', 'levelup': 'levelup.ogg', 'line': 'line.ogg', 'double': 'double.ogg', 'tripple': 'tripple.ogg', 'tetris': 'tetris.ogg'}
 
 BLACK = (0, 0, 0)
@@ -57,6 +60,14 @@ BROWN = (165,42,42)
 
 FONT_NAME = 'arial'
 TITLE = "tetris"
+MAX_LAG = 250 # ms of game time to catch up on at most after a stall, past that the game just runs late
+DEMO_MOVE_MS = 40 # how often the demo makes a move
+LAYOUT_CELL = 20 # the HUD and title screen positions and font sizes below are in pixels at this cell size
+LAYOUT_ROWS = 20 # and the HUD is sized as if the board had this many rows, so it stays readable next to big boards
+HUD_CELLS = 5 # the HUD is this many of those cells wide
+MIN_CELL = 4
+IDLE_WAIT_MS = 1000 # longest the title, pause and game over screens sleep waiting for an event
+REDRAW_EVENTS = (pg.VIDEOEXPOSE, pg.WINDOWEXPOSED) # the window was uncovered and has to be drawn again
 
 COLORS = [
 BLACK,
@@ -74,37 +85,6 @@ BROWN
 ]
 
 
-# Define the shapes of the single parts
-tetris_shapes = [
-	[[0, 0, 0, 0],
-	 [10, 10, 10, 10],
-	 [0, 0, 0, 0]],
-
-	[[2, 2],
-	 [2, 2]],
-
-	[[0, 0, 0],
-	 [8, 8, 8],
-	 [0, 8, 0]],
-	
-	[[0, 0, 0],
-	 [0, 3, 3],
-	 [3, 3, 0]],
-
-	[[0, 0, 0],
-	 [1, 1, 0],
-	 [0, 1, 1]],
-
-	[[4, 0, 0],
-	 [4, 4, 4],
-	 [0, 0, 0]],
-
-	[[0, 0, 0],
-	 [5, 5, 5],
-	 [5, 0, 0]],
-
-]
-
 tetris_shape = [
 	 [1, 1, 1, 0, 2, 2, 0, 3, 3, 3, 0, 4, 4, 0, 5, 0, 0, 6, 6],
 	 [0, 1, 0, 0, 2, 0, 0, 0, 3, 0, 0, 4, 0, 0, 5, 0, 0, 6, 0],
@@ -112,247 +92,281 @@ tetris_shape = [
 	 [0, 1, 0, 0, 2, 0, 0, 0, 3, 0, 0, 4, 0, 0, 5, 0, 0, 6, 0],
 	 [0, 1, 0, 0, 2, 2, 0, 0, 3, 0, 0, 4, 0, 0, 5, 0, 6, 6, 0]
 ]
-def rotate_clockwise(shape):
-	# Rotates shape counterclockwise three times to rotate it clockwise.
-	for i in range(0, 3):
-		shape = rotate_counterclockwise(shape)
-	return shape
-
-def rotate_counterclockwise(shape):
-	return [[shape[y][x]
-			 for y in range(len(shape))]
-			for x in range(len(shape[0]) - 1, -1, -1)]
-
-def vflip(shape):
-	return [shape[y] for y in range(len(shape) - 1, -1, -1)]
-
-def hflip(shape):
-	new_shape = []
-	height = len(shape)
-	width = len(shape[0])
-	for j in range(0, height):
-		new_row = []
-		for i in range(width - 1, -1, -1):
-			new_row.append(shape[j][i])
-		new_shape.append(new_row)
-	return new_shape
-
-def check_collision(board, boarder, shape, offset):
-	off_x, off_y = offset
-	for cy, row in enumerate(shape):
-		for cx, cell in enumerate(row):
-			try:
-				if cy + off_y >= 0:
-					if (cell and board[cy + off_y][cx + off_x]) or (cell and boarder[cy + off_y + 3][cx + off_x + 1]):
-						return True
-				else:
-					if (cell and boarder[cy + off_y + 3][cx + off_x + 1]):
-						return True
-			except IndexError:
-				return True
-	return False
-
-def check_collision_side(board, boarder, shape, offset):
-	off_x, off_y = offset
-	for cy, row in enumerate(shape):
-		for cx, cell in enumerate(row):
-			try:
-				if (cell and board[ cy + off_y][ cx + off_x]) or (cell and boarder[ cy + off_y + 3][ cx + off_x + 1]):
-					return (cx, cy)
-			except IndexError:
-				return (cx, cy)
-	return False
-
-def remove_row(board, row):
-	del board[row]
-	return [[0 for i in range(config['cols'])]] + board
-	
-def new_board():
-	board = [ [ 0 for x in range(config['cols']) ]
-			for y in range(config['rows']) ]
-	board += [[ 1 for x in range(config['cols'])]]
-	return board
 
 class tetrisApp(object):
-	def __init__(self):
-		pg.mixer.pre_init(44100, -16, 4, 2048) #reduces delay in sound playback.
+	# playback is a replay.replay to show instead of a game you play, at speed times normal speed.
+	# demo is an ai.placementAI to let play instead, for attract mode. It starts a new game a few seconds after each
+	# game over. show_title = False goes straight to the game.
+	# client is a connected versus.threadedClient for a game against other players, the server runs the games.
+	# rules is an engine.gameRules for the games you play, the board size of a replay or versus game is its own.
+	def __init__(self, playback = None, speed = 1, demo = None, show_title = True, client = None, rules = None):
+		self.playback = playback
+		self.speed = speed
+		self.demo = demo
+		self.client = client
+		if playback != None:
+			rules = gameRules(playback.cols, playback.rows)
+		elif client != None:
+			board = client.games[client.me].board
+			rules = gameRules(board.cols, board.height)
+		self.rules = rules if rules != None else gameRules()
+		self.watching = playback != None or demo != None # only quit does anything
+		self.gameover_time = 0
+		self.sim_time = 0.0 # ms of game time, advanced one fixed tick at a time by run()
+		self.demo_time = 0
+		self.profiler = frameProfiler()
+		init_mixer(config['audio_buffer'])
 		pg.init()
 		pg.mixer.init()
-		pg.key.set_repeat(250,25)
-		self.channel3 = pg.mixer.Channel(2)
-		self.channel4 = pg.mixer.Channel(3)
 		self.font_name = pg.font.match_font(FONT_NAME)  # finds the closest match on computer
-		self.width = config['cell_size']*config['cols']
-		self.height = config['cell_size']*config['rows']
-		self.next_stone = None
+		self.text_cache = textCache(self.font_name)
 		os.environ['SDL_VIDEO_CENTERED'] = '1'
-		self.flags = pg.SCALED  | pg.RESIZABLE
-		self.screen = pg.display.set_mode((self.width + 102, self.height + 2), self.flags)
+		cell_size = config['cell_size']
+		desktop = pg.display.Info()
+		if desktop.current_h > 0: # a big board starts with smaller cells so the window fits on the screen
+			cell_size = max(MIN_CELL, min(cell_size, (desktop.current_h * 9 // 10 - 2) // self.rules.rows))
+		size = (self.rules.cols * cell_size + HUD_CELLS * (self.rules.rows * cell_size // LAYOUT_ROWS) + 2, self.rules.rows * cell_size + 2)
+		if config['scaling'] == 'sdl': # draws at cell_size and lets SDL stretch it to the window
+			self.flags = pg.SCALED | pg.RESIZABLE
+		elif config['fullscreen']:
+			self.flags = pg.FULLSCREEN
+			size = (0, 0) # the desktop resolution
+		else:
+			self.flags = pg.RESIZABLE
+		pg.display.set_mode(size, self.flags)
 		pg.display.set_caption(TITLE)
 		icon_image = pg.image.load(path.join(game_folder, 'tetris.png'))
 		pg.display.set_icon(icon_image)
-		self.play_surface = pg.Surface((self.width, self.height))
-		self.next_surface = pg.Surface((99, 99))
-		# Loads sound effects
-		self.effects_sounds = {}
-		for key in EFFECTS_SOUNDS:
-			self.effects_sounds[key] = pg.mixer.Sound(path.join(snd_folder, EFFECTS_SOUNDS[key]))
-
-		self.level = 0
-		self.score = 0
-		self.lines = 0
-		self.lines_required = 0
-		self.lines_left = 0
+		self.opponents = []
+		self.animations = None
+		self.layout()
+		# Loads sound effects and finds the music in the background while the title screen is up
+		self.assets = assetManager(snd_folder, music_folder, EFFECTS_SOUNDS)
+		self.audio = audioMixer(self.assets)
+
 		self.start_level = 0
+		self.tick_rate = config['tick_rate']
+		if playback != None:
+			self.start_level = playback.start_level
+			self.tick_rate = playback.tick_rate # its frames are ticks at the rate it was recorded at
+			self.engine = playback.new_engine(bitBoard)
+		elif client != None:
+			self.engine = client.games[client.me]
+			self.opponents = [game for i, game in enumerate(client.games) if i != client.me]
+			self.layout()
+		else:
+			self.engine = tetrisEngine(self.start_level, config['seed'], config['randomizer'], bitBoard, self.rules)
+		self.recorder = None
+		self.history = None # practice mode's undo
+		if config['practice'] and not self.watching and client == None:
+			self.history = gameHistory()
+		self.stream = None # spectators, see broadcast.py
+		if config['broadcast'] and client == None:
+			import broadcast
+			self.stream_writer = broadcast.open_writer(config['broadcast'])
+			self.stream = broadcast.gameStream(self.engine, self.stream_writer.write, 'demo' if demo != None else config['player'])
+		self.scores = None
+		if config['scores'] and playback == None and client == None and self.history == None:
+			self.scores = scoreStore(config['scores'])
+		self.controls = inputMap(path.join(main_folder, 'controls.json'))
 
-		self.music_list = []
-		number_of_files = len([name for name in listdir(music_folder) if path.isfile(path.join(music_folder, name))])
-		for i in range(0, number_of_files):
-			filename = 'music{}.ogg'.format(i)
-			song = path.join(music_folder, filename)
-			self.music_list.append(song)
 		self.current_song = 0
 
-		self.title_surface = pg.Surface((self.width + 82, self.height + 2))
-
 		pg.joystick.init() # Initializes all joysticks/controllers
 		joysticks = [pg.joystick.Joystick(x) for x in range(pg.joystick.get_count())]
-		loop = True
+		pg.event.set_blocked(pg.MOUSEMOTION) # We do not need
+		                                             # mouse movement
+		                                             # events, so we
+		                                             # block them.
+		# The title screen only draws when something on it changed and otherwise sleeps in pg.event.wait().
+		loop = show_title and not self.watching and client == None # replays, the demo and versus games skip the title screen
+		redraw = True
 		while loop:
-			self.title_surface.fill(BLACK)
-			self.draw_text(self.title_surface, "Mutant Python Games", 12, GREEN, (self.width + 82) // 2, 125)
-			self.draw_text(self.title_surface, "UP/R CTRL - Rotate", 16, WHITE, (self.width + 82) // 2, 170)
-			self.draw_text(self.title_surface, "Move with arrow keys.", 16, WHITE, (self.width + 82) // 2, 200)
-			self.draw_text(self.title_surface, "Remove rows by completing them", 18, BLUE, (self.width + 82) // 2, 233)
-			self.draw_text(self.title_surface, "Gamepads Supported", 14, WHITE, (self.width + 82) // 2, 255)
-			self.draw_text(self.title_surface, "Press any key/button to begin.", 16, ORANGE, (self.width + 82) // 2,
-						   320)
-			self.draw_text(self.title_surface, "+/- or R/L to change level", 16, YELLOW, (self.width + 82) // 2, 360)
-			self.draw_text(self.title_surface, "Start Level = " + str(self.start_level), 16, YELLOW, (self.width + 82) // 2, 380)
-			tetris_surface = self.draw_tetris_title()
-			nov_rect = tetris_surface.get_rect()
-			self.title_surface.blit(tetris_surface, ((self.width + 82) // 2 - nov_rect.width // 2, 50))
-			self.screen.blit(self.title_surface, (10, 0))
-			pg.display.flip()
-			for event in pg.event.get():
-				if event.type == pg.KEYDOWN:
-					if event.key in [pg.K_PLUS, pg.K_EQUALS, pg.K_MINUS]:
-						if event.key in [pg.K_PLUS, pg.K_EQUALS]:
-							self.start_level += 1
-							if self.start_level > 9:
-								self.start_level = 9
-						elif event.key == pg.K_MINUS:
-							self.start_level -= 1
-							if self.start_level < 0:
-								self.start_level = 0
-					else:
-						loop = False
-				elif event.type == pg.QUIT:
-					self.quit()
-				elif event.type == pg.JOYBUTTONDOWN:
-					if event.button in [0, 1, 2, 3, 6, 7, 8, 9, 10]:
-						loop = False
-					elif event.button == 4:
-						self.start_level -= 1
-						if self.start_level < 0:
-							self.start_level = 0
-					elif event.button == 5:
+			if redraw:
+				redraw = False
+				self.draw_title()
+			event = pg.event.wait(IDLE_WAIT_MS)
+			level = self.start_level
+			if event.type == pg.KEYDOWN:
+				if event.key in [pg.K_PLUS, pg.K_EQUALS, pg.K_MINUS]:
+					if event.key in [pg.K_PLUS, pg.K_EQUALS]:
 						self.start_level += 1
 						if self.start_level > 9:
 							self.start_level = 9
-					elif event.button in [8, 10]:
-						self.quit()
+					elif event.key == pg.K_MINUS:
+						self.start_level -= 1
+						if self.start_level < 0:
+							self.start_level = 0
+				else:
+					loop = False
+			elif event.type == pg.QUIT:
+				self.quit()
+			elif event.type == pg.VIDEORESIZE:
+				self.layout()
+				redraw = True
+			elif event.type in REDRAW_EVENTS:
+				redraw = True
+			elif event.type == pg.JOYBUTTONDOWN:
+				if event.button in [0, 1, 2, 3, 6, 7, 8, 9, 10]:
+					loop = False
+				elif event.button == 4:
+					self.start_level -= 1
+					if self.start_level < 0:
+						self.start_level = 0
+				elif event.button == 5:
+					self.start_level += 1
+					if self.start_level > 9:
+						self.start_level = 9
+				elif event.button in [8, 10]:
+					self.quit()
+			if self.start_level != level:
+				redraw = True
 
-		pg.event.set_blocked(pg.MOUSEMOTION) # We do not need
-		                                             # mouse movement
-		                                             # events, so we
-		                                             # block them.
 		self.init_game()
 
-	def level_up(self, newgame = 0):
-		global config
-		if not newgame:
-			self.level += 1
-			#self.board = new_board()
-			pg.mixer.music.stop()
-			self.channel4.play(self.effects_sounds['levelup'])
-			if self.level > 9:
-				self.delay -= 20
-			else:
-				self.delay -= 60
-			if self.delay < 50:
-				self.delay = 50
-			self.current_song += 1  # Changes song to next in list
-			if self.current_song > len(self.music_list) - 1:
-				self.current_song = 0
-		else:
-			self.delay = config['delay'] - (self.level * 60)
-		self.lines = 0
-		self.lines_required = self.lines_left = (self.level + 1) * 5
-		song = self.music_list[self.current_song]
-		pg.mixer.music.load(song)
-		pg.mixer.music.play(loops=-1)
-
-	def new_stone(self):
-		global COLORS
-		if self.next_stone != None:
-			self.stone = self.next_stone
+	def px(self, pixels):
+		# A size in the LAYOUT_CELL layout at the current size.
+		return max(1, pixels * self.hud_cell // LAYOUT_CELL)
+
+	def layout(self):
+		# Sizes everything for the window as it is now. The cell size is the largest whole number of pixels that fits the
+		# board and the HUD, the game is centred in the window and drawn straight onto it at that size, so nothing has to
+		# be stretched every frame. The cached tiles and surfaces are made again here and only here. With scaling 'sdl'
+		# the window is always its first size as far as we can tell and SDL does the stretching.
+		# The HUD is scaled by hud_cell, the cell size a LAYOUT_ROWS row board as tall as this one would have, which is
+		# the cell size itself on a normal board.
+		self.window = pg.display.get_surface()
+		window_width, window_height = self.window.get_size()
+		cols, rows = self.rules.cols, self.rules.rows
+		self.cell_size = max(MIN_CELL, min((window_width - 2) * LAYOUT_ROWS // (cols * LAYOUT_ROWS + HUD_CELLS * rows), (window_height - 2) // rows))
+		self.width = self.cell_size * cols
+		self.height = self.cell_size * rows
+		self.hud_cell = max(MIN_CELL, self.height // LAYOUT_ROWS)
+		px = self.px
+		view = pg.Rect(0, 0, self.width + 2 + HUD_CELLS * self.hud_cell, self.height + 2)
+		view.center = self.window.get_rect().center
+		self.view = view.clip(self.window.get_rect())
+		self.window.fill(BLACK)
+		self.screen = self.window.subsurface(self.view) # drawing on it draws on the window
+		self.play_surface = pg.Surface((self.width, self.height)).convert()
+		self.next_surface = pg.Surface((px(99), px(99))).convert()
+		self.title_surface = pg.Surface((self.width + px(82), self.height + 2)).convert()
+		self.atlas = tileAtlas(COLORS, self.cell_size)
+		self.ghost_atlas = tileAtlas(COLORS, self.cell_size, ghost = True)
+		self.hud_atlas = self.atlas if self.hud_cell == self.cell_size else tileAtlas(COLORS, self.hud_cell) # the next stone
+		self.logo = None # drawn the first time the title screen needs it
+		self.mini_atlas = tileAtlas(COLORS, max(1, px(3))) if self.opponents else None
+		if self.animations != None:
+			self.animations.stop()
+		self.animations = animationPlayer(cols, len(COLORS))
+		# Used by draw_dirty(): the locked cells live on board_surface, which is only redrawn when they change.
+		self.board_surface = pg.Surface((self.width, self.height)).convert()
+		self.play_rect = pg.Rect(1, 1, self.width, self.height)
+		self.hud_rect = pg.Rect(self.width + 2, 0, HUD_CELLS * self.hud_cell, self.height + 2)
+		self.redraw_all = True
+
+	def update_display(self, rects = None):
+		# pg.display.update() for rects on self.screen.
+		if rects == None:
+			pg.display.update()
 		else:
-			selected_shape = copy.deepcopy(tetris_shapes[rand(len(tetris_shapes))])
-			self.stone = selected_shape
-		self.stone_x = int(config['cols'] / 2 - len(self.stone[0])/2)
-		self.stone_y = -3
+			pg.display.update([rect.move(self.view.topleft) for rect in rects])
 
-		next_selected_shape = copy.deepcopy(tetris_shapes[rand(len(tetris_shapes))])
-		self.next_stone = next_selected_shape
+	def play_effect(self, name):
+		self.audio.play(name)
+
+	def play_song(self):
+		self.assets.play_music(self.current_song) # this also starts reading the next song in
+
+	def level_up(self):
+		pg.mixer.music.stop()
+		self.play_effect('levelup')
+		self.current_song += 1  # Changes song to next in list
+		if self.current_song > len(self.assets.music_list) - 1:
+			self.current_song = 0
+		self.play_song()
 
-		if check_collision(self.board, self.boarder, self.stone,(self.stone_x, self.stone_y)):
-			self.gameover = True
-	
 	def init_game(self):
-		self.flips = 0
-		self.delay = config['delay']
-		self.start_time = self.last_drop = pg.time.get_ticks()
-		self.board = new_board()
-		self.boarder = self.create_boarder()
-		self.level = self.start_level
-		self.score = 0
-		self.next_stone = None
-		self.level_up(1)
-		self.new_stone()
-
-	def join_matrixes(self, board, mat2, mat2_off):
-		off_x, off_y = mat2_off
-		for cy, row in enumerate(mat2):
-			for cx, val in enumerate(row):
-				if (cy + off_y - 1 >= 0):
-					try:
-						board[cy + off_y - 1][cx + off_x] += val
-					except:
-						pass
-				else:
-					self.gameover = True
-		return board
-
-	def create_boarder(self):
-		boarder = [] # creates a matrix of zeros the size of the board surrounded but padded with 1s except for on top to use for collision detection.
-		for j in range(0, len(self.board) + 4):
-			new_row = []
-			for i in range(0, len(self.board[0]) + 2):
-				if (j == len(self.board)+3) or (i in [0, len(self.board[0])+1]):
-					val = 1
+		self.start_time = self.last_drop = self.sim_time
+		self.engine.start_level = self.start_level
+		self.engine.init_game()
+		if config['record'] and not self.watching and self.client == None and self.history == None:
+			self.recorder = self.engine.recorder = replayRecorder(self.engine)
+		self.playback_index = 0
+		self.animations.stop()
+		self.redraw_all = True
+		self.play_song()
+		if self.history != None:
+			self.history.clear()
+			self.history.push((self.engine.snapshot(), self.current_song))
+		if self.stream != None:
+			self.stream.keyframe()
+
+	def undo(self):
+		# Practice mode: takes back the last stone, or from the game over screen the one that ended it.
+		if self.history == None or self.engine.paused:
+			return
+		snapshot, song = self.history.undo(0 if self.engine.gameover else 1)
+		self.engine.restore(snapshot)
+		if self.stream != None:
+			self.stream.keyframe()
+		self.last_drop = self.sim_time
+		self.animations.stop()
+		self.redraw_all = True
+		if song != self.current_song:
+			self.current_song = song
+			self.play_song()
+
+	def save_replay(self):
+		if self.recorder != None:
+			self.recorder.save(path.join(config['record'], 'game-{}.tfr'.format(self.recorder.seed)))
+			self.recorder = self.engine.recorder = None
+
+	def act(self, action):
+		# Everything that changes the game goes through the engine, then we play whatever it reported.
+		moved = self.engine.step(action)
+		self.handle_events()
+		return moved
+
+	def handle_events(self):
+		if self.client != None:
+			events = self.engine.take_events() # the client's thread adds to them
+		else:
+			events = self.engine.events
+			self.engine.events = []
+		if self.stream != None:
+			self.stream.update(events)
+		for event in events:
+			if event[0] == 'rotate':
+				self.play_effect('rotate')
+			elif event[0] == 'set':
+				self.play_effect('set')
+			elif event[0] == 'lines':
+				rows_removed, rows = event[1], event[3]
+				if rows_removed == 1:
+					self.play_effect('line')
+				elif rows_removed == 2:
+					self.play_effect('double')
+				elif rows_removed == 3:
+					self.play_effect('tripple')
 				else:
-					val = 0
-				new_row.append(val)
-			boarder.append(new_row)
-		return boarder
+					self.play_effect('tetris')
+				self.animations.clear_lines(rows, self.sim_time, self.cell_size)
+			elif event[0] == 'levelup':
+				self.level_up()
+			elif event[0] == 'gameover':
+				self.gameover_time = self.sim_time
+				self.save_replay()
+				if self.scores != None:
+					self.scores.add(game_record(self.engine, 'demo' if self.demo != None else config['player'], self.sim_time - self.start_time))
+		if self.history != None and ('set',) in events and not self.engine.gameover:
+			self.history.push((self.engine.snapshot(), self.current_song)) # the next stone has appeared
 
 	def center_msg(self, msg):
-		self.draw_text(self.play_surface, msg,12,WHITE, self.width // 2, self.height // 2)
+		self.draw_text(self.play_surface, msg, self.px(12), WHITE, self.width // 2, self.height // 2)
 
 	def draw_text(self, surface, text, size, color, x, y, align='midtop'):
-		font = pg.font.Font(self.font_name, size)
-		text_surface = font.render(text, True, color)
+		text_surface = self.text_cache.render(text, size, color)
 		text_rect = text_surface.get_rect()
 		if align == 'midtop':
 			text_rect.midtop = (x, y)
@@ -360,354 +374,459 @@ class tetrisApp(object):
 			text_rect.midleft = (x, y)
 		surface.blit(text_surface, text_rect)
 
+	def draw_title(self):
+		px = self.px
+		middle = self.title_surface.get_width() // 2
+		self.title_surface.fill(BLACK)
+		self.draw_text(self.title_surface, "Mutant Python Games", px(12), GREEN, middle, px(125))
+		self.draw_text(self.title_surface, "UP/R CTRL - Rotate", px(16), WHITE, middle, px(170))
+		self.draw_text(self.title_surface, "Move with arrow keys.", px(16), WHITE, middle, px(200))
+		self.draw_text(self.title_surface, "Remove rows by completing them", px(18), BLUE, middle, px(233))
+		self.draw_text(self.title_surface, "Gamepads Supported", px(14), WHITE, middle, px(255))
+		self.draw_text(self.title_surface, "Press any key/button to begin.", px(16), ORANGE, middle, px(320))
+		self.draw_text(self.title_surface, "+/- or R/L to change level", px(16), YELLOW, middle, px(360))
+		self.draw_text(self.title_surface, "Start Level = " + str(self.start_level), px(16), YELLOW, middle, px(380))
+		if self.logo == None:
+			self.logo = self.draw_tetris_title()
+		self.title_surface.blit(self.logo, (middle - self.logo.get_width() // 2, px(50)))
+		self.screen.blit(self.title_surface, (px(10), 0))
+		pg.display.flip()
+		self.assets.mark('first title frame')
+
 	def draw_tetris_title(self):
 		global tetris_shape
-		surface = pg.Surface((266, 70))
-		matrix = tetris_shape
-		cell_size = 14
-		off_x, off_y = (0, 0)
-		for y, row in enumerate(matrix):
+		cell_size = self.px(14)
+		surface = pg.Surface((len(tetris_shape[0]) * cell_size, len(tetris_shape) * cell_size))
+		for y, row in enumerate(tetris_shape):
 			for x, val in enumerate(row):
 				if val:
-					pg.draw.rect(
-						surface,
-						COLORS[val],
-						pg.Rect(
-							x * cell_size + off_x,
-							y * cell_size + off_y,
-							cell_size + off_x,
-							cell_size + off_y), 0)
-					pg.draw.rect(
-						surface,
-						self.get_border_color(val),
-						pg.Rect(
-							x * cell_size + off_x,
-							y * cell_size + off_y,
-							cell_size + off_x,
-							cell_size + off_y), 1)
-					pg.draw.rect(
-						surface,
-						self.get_border_color(val, 30),
-						pg.Rect(
-							x * cell_size + off_x + 4,
-							y * cell_size + off_y + 4,
-							cell_size + off_x - 5,
-							cell_size + off_y - 5), 0)
+					draw_cell(surface, COLORS[val], x * cell_size, y * cell_size, cell_size)
 		return(surface)
 
 	def draw_matrix(self, matrix, offset, next_surf = 0, surface = None):
 		off_x, off_y  = offset
 		if surface == None:
 			surface = self.play_surface
-		for y, row in enumerate(matrix):
-			for x, val in enumerate(row):
-				if val:
-					if next_surf == 0:
-						pg.draw.rect(
-							surface,
-							COLORS[val],
-							pg.Rect(
-								(off_x+x) *
-								  config['cell_size'],
-								(off_y+y) *
-								  config['cell_size'],
-								config['cell_size'],
-								config['cell_size']),0)
-						pg.draw.rect(
-							surface,
-							self.get_border_color(val),
-							pg.Rect(
-								(off_x+x) *
-								  config['cell_size'],
-								(off_y+y) *
-								  config['cell_size'],
-								config['cell_size'],
-								config['cell_size']),1)
-
-						pg.draw.rect(
-							surface,
-							self.get_border_color(val, 30),
-							pg.Rect(
-								(off_x+x) *
-								  config['cell_size']+4,
-								(off_y+y) *
-								  config['cell_size']+4,
-								config['cell_size']-5,
-								config['cell_size']-5),0)
-					else: # Used for drawing next piece up.
-						pg.draw.rect(
-							self.next_surface,
-							COLORS[val],
-							pg.Rect(
-								x*config['cell_size'] + off_x,
-								y*config['cell_size'] + off_y,
-								config['cell_size'],
-								config['cell_size']),0)
-						pg.draw.rect(
-							self.next_surface,
-							self.get_border_color(val),
-							pg.Rect(
-								x*config['cell_size'] + off_x,
-								y*config['cell_size'] + off_y,
-								config['cell_size'],
-								config['cell_size']),1)
-						pg.draw.rect(
-							self.next_surface,
-							self.get_border_color(val, 30),
-							pg.Rect(
-								x*config['cell_size'] + off_x + 4,
-								y*config['cell_size'] + off_y + 4,
-								config['cell_size'] - 5,
-								config['cell_size'] - 5),0)
+		if next_surf == 0:
+			self.atlas.draw_matrix(surface, matrix, off_x * self.cell_size, off_y * self.cell_size)
+		else: # Used for drawing next piece up.
+			self.hud_atlas.draw_matrix(self.next_surface, matrix, off_x, off_y)
 
 	def get_border_color(self, val, coldelta = 50):
-		bordercolor = [0, 0, 0]
-		bordercolor[0] = COLORS[val][0] - coldelta
-		if bordercolor[0] < 0: bordercolor[0] = 0
-		elif bordercolor[0] > 255: bordercolor[0] = 255
-		bordercolor[1] = COLORS[val][1] - coldelta
-		if bordercolor[1] < 0: bordercolor[1] = 0
-		elif bordercolor[1] > 255: bordercolor[1] = 255
-		bordercolor[2] = COLORS[val][2] - coldelta
-		if bordercolor[2] < 0: bordercolor[2] = 0
-		elif bordercolor[2] > 255: bordercolor[2] = 255
-		return bordercolor
-
-	def tetris_animation(self, row):
-		animatrix = []
-		val = 1
-		for j in range(0, 4):
-			a_row = []
-			for i in range(0, config['cols']): # Makes a matrix of zeros to later fill with colors.
-				a_row.append(0)
-			animatrix.append(a_row)
-
-		offset = int(len(animatrix[0])/2)
-		for i in range(0, offset):
-			for j in range(0, 4):
-				rand_color1 = random.randrange(1, len(COLORS))
-				rand_color2 = random.randrange(1, len(COLORS))
-				animatrix[j][i + offset] = rand_color1
-				animatrix[j][offset - i - 1] = rand_color2
-			nov_surface = pg.Surface((self.width, config['cell_size'] * 4))
-			self.draw_matrix(animatrix, (0, 0), 0, nov_surface)
-			self.screen.blit(self.play_surface, (1, 1))
-			self.screen.blit(nov_surface, (1, int(row * config['cell_size']) + 1))
-			pg.display.update()
-			self.clock.tick(config['maxfps'])
+		return border_color(COLORS[val], coldelta)
 
-	def move(self, delta_x):
-		if not self.gameover and not self.paused:
-			new_x = self.stone_x + delta_x
-			if not check_collision(self.board, self.boarder, self.stone, (new_x, self.stone_y)):
-				self.stone_x = new_x
 	def quit(self):
 		self.center_msg("Exiting...")
-		pg.display.update()
+		self.update_display()
+		if config['load_times']:
+			print(self.assets.report())
+		self.save_replay()
+		if self.profiler.enabled:
+			self.toggle_profiler()
+		if self.scores != None:
+			self.scores.close()
+		if self.stream != None:
+			self.stream_writer.close()
 		sys.exit()
 
-	def insta_fall(self):
-		if not self.gameover and not self.paused:
-			while not check_collision(self.board, self.boarder, self.stone, (self.stone_x, self.stone_y)):
-				self.stone_y += 1
-		self.stone_y -= 1
-		self.drop
-
-	def drop(self):
-		if not self.gameover and not self.paused:
-			self.stone_y += 1
-			if check_collision(self.board, self.boarder, self.stone, (self.stone_x, self.stone_y)):
-				self.channel3.play(self.effects_sounds['set'])
-				self.board = self.join_matrixes(self.board, self.stone, (self.stone_x, self.stone_y))
-				self.new_stone()
-				rows_removed = 0
-				prevy = 0
-				while True:
-					for i, row in enumerate(self.board[:-1]):
-						if 0 not in row:
-							if prevy == 0:
-								prevy = i
-							self.board = remove_row(
-							  self.board, i)
-							rows_removed += 1
-							self.lines += 1
-							break
-					else:
-						break
-
-				if rows_removed == 1:
-					self.score += 40 * (self.level + 1)
-					self.channel4.play(self.effects_sounds['line'])
-				elif rows_removed == 2:
-					self.score += 100 * (self.level + 1)
-					self.channel4.play(self.effects_sounds['double'])
-					self.lines += 1
-				elif rows_removed == 3:
-					self.score += 300 * (self.level + 1)
-					self.channel4.play(self.effects_sounds['tripple'])
-					self.lines += 2
-				elif rows_removed > 3:
-					self.score += 1200 * (self.level + 1)
-					self.channel4.play(self.effects_sounds['tetris'])
-					self.lines += 4
-					self.tetris_animation(prevy)
-
-				self.lines_left = self.lines_required - self.lines
-				if self.lines_left < 0:
-					self.lines_left = 0
-				if self.lines_left <= 0:
-					self.level_up()
-
-	def rotate_stone(self, orientation):
-		if not self.gameover and not self.paused:
-			self.channel3.play(self.effects_sounds['rotate'])
-			if orientation == 1:
-				new_stone = rotate_counterclockwise(self.stone)
-			elif orientation == 2:
-				self.flips += 1
-				new_stone = hflip(self.stone)
-			elif orientation == 3:
-				self.flips += 1
-				new_stone = vflip(self.stone)
-			else:
-				new_stone = rotate_clockwise(self.stone)
-			if not check_collision(self.board, self.boarder, new_stone, (self.stone_x, self.stone_y)):
-				self.stone = new_stone
-			else:
-				col_point = check_collision_side(self.board, self.boarder, new_stone, (self.stone_x, self.stone_y))
-				if col_point[0] == 2:
-					if not check_collision(self.board, self.boarder, new_stone, (self.stone_x - 1, self.stone_y)):
-						self.stone = new_stone
-						self.move(-1)
-				if col_point[0] == 0:
-					if not check_collision(self.board, self.boarder, new_stone, (self.stone_x + 1, self.stone_y)):
-						self.stone = new_stone
-						self.move(1)
-
 	def toggle_pause(self):
-		now = pg.time.get_ticks()
-		if now - self.start_time > 500:
-			if not self.gameover:
-				self.paused = not self.paused
-		if self.paused:
+		if self.client != None:
+			return # the other players would not wait
+		if self.sim_time - self.start_time > 500:
+			if not self.engine.gameover:
+				self.engine.paused = not self.engine.paused
+		if self.engine.paused:
 			pg.mixer.music.pause()
 		else:
 			pg.mixer.music.unpause()
 	
 	def start_game(self):
-		if self.gameover:
+		if self.engine.gameover and self.client == None:
 			self.init_game()
-			self.gameover = False
+
+	def draw_hud(self):
+		px = self.px
+		middle = self.width + px(50)
+		self.next_surface.fill(BLACK)
+		pg.draw.rect(self.next_surface, WHITE, (0, 0, px(84), px(84)), 1)
+		self.draw_matrix(self.engine.next_stone, (px(2), px(2)), 1)
+		self.draw_text(self.screen, "Score:", px(20), WHITE, middle, px(10))
+		self.draw_text(self.screen, str(self.engine.score), px(14), WHITE, middle, px(30))
+		self.draw_text(self.screen, "Level:", px(20), WHITE, middle, px(50))
+		self.draw_text(self.screen, str(self.engine.level), px(20), WHITE, middle, px(70))
+		self.draw_text(self.screen, "Lines Left", px(16), WHITE, middle, px(110))
+		self.draw_text(self.screen, str(self.engine.lines_left), px(20), WHITE, middle, px(142))
+		pg.draw.rect(self.screen, WHITE, (self.width + px(17), px(130), px(68), px(50)), 1)
+		if self.profiler.enabled:
+			for i, line in enumerate(self.profiler.summary):
+				self.draw_text(self.screen, line, px(11), GREEN, middle, px(186 + i * 12))
+		self.draw_text(self.screen, "Next", px(20), WHITE, middle, px(250))
+		self.draw_text(self.screen, "Start Level: " + str(self.start_level), px(12), WHITE, middle, px(380))
+		#self.draw_text(self.screen, "Flips: " + str(self.flips), 20, WHITE, self.width + 50, 190)
+		self.screen.blit(self.next_surface, (self.width + px(10), px(275)))
+		if self.client != None:
+			self.draw_opponents()
+
+	def draw_opponents(self):
+		# The other players' boards, small, side by side under the level.
+		cell_size = self.mini_atlas.cell_size
+		top = self.px(186)
+		for i, game in enumerate(self.opponents):
+			width, height = game.board.cols * cell_size, game.board.height * cell_size
+			x = self.width + self.px(10) + i * (width + 4)
+			pg.draw.rect(self.screen, WHITE, (x - 1, top - 1, width + 2, height + 2), 1)
+			self.screen.fill(BLACK, (x, top, width, height))
+			self.mini_atlas.draw_matrix(self.screen, game.board.matrix[:-1], x, top)
+			if not game.gameover:
+				self.screen.set_clip((x, top, width, height))
+				self.mini_atlas.draw_matrix(self.screen, game.stone, x + game.stone_x * cell_size, top + game.stone_y * cell_size)
+				self.screen.set_clip(None)
+
+	def gameover_msg(self):
+		if self.client == None or self.client.winner == None:
+			return "Game Over! Press space/start to continue"
+		return "You win!" if self.client.winner == self.client.me else "You lose!"
 
 	def draw(self):
 		self.screen.fill(BLACK)
 		pg.draw.rect(self.screen, WHITE, (0, 0, self.width + 2, self.height + 2), 1)
-		self.next_surface.fill(BLACK)
-		pg.draw.rect(self.next_surface, WHITE, (0, 0, 84, 84), 1)
-		self.draw_matrix(self.next_stone,(2, 2), 1)
 		self.screen.blit(self.play_surface, (1, 1))
-		self.draw_text(self.screen, "Score:", 20, WHITE, self.width + 50, 10)
-		self.draw_text(self.screen, str(self.score), 14, WHITE, self.width + 50, 30)
-		self.draw_text(self.screen, "Level:", 20, WHITE, self.width + 50, 50)
-		self.draw_text(self.screen, str(self.level), 20, WHITE, self.width + 50, 70)
-		self.draw_text(self.screen, "Lines Left", 16, WHITE, self.width + 50, 110)
-		self.draw_text(self.screen, str(self.lines_left), 20, WHITE, self.width + 50, 142)
-		pg.draw.rect(self.screen, WHITE, (self.width + 17, 130, 68, 50), 1)
-		self.draw_text(self.screen, "Next", 20, WHITE, self.width + 50, 250)
-		self.draw_text(self.screen, "Start Level: " + str(self.start_level), 12, WHITE, self.width + 50, 380)
-		#self.draw_text(self.screen, "Flips: " + str(self.flips), 20, WHITE, self.width + 50, 190)
-		self.screen.blit(self.next_surface, (self.width + 10, 275))
-		pg.display.update()
-	
-	def run(self):
-		self.gameover = False
-		self.paused = False
-		key_actions = {
-			'ESCAPE':	self.quit,
-			'LEFT':		lambda:self.move(-1),
-			'RIGHT':	lambda:self.move(+1),
-			'UP': lambda: self.rotate_stone(1),
-			'RCTRL': lambda: self.rotate_stone(0),
-			'DOWN':		self.drop,
-			'p':		self.toggle_pause,
-			'SPACE':	lambda:self.insta_fall(),
-			'a': 		lambda:self.rotate_stone(1),
-			'd': 		lambda:self.rotate_stone(0),
-			'w': lambda: self.rotate_stone(3),
-			's': lambda: self.rotate_stone(2),
-		}
-
-		pg.joystick.init() # Initializes all joysticks/controllers
-		joysticks = [pg.joystick.Joystick(x) for x in range(pg.joystick.get_count())]
+		self.draw_hud()
+		self.update_display()
+
+	def ghost_y(self):
+		# Row to draw the ghost stone on, None for no ghost.
+		if not config['ghost']:
+			return None
+		return self.engine.landing_y()
+
+	def draw_stone(self, ghost_y = None):
+		# Draws the falling stone, and its ghost at ghost_y, straight onto the screen and returns the rects of the board
+		# they cover.
+		engine = self.engine
+		rects = []
+		self.screen.set_clip(self.play_rect)
+		if ghost_y != None and ghost_y > engine.stone_y:
+			rects.append(self.draw_piece(self.ghost_atlas, engine.stone, engine.stone_x, ghost_y))
+		rects.append(self.draw_piece(self.atlas, engine.stone, engine.stone_x, engine.stone_y))
+		self.screen.set_clip(None)
+		return rects
+
+	def draw_piece(self, atlas, stone, stone_x, stone_y):
+		cell_size = self.cell_size
+		x = self.play_rect.x + stone_x * cell_size
+		y = self.play_rect.y + stone_y * cell_size
+		atlas.draw_matrix(self.screen, stone, x, y)
+		return pg.Rect(x, y, len(stone[0]) * cell_size, len(stone) * cell_size).clip(self.play_rect)
+
+	def draw_board_rows(self, first, last):
+		# Draws rows first to last - 1 of the board onto board_surface and the screen, returns the screen rect.
+		# Rows above the top of the stack are empty, so they are only cleared.
+		board = self.engine.board
+		cell_size = self.cell_size
+		rect = pg.Rect(0, first * cell_size, self.width, (last - first) * cell_size)
+		self.board_surface.fill(BLACK, rect)
+		top = max(first, board.top)
+		self.atlas.draw_matrix(self.board_surface, board.matrix[top:last], 0, top * cell_size)
+		screen_rect = rect.move(self.play_rect.topleft)
+		self.screen.blit(self.board_surface, screen_rect, rect)
+		return screen_rect
+
+	def draw_dirty(self):
+		# The render = 'dirty' version of draw(). Only the rectangles that changed since the last frame are sent to
+		# pg.display.update(), and of the locked cells only the rows the board reports as changed are redrawn (after a
+		# stone sets, from its top row to its bottom one, after a clear, from the top of the stack down), so what a
+		# frame costs depends on what happened and not on the size of the board.
+		engine = self.engine
+		state = (engine.gameover, engine.paused)
+		hud = (engine.score, engine.level, engine.lines_left, engine.next_id, self.start_level, self.profiler.summary)
+		if self.client != None:
+			hud += tuple(game.version for game in self.opponents)
+		if self.redraw_all or state != self.state:
+			self.redraw_all = False
+			self.state = state
+			self.hud_state = hud
+			self.screen.fill(BLACK)
+			pg.draw.rect(self.screen, WHITE, (0, 0, self.width + 2, self.height + 2), 1)
+			if engine.gameover or engine.paused:
+				self.play_surface.fill(BLACK)
+				if engine.gameover:
+					self.center_msg(self.gameover_msg())
+				else:
+					self.center_msg("Paused")
+				self.screen.blit(self.play_surface, self.play_rect)
+			else:
+				engine.board.take_changes()
+				self.draw_board_rows(0, engine.board.height)
+				ghost_y = self.ghost_y()
+				self.stone_key = (engine.stone_id, engine.orientation, engine.stone_x, engine.stone_y, ghost_y)
+				self.stone_rects = self.draw_stone(ghost_y)
+				self.animations.draw(self.screen, self.atlas, self.play_rect.x, self.play_rect.y)
+			self.draw_hud()
+			self.update_display()
+			return
+		if engine.gameover or engine.paused:
+			return # nothing moves on these screens
+
+		dirty = []
+		rows = engine.board.take_changes()
+		for animation in self.animations.update(self.sim_time): # puts back what was under the ones that finished
+			first, last = animation.rows[0], animation.rows[-1] + 1
+			rows = (first, last) if rows == None else (min(first, rows[0]), max(last, rows[1]))
+		if rows != None:
+			dirty.append(self.draw_board_rows(*rows))
+		ghost_y = self.ghost_y()
+		stone_key = (engine.stone_id, engine.orientation, engine.stone_x, engine.stone_y, ghost_y)
+		if stone_key != self.stone_key:
+			# Puts back the board where the stone and its ghost were
+			for rect in self.stone_rects:
+				self.screen.blit(self.board_surface, rect, rect.move(-self.play_rect.x, -self.play_rect.y))
+			dirty += self.stone_rects
+		if dirty:
+			self.stone_key = stone_key
+			self.stone_rects = self.draw_stone(ghost_y)
+			dirty += self.stone_rects
+		dirty += self.animations.draw(self.screen, self.atlas, self.play_rect.x, self.play_rect.y)
+		if hud != self.hud_state:
+			self.hud_state = hud
+			self.screen.fill(BLACK, self.hud_rect)
+			self.draw_hud()
+			dirty.append(self.hud_rect)
+		if dirty:
+			self.update_display(dirty)
 
-		#pg.time.set_timer(pg.USEREVENT+1, self.delay)
-		self.clock = pg.time.Clock()
-		last_move = 0
-		move_delay = 50 # Makes the dpad move in steps
-		while 1:
+	def insta_fall(self):
+		if self.engine.gameover:
+			self.start_game()
+		else:
+			self.act(INSTA_FALL)
+
+	def start_button(self):
+		self.toggle_pause()
+		self.start_game()
+
+	def play_frame(self):
+		# Replays everything that was recorded on this frame. Gravity was recorded too, so it is not run here.
+		actions = self.playback.actions
+		while self.playback_index < len(actions) and actions[self.playback_index][0] <= self.engine.frame:
+			self.act(actions[self.playback_index][1])
+			self.playback_index += 1
+
+	def render(self):
+		if config['render'] == 'dirty':
+			self.draw_dirty()
+		else:
 			self.play_surface.fill((0,0,0))
-			if self.gameover:
-				self.center_msg("Game Over! Press space/start to continue")
+			if self.engine.gameover:
+				self.center_msg(self.gameover_msg())
 			else:
-				if self.paused:
+				if self.engine.paused:
 					self.center_msg("Paused")
 				else:
-					self.draw_matrix(self.board, (0,0))
-					self.draw_matrix(self.stone,
-					                 (self.stone_x,
-					                  self.stone_y))
+					board = self.engine.board
+					board.take_changes()
+					self.draw_matrix(board.matrix[board.top:board.height], (0, board.top))
+					ghost_y = self.ghost_y()
+					if ghost_y != None and ghost_y > self.engine.stone_y:
+						self.ghost_atlas.draw_matrix(self.play_surface, self.engine.stone,
+							self.engine.stone_x * self.cell_size, ghost_y * self.cell_size)
+					self.draw_matrix(self.engine.stone,
+					                 (self.engine.stone_x,
+					                  self.engine.stone_y))
+					self.animations.update(self.sim_time)
+					self.animations.draw(self.play_surface, self.atlas, 0, 0)
 			self.draw()
 
-			now = pg.time.get_ticks()
-			if (now - self.last_drop) > self.delay:
-				self.drop()
-				self.last_drop = pg.time.get_ticks()
-
-			# gets state of hat for moving blocks.
-			if pg.joystick.get_init:
-				if len(joysticks) > 0:
-					hat_state = joysticks[0].get_hat(0)
-					ora = pg.time.get_ticks()
-					if (ora - last_move) > move_delay:
-						if hat_state == (1, 0):
-							self.move(+1)
-							last_move = pg.time.get_ticks()
-						elif hat_state == (-1, 0):
-							self.move(-1)
-							last_move = pg.time.get_ticks()
-					if hat_state == (0, -1):
-						self.drop()
-
-			for event in pg.event.get():
-				if event.type == pg.QUIT:
-					self.quit()
-				elif event.type == pg.JOYBUTTONDOWN:
-					if event.button == 0:
-						self.rotate_stone(0)
-					elif event.button == 3:
-						self.rotate_stone(3)
-					elif event.button == 5:
-						self.insta_fall()
-					elif event.button == 2:
-						self.rotate_stone(1)
-					elif event.button == 1:
-						self.rotate_stone(2)
-					elif event.button in [7, 9]:
-						self.toggle_pause()
-						self.start_game()
-					elif event.button in [8, 10]:
-						self.quit()
-				elif event.type == pg.KEYDOWN:
-					for key in key_actions:
-						if event.key == eval("pg.K_"
-						+key):
-							key_actions[key]()
-					if (event.key == pg.K_SPACE) and self.gameover:
-						self.start_game()
+	def update(self, now):
+		# One simulation tick, now is the game time in ms.
+		if self.client != None:
+			self.handle_events() # gravity runs on the server
+		elif self.playback != None:
+			self.play_frame()
+		elif self.demo != None and self.engine.gameover:
+			if now - self.gameover_time > 3000:
+				self.init_game()
+		else:
+			if self.demo != None and now >= self.demo_time: # slow enough to follow
+				self.act(self.demo.next_action(self.engine))
+				self.demo_time = now + DEMO_MOVE_MS
+			if now - self.last_drop >= self.engine.delay:
+				self.act(DROP)
+				self.last_drop += self.engine.delay # on the tick grid, not whenever the frame happened to come
+
+	def handle_input(self, now, events = None):
+		commands = self.commands
+		for event in pg.event.get() if events == None else events:
+			action = None
+			if event.type == pg.QUIT:
+				self.quit()
+			elif event.type == pg.VIDEORESIZE:
+				self.layout()
+			elif event.type in REDRAW_EVENTS:
+				self.redraw_all = True
+			elif event.type == pg.KEYDOWN:
+				action = self.controls.key_down(event.key, now)
+			elif event.type == pg.KEYUP:
+				self.controls.key_up(event.key)
+			elif event.type == pg.JOYBUTTONDOWN:
+				action = self.controls.button_down(event.button, now)
+			elif event.type == pg.JOYBUTTONUP:
+				self.controls.button_up(event.button)
+			elif event.type == pg.JOYHATMOTION:
+				action = self.controls.hat_motion(event.value, now)
+			if action != None and (not self.watching or action in ('quit', 'profile')):
+				commands[action]()
+		for action in self.controls.repeats(now):
+			if not self.watching:
+				commands[action]()
+
+	def idle(self):
+		# True while nothing on screen can change without an event: paused, or a game over nobody is going to restart
+		# by themselves. The demo restarts its games and versus games still show the others playing.
+		if self.animations.active or self.demo != None or self.client != None:
+			return False
+		return self.engine.paused or self.engine.gameover
+
+	def wait_event(self):
+		# Sleeps until there is an event (or IDLE_WAIT_MS passes) and returns it with any others that came in.
+		event = pg.event.wait(IDLE_WAIT_MS)
+		return ([event] if event.type != pg.NOEVENT else []) + pg.event.get()
+
+	def wait_frame(self):
+		if config['maxfps']:
+			self.clock.tick(config['maxfps'])
 
+	def toggle_profiler(self):
+		profiler = self.profiler
+		if profiler.enabled:
+			profiler.stop()
+			profiler.save(config['profile'] or 'tetris-profile.json')
+		else:
+			profiler.time_calls(self, 'handle_input', 'events')
+			profiler.time_calls(self, 'update', 'update')
+			profiler.time_calls(self.engine.actions, DROP, 'drop')
+			profiler.time_calls(self, 'render', 'draw')
+			profiler.time_calls(tileAtlas, 'draw_matrix', 'draw_matrix') # the class, layout() makes new atlases
+			profiler.time_calls(self, 'draw_text', 'draw_text')
+			profiler.time_calls(self, 'wait_frame', 'tick')
+			profiler.count_calls(listBoard, 'collides', 'collisions')
+			profiler.count_calls(bitBoard, 'collides', 'collisions')
+			profiler.count_calls(pg.draw, 'rect', 'draw.rect')
+			profiler.start()
+		self.redraw_all = True
 
-			self.clock.tick(config['maxfps'])
+	def run(self):
+		self.commands = {
+			'quit':		self.quit,
+			'pause':	self.toggle_pause,
+			'start':	self.start_button,
+			'insta_fall':	self.insta_fall,
+			'profile':	self.toggle_profiler,
+			'undo':		self.undo,
+		}
+		for name, action in ENGINE_ACTIONS.items():
+			if name not in self.commands:
+				self.commands[name] = lambda action = action: self.act(action)
+
+		pg.joystick.init() # Initializes all joysticks/controllers
+		joysticks = [pg.joystick.Joystick(x) for x in range(pg.joystick.get_count())]
+
+		# The game runs on fixed ticks of tick_ms game time, as many as the real time since the last frame covers
+		# (times the playback speed), so gravity and auto repeat keep the same timing whatever the frame rate is.
+		# Rendering happens once per loop at maxfps, or as fast as it can with maxfps 0. engine.frame counts ticks.
+		# With low_latency the input is read right before every tick instead of once per frame.
+		self.clock = pg.time.Clock()
+		if config['profile']:
+			self.toggle_profiler()
+		tick_ms = 1000.0 / self.tick_rate
+		low_latency = config['low_latency']
+		lag = 0.0
+		last = time.perf_counter()
+		while 1:
+			if self.profiler.enabled:
+				self.profiler.next_frame()
+			if self.idle():
+				# Draws the screen once and then sleeps until something happens. Game time stands still meanwhile.
+				self.render()
+				self.handle_input(self.sim_time, self.wait_event())
+				last = time.perf_counter()
+				lag = 0.0
+				continue
+			now = time.perf_counter()
+			lag = min(lag + (now - last) * 1000 * self.speed, MAX_LAG)
+			last = now
+			if not low_latency:
+				self.handle_input(self.sim_time)
+			while lag >= tick_ms:
+				if low_latency:
+					self.handle_input(self.sim_time)
+				self.update(self.sim_time)
+				self.engine.frame += 1
+				self.sim_time += tick_ms
+				lag -= tick_ms
+			self.render()
+			self.wait_frame()
 
 if __name__ == '__main__':
-	App = tetrisApp()
+	parser = argparse.ArgumentParser(description = 'Tetris Flip')
+	parser.add_argument('--load-times', action = 'store_true', help = 'print how long the sounds and music took to load when quitting')
+	parser.add_argument('--seed', type = int, help = 'seed every game with this so the stones always come in the same order')
+	parser.add_argument('--bag', action = 'store_true', help = 'deal the stones from shuffled bags of all seven')
+	parser.add_argument('--record', metavar = 'FOLDER', help = 'save a replay of every game into FOLDER')
+	parser.add_argument('--replay', metavar = 'FILE', help = 'watch a recorded game')
+	parser.add_argument('--speed', type = float, default = 1, help = 'how fast to play --replay back')
+	parser.add_argument('--profile', metavar = 'FILE', help = 'time every frame from the start and save it to FILE (.json Chrome trace or .csv), F3 toggles it')
+	parser.add_argument('--fps', type = int, default = config['maxfps'], help = 'frames drawn per second, 0 for as many as possible')
+	parser.add_argument('--tick-rate', type = int, default = config['tick_rate'], help = 'game updates per second')
+	parser.add_argument('--low-latency', action = 'store_true', help = 'read the controls right before every game update')
+	parser.add_argument('--audio-buffer', type = int, default = config['audio_buffer'], help = 'samples per sound buffer, smaller plays sounds sooner (python audio.py latency measures it)')
+	parser.add_argument('--demo', action = 'store_true', help = 'let the computer play (attract mode)')
+	parser.add_argument('--demo-depth', type = int, default = 2, help = 'how many stones ahead the computer looks')
+	parser.add_argument('--scores', metavar = 'FILE', default = path.join(main_folder, 'scores.db'), help = 'keep finished games in this SQLite file, "" for none (see scores.py)')
+	parser.add_argument('--player', default = config['player'], help = 'the name your games are kept under')
+	parser.add_argument('--scaling', choices = ['native', 'sdl'], default = config['scaling'], help = 'native draws at the window size, sdl draws small and lets SDL stretch it')
+	parser.add_argument('--fullscreen', action = 'store_true', help = 'fill the screen at its own resolution')
+	parser.add_argument('--no-ghost', action = 'store_true', help = 'do not show where the stone will land')
+	parser.add_argument('--practice', action = 'store_true', help = 'backspace takes back stones, games are not scored or recorded')
+	parser.add_argument('--board', metavar = 'COLSxROWS', help = 'play on a board of another size, like 100x200')
+	parser.add_argument('--broadcast', metavar = 'HOST[:PORT]', help = 'stream your games to a relay started with broadcast.py relay, - for stdout')
+	parser.add_argument('--connect', metavar = 'HOST[:PORT]', help = 'play a versus game on a server started with versus.py serve')
+	args = parser.parse_args()
+	config['load_times'] = args.load_times
+	config['seed'] = args.seed
+	config['randomizer'] = 'bag' if args.bag else 'uniform'
+	config['record'] = args.record
+	config['profile'] = args.profile
+	config['maxfps'] = args.fps
+	config['tick_rate'] = args.tick_rate
+	config['low_latency'] = args.low_latency
+	config['audio_buffer'] = args.audio_buffer
+	config['scores'] = args.scores
+	config['scaling'] = args.scaling
+	config['fullscreen'] = args.fullscreen
+	config['ghost'] = not args.no_ghost
+	config['practice'] = args.practice
+	config['player'] = args.player
+	config['broadcast'] = args.broadcast
+	client = None
+	if args.connect:
+		import versus
+		host, port = (args.connect.split(':') + [versus.PORT])[:2]
+		client = versus.threadedClient()
+		print('waiting for an opponent on', args.connect)
+		try:
+			client.start(host, int(port))
+		except (OSError, EOFError) as e: # EOFError: the server hung up before the match started
+			print('could not connect to {}: {}'.format(args.connect, e))
+			sys.exit(1)
+	rules = None
+	if args.board:
+		cols, rows = args.board.lower().split('x')
+		rules = gameRules(int(cols), int(rows))
+		if args.broadcast and client == None:
+			import broadcast
+			if rules.cols * rules.rows > broadcast.MAX_CELLS:
+				parser.error('--broadcast needs a board of at most {} cells, {} has {}'.format(broadcast.MAX_CELLS, args.board, rules.cols * rules.rows))
+	App = tetrisApp(replay.load(args.replay) if args.replay else None, args.speed,
+		placementAI(depth = args.demo_depth) if args.demo else None, client = client, rules = rules)
 	App.run()
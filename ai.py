@@ -0,0 +1,380 @@
+# Placement search computer player, for the demo/attract mode (Tetris.py --demo), bot tournaments and analysing games.
+# For the current stone it finds every spot it can end up in by searching the moves the engine allows (left, right,
+# drop, insta fall and all four turns, flips included, with the same wall kicks as tetrisEngine.rotate_stone), so
+# tucks and spins under overhangs are found as well as straight drops. Each spot is scored with a weighted sum of
+# board features:
+#	lines		rows cleared by the placement
+#	height		sum of the column heights
+#	holes		empty cells with a filled cell somewhere above them
+#	bumpiness	sum of the height differences between neighbouring columns
+# With depth 2 the next stone is placed on every candidate board too, deeper than that every stone is tried and
+# averaged since they are not known yet. Only the beam best candidates of a level are searched further down.
+# Searches are memoised in an LRU cache keyed on the board's rows and the stones still to place, which is bounded to
+# cache_size entries so it can stay around for a whole session.
+#	python ai.py play --games 5 --depth 2		play headless games and report score and time per stone, up to
+#							--max-pieces (10000) stones each
+#	python ai.py analyze game.tfr			rank each placement in a replay against the AI's choice
+import argparse
+import sys
+import time
+from collections import OrderedDict
+from engine import tetrisEngine, LEFT, RIGHT, DROP, INSTA_FALL, ROTATE_CW, ROTATE_CCW, HFLIP, VFLIP
+from bitboard import bitBoard, piece_masks, PAD, TOP
+
+DEFAULT_WEIGHTS = {
+	'lines':	0.76,
+	'height':	-0.51,
+	'holes':	-0.36,
+	'bumpiness':	-0.18,
+}
+LOSS = -1e9 # the value of a placement that ends the game
+TURN_ACTIONS = (ROTATE_CW, ROTATE_CCW, HFLIP, VFLIP)
+
+class searchBoard(bitBoard):
+	# A bitBoard without the colours, cheap to copy so placements can be tried out.
+	@classmethod
+	def from_board(cls, board):
+		new = cls.__new__(cls)
+		new.rules = board.rules
+		new.masks = piece_masks(board.rules.orientations)
+		new.cols = board.cols
+		new.height = board.height
+		new.top = board.top
+		new.changes = None
+		new.walls = ((1 << PAD) - 1) | (((1 << PAD) - 1) << (new.cols + PAD))
+		new.full = new.solid = (1 << (new.cols + 2 * PAD)) - 1
+		if isinstance(board, bitBoard):
+			new.rows = board.rows[:]
+		else:
+			new.rows = [new.walls] * TOP
+			for row in board.matrix[:board.height]:
+				new.rows.append(new.walls | sum(1 << (cx + PAD) for cx, val in enumerate(row) if val))
+			new.rows += [new.solid] * TOP
+		return new
+
+	def copy(self):
+		new = searchBoard.__new__(searchBoard)
+		new.__dict__.update(self.__dict__)
+		new.rows = self.rows[:]
+		return new
+
+	def place(self, stone_id, orientation, x, y):
+		# The board after the stone sets at (x, y): (new board, rows cleared, False if part of it is above the board).
+		board = self.copy()
+		rows = board.rows
+		inside = True
+		for cy, mask in self.masks[stone_id][orientation]:
+			if y + cy < 0:
+				inside = False
+			else:
+				rows[y + cy + TOP] |= mask << (x + PAD)
+		top = max(y, 0)
+		lines, prevy = board.clear_lines(range(top, min(y + len(self.rules.orientations[stone_id][orientation]), board.height)))
+		return board, lines, inside
+
+	def clear_lines(self, rows):
+		full = [y for y in rows if self.rows[y + TOP] == self.full]
+		if full:
+			kept = [y for y in range(self.height) if y not in full]
+			self.rows[TOP:TOP + self.height] = [self.walls] * len(full) + [self.rows[y + TOP] for y in kept]
+		return len(full), full[0] if full else 0
+
+	def features(self):
+		# (height, holes, bumpiness) of the board.
+		cols = self.cols
+		height = self.height
+		colmask = (1 << cols) - 1
+		heights = [0] * cols
+		seen = 0
+		holes = 0
+		for y in range(height):
+			row = (self.rows[y + TOP] >> PAD) & colmask
+			new = row & ~seen
+			while new:
+				bit = new & -new
+				heights[bit.bit_length() - 1] = height - y
+				new ^= bit
+			seen |= row
+			holes += bin(seen & ~row).count('1')
+		bumpiness = sum(abs(heights[i] - heights[i + 1]) for i in range(cols - 1))
+		return sum(heights), holes, bumpiness
+
+def spawn_state(board, stone_id):
+	# Where tetrisEngine.new_stone puts a stone: (orientation, x, y).
+	return board.rules.spawn(stone_id)
+
+def reachable(board, stone_id, start, paths = False):
+	# Every place the stone can set from start = (orientation, x, y), as a list of (orientation, x, y, path).
+	# path is the list of (orientation, x, y, action) steps that gets there, ending with the DROP that locks it, or
+	# None unless paths is True. A search over the same moves tetrisEngine allows, with the same collision tests.
+	collides = board.collides
+	pieces = [board.piece(stone_id, o) for o in range(len(board.rules.orientations[stone_id]))]
+	turns = board.rules.turns[stone_id]
+	if collides(pieces[start[0]], start[1], start[2]):
+		return []
+	# Rows above the stack (and below the top of the board, where collision_point wraps around) all behave the same,
+	# anything a stone can do in one of them it can do in the lowest, so the search falls straight to that one.
+	stack_top = board.height
+	for y in range(board.height):
+		if board.rows[y + TOP] != board.walls:
+			stack_top = y
+			break
+	open_bottom = stack_top - 4
+	lands = {} # state: the row an insta fall from it ends on
+	parents = {start: None}
+	queue = [start]
+	finals = []
+	for state in queue:
+		o, x, y = state
+		piece = pieces[o]
+		moves = []
+		if collides(piece, x, y + 1):
+			finals.append(state)
+		else:
+			# Where an insta fall ends, shared by every state above it in this column
+			fall = [state]
+			land = y + 1
+			while (o, x, land) not in lands and not collides(piece, x, land + 1):
+				fall.append((o, x, land))
+				land += 1
+			land = lands.get((o, x, land), land)
+			for above in fall:
+				lands[above] = land
+			moves.append(((o, x, land), INSTA_FALL))
+			if 0 <= y < open_bottom:
+				moves.append(((o, x, open_bottom), DROP))
+			else:
+				moves.append(((o, x, y + 1), DROP))
+		if not collides(piece, x - 1, y):
+			moves.append(((o, x - 1, y), LEFT))
+		if not collides(piece, x + 1, y):
+			moves.append(((o, x + 1, y), RIGHT))
+		for turn in range(4):
+			new_o = turns[o][turn]
+			new_piece = pieces[new_o]
+			if not collides(new_piece, x, y):
+				moves.append(((new_o, x, y), TURN_ACTIONS[turn]))
+			else: # the wall kicks in rotate_stone
+				side = board.collision_point(new_piece, x, y)[0]
+				if side == 2 and not collides(new_piece, x - 1, y):
+					moves.append(((new_o, x - 1, y), TURN_ACTIONS[turn]))
+				elif side == 0 and not collides(new_piece, x + 1, y):
+					moves.append(((new_o, x + 1, y), TURN_ACTIONS[turn]))
+		for new_state, action in moves:
+			if new_state not in parents:
+				parents[new_state] = (state, action)
+				queue.append(new_state)
+	results = []
+	for state in finals:
+		path = None
+		if paths:
+			path = [state + (DROP,)]
+			parent = parents[state]
+			while parent != None:
+				(o, x, y), action = parent
+				if action == DROP: # one step per row for the jumps through open air
+					path += [(o, x, drop_y, DROP) for drop_y in range(path[-1][2] - 1, y, -1)]
+				path.append((o, x, y, action))
+				parent = parents[parent[0]]
+			path.reverse()
+		results.append(state + (path,))
+	return results
+
+class lruCache(object):
+	# A dict that forgets the least recently used entry once it has more than max_entries.
+	def __init__(self, max_entries):
+		self.max_entries = max_entries
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key):
+		value = self.entries.get(key)
+		if value == None:
+			self.misses += 1
+		else:
+			self.hits += 1
+			self.entries.move_to_end(key)
+		return value
+
+	def put(self, key, value):
+		self.entries[key] = value
+		if len(self.entries) > self.max_entries:
+			self.entries.popitem(last = False)
+
+class placementAI(object):
+	def __init__(self, weights = None, depth = 2, beam = 6, cache_size = 50000):
+		self.weights = dict(DEFAULT_WEIGHTS)
+		self.weights.update(weights or {})
+		self.depth = depth
+		self.beam = beam
+		self.cache = lruCache(cache_size)
+		self.plan = []
+		self.plan_piece = None
+
+	def static(self, board):
+		height, holes, bumpiness = board.features()
+		w = self.weights
+		return w['height'] * height + w['holes'] * holes + w['bumpiness'] * bumpiness
+
+	def placements(self, board, stone_id):
+		# Where a fresh stone can set, (orientation, x, y) with the unique resulting boards only, cached.
+		key = ('places', tuple(board.rows), stone_id)
+		places = self.cache.get(key)
+		if places == None:
+			places = []
+			seen = set()
+			for o, x, y, path in reachable(board, stone_id, spawn_state(board, stone_id)):
+				new_board, lines, inside = board.place(stone_id, o, x, y)
+				result = tuple(new_board.rows)
+				if result not in seen:
+					seen.add(result)
+					places.append((o, x, y))
+			self.cache.put(key, places)
+		return places
+
+	def candidates(self, board, stone_id, places):
+		# (immediate score, new board or None if it ends the game, place) best first.
+		scored = []
+		for place in places:
+			new_board, lines, inside = board.place(stone_id, *place[:3])
+			if not inside:
+				scored.append((LOSS, None, place))
+			else:
+				scored.append((self.weights['lines'] * lines + self.static(new_board), new_board, place))
+		scored.sort(key = lambda c: c[0], reverse = True)
+		return scored
+
+	def search(self, board, stones, depth):
+		# Best score over the next depth stones. stones are the ones known so far, the rest are averaged over.
+		if not stones:
+			stones = len(board.rules.orientations)
+			return sum(self.search(board, (stone_id,), depth) for stone_id in range(stones)) / stones
+		key = (tuple(board.rows), stones, depth)
+		value = self.cache.get(key)
+		if value != None:
+			return value
+		value = LOSS
+		for score, new_board, place in self.candidates(board, stones[0], self.placements(board, stones[0]))[:self.beam]:
+			if new_board != None and depth > 1:
+				score += self.search(new_board, stones[1:], depth - 1) - self.static(new_board)
+			value = max(value, score)
+		self.cache.put(key, value)
+		return value
+
+	def rank(self, engine):
+		# Every distinct place the engine's current stone can set from where it is now, best first, as
+		# (score, orientation, x, y, path). Like further down only the beam best are looked ahead from, they come
+		# first and the rest follow with just their own score.
+		board = searchBoard.from_board(engine.board)
+		stones = (engine.stone_id, engine.next_id)
+		finals = reachable(board, engine.stone_id, (engine.orientation, engine.stone_x, engine.stone_y), True)
+		searched = []
+		rest = []
+		seen = set()
+		for score, new_board, place in self.candidates(board, engine.stone_id, finals):
+			if new_board != None:
+				result = tuple(new_board.rows)
+				if result in seen:
+					continue
+				seen.add(result)
+				if self.depth > 1 and len(searched) < self.beam:
+					score += self.search(new_board, stones[1:], self.depth - 1) - self.static(new_board)
+					searched.append((score,) + place)
+					continue
+			rest.append((score,) + place)
+		searched.sort(key = lambda r: r[0], reverse = True)
+		return searched + rest
+
+	def best(self, engine):
+		# The actions that put the current stone in the best place, [] if it cannot move.
+		ranked = self.rank(engine)
+		if not ranked:
+			return []
+		return [step[3] for step in ranked[0][4]]
+
+	def next_action(self, engine):
+		# One action at a time for playing live: keeps following the plan for this stone while the stone is where the
+		# plan expects it and plans again if something else (gravity) moved it.
+		state = (engine.orientation, engine.stone_x, engine.stone_y)
+		if self.plan_piece != engine.pieces or not self.plan or self.plan[0][:3] != state:
+			self.plan_piece = engine.pieces
+			ranked = self.rank(engine)
+			self.plan = list(ranked[0][4]) if ranked else []
+		if not self.plan:
+			return DROP
+		return self.plan.pop(0)[3]
+
+	def play(self, engine):
+		# Places one stone, for bots.py and tournament.py.
+		for action in self.best(engine) or [DROP]:
+			engine.step(action)
+
+def play_games(games, depth, beam, seed, max_pieces = 10000):
+	ai = placementAI(depth = depth, beam = beam)
+	for game in range(games):
+		engine = tetrisEngine(0, seed + game, 'uniform', bitBoard)
+		start = time.perf_counter()
+		while not engine.gameover and engine.pieces < max_pieces:
+			ai.play(engine)
+			engine.events = []
+		seconds = time.perf_counter() - start
+		print('seed {}: score {} lines {} level {} pieces {} flips {}, {:.1f} ms per stone'.format(seed + game,
+			engine.score, engine.total_lines, engine.level, engine.pieces, engine.flips, seconds * 1000 / engine.pieces))
+	cache = ai.cache
+	print('cache: {} entries, {:.0%} hits'.format(len(cache.entries), cache.hits / float(max(1, cache.hits + cache.misses))))
+
+def analyze(filename, depth, beam):
+	# Plays the replay back and, for every stone, finds where the player put it among the AI's ranking.
+	from replay import replay
+	r = replay.load(filename)
+	engine = r.new_engine(bitBoard)
+	ai = placementAI(depth = depth, beam = beam)
+	ranked = ai.rank(engine)
+	board = searchBoard.from_board(engine.board)
+	best_moves = 0
+	stones = 0
+	lost = 0.0
+	for frame, action in r.actions:
+		stone_id, state = engine.stone_id, (engine.orientation, engine.stone_x, engine.stone_y)
+		pieces = engine.pieces
+		engine.step(action)
+		engine.events = []
+		if engine.pieces != pieces: # it set
+			result = tuple(board.place(stone_id, *state)[0].rows)
+			scores = [rank[0] for rank in ranked if tuple(board.place(stone_id, *rank[1:4])[0].rows) == result]
+			if ranked and scores:
+				stones += 1
+				place = [rank[0] for rank in ranked].index(scores[0]) + 1
+				best_moves += place == 1
+				if scores[0] <= LOSS:
+					print('stone {:4}: placed {:3} of {:3}, ends the game'.format(stones, place, len(ranked)))
+				else:
+					lost += ranked[0][0] - scores[0]
+					print('stone {:4}: placed {:3} of {:3}, {:8.2f} behind the best'.format(stones, place, len(ranked), ranked[0][0] - scores[0]))
+			if engine.gameover:
+				break
+			ranked = ai.rank(engine)
+			board = searchBoard.from_board(engine.board)
+	if stones:
+		print('{} stones, {:.0%} in the AI\'s best spot, {:.2f} behind on average'.format(stones, best_moves / float(stones), lost / stones))
+
+def main():
+	parser = argparse.ArgumentParser(description = 'Tetris Flip placement search AI')
+	parser.add_argument('command', choices = ['play', 'analyze'])
+	parser.add_argument('replays', nargs = '*', help = '.tfr files to analyze')
+	parser.add_argument('--games', type = int, default = 1)
+	parser.add_argument('--seed', type = int, default = 0)
+	parser.add_argument('--depth', type = int, default = 2)
+	parser.add_argument('--beam', type = int, default = 6)
+	parser.add_argument('--max-pieces', type = int, default = 10000, help = 'stop a game after this many stones')
+	args = parser.parse_args()
+	if args.command == 'play':
+		play_games(args.games, args.depth, args.beam, args.seed, args.max_pieces)
+	else:
+		for filename in args.replays:
+			analyze(filename, args.depth, args.beam)
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
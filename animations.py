@@ -0,0 +1,97 @@
+# Line clear animations for tetrisApp.
+# An animation is just some state and a start time. The main loop calls update(now) and draw() once per frame like
+# everything else, so the game keeps running and reading the controls while one plays. The surfaces they draw on come
+# from a pool and go back to it when the animation ends, so a clear does not allocate anything once the pool is warm.
+import random
+import pygame as pg
+
+# Colour indexes (into Tetris.COLORS) the cleared rows are filled with, by number of rows. A tetris gets every colour.
+CLEAR_COLORS = {
+	1:	(10,),
+	2:	(2, 10),
+	3:	(5, 2, 10),
+}
+STEP_MS = 1000 / 30.0 # one column on each side every step, the speed the old tetris animation ran at
+
+class surfacePool(object):
+	def __init__(self):
+		self.free = {} # size: surfaces not in use
+
+	def get(self, size):
+		surfaces = self.free.get(size)
+		if surfaces:
+			return surfaces.pop()
+		return pg.Surface(size)
+
+	def put(self, surface):
+		self.free.setdefault(surface.get_size(), []).append(surface)
+
+class clearAnimation(object):
+	# Fills the cleared rows with colours from the middle out, one column on each side every STEP_MS. rows are the
+	# board rows that were cleared, top one first, they need not be next to each other.
+	def __init__(self, rows, cols, colors, start, surface):
+		self.rows = rows
+		self.cols = cols
+		self.colors = colors
+		self.start = start
+		self.surface = surface
+		self.matrix = [[0] * cols for y in rows]
+		self.steps = 0
+		self.changed = True
+
+	def update(self, now):
+		# Returns False once it has finished.
+		# On an odd width the right half has the extra column, so the last step has nothing left on the left.
+		last = (self.cols + 1) // 2
+		steps = min(int((now - self.start) / STEP_MS) + 1, last)
+		middle = self.cols // 2
+		while self.steps < steps:
+			left = middle - self.steps - 1
+			for row in self.matrix:
+				row[middle + self.steps] = random.choice(self.colors)
+				if left >= 0:
+					row[left] = random.choice(self.colors)
+			self.steps += 1
+			self.changed = True
+		return now - self.start < last * STEP_MS
+
+	def draw(self, target, atlas, x, y):
+		# The surface holds the rows one under the other, each is put where its board row is. Returns the rects.
+		if self.changed:
+			self.changed = False
+			self.surface.fill((0, 0, 0))
+			atlas.draw_matrix(self.surface, self.matrix, 0, 0)
+		cell_size = atlas.cell_size
+		width = self.surface.get_width()
+		return [target.blit(self.surface, (x, y + row * cell_size), pg.Rect(0, i * cell_size, width, cell_size))
+			for i, row in enumerate(self.rows)]
+
+class animationPlayer(object):
+	def __init__(self, cols, colors):
+		self.cols = cols
+		self.colors = colors # how many colours there are, colour 0 is the background
+		self.pool = surfacePool()
+		self.active = []
+
+	def clear_lines(self, rows, now, cell_size):
+		# rows: the board rows that were cleared, the engine's ('lines', ...) event has them.
+		colors = CLEAR_COLORS.get(len(rows)) or range(1, self.colors)
+		surface = self.pool.get((self.cols * cell_size, len(rows) * cell_size))
+		self.active.append(clearAnimation(rows, self.cols, colors, now, surface))
+
+	def update(self, now):
+		# Returns the animations that finished, the board rows under them have to be drawn again.
+		finished = [animation for animation in self.active if not animation.update(now)]
+		for animation in finished:
+			self.active.remove(animation)
+			self.pool.put(animation.surface)
+		return finished
+
+	def draw(self, target, atlas, x, y):
+		# Draws every running animation onto target with the board's top left corner at (x, y), returns the rects.
+		return [rect for animation in self.active for rect in animation.draw(target, atlas, x, y)]
+
+	def stop(self):
+		for animation in self.active:
+			self.pool.put(animation.surface)
+		self.active = []
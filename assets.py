@@ -0,0 +1,82 @@
+# Sound and music loading for tetrisApp.
+# The sound effects are loaded on a background thread so the title screen can be drawn straight away, and the next
+# song is read into memory ahead of time so changing music at a level up does not wait on the disk.
+# How long each load took is kept in self.timings (in ms) and report() formats it.
+import io
+import threading
+import time
+from os import path, listdir
+import pygame as pg
+
+class assetManager(object):
+	def __init__(self, snd_folder, music_folder, effects):
+		self.snd_folder = snd_folder
+		self.music_folder = music_folder
+		self.effects = effects
+		self.sounds = {}
+		self.music_list = []
+		self.prefetched = {} # song index: the file's bytes
+		self.timings = {}
+		self.lock = threading.Lock()
+		self.started = time.perf_counter()
+		self.loader = threading.Thread(target = self.load, daemon = True)
+		self.loader.start()
+
+	def load(self):
+		start = time.perf_counter()
+		number_of_files = len([name for name in listdir(self.music_folder) if path.isfile(path.join(self.music_folder, name))])
+		for i in range(0, number_of_files):
+			filename = 'music{}.ogg'.format(i)
+			self.music_list.append(path.join(self.music_folder, filename))
+		for key in self.effects:
+			sound_start = time.perf_counter()
+			self.sounds[key] = pg.mixer.Sound(path.join(self.snd_folder, self.effects[key]))
+			self.timings['sound ' + key] = (time.perf_counter() - sound_start) * 1000
+		self.timings['all sounds'] = (time.perf_counter() - start) * 1000
+		if self.music_list:
+			self.read_song(0)
+
+	def wait(self):
+		# Blocks until the background load is done, only needed before the first song is played.
+		self.loader.join()
+
+	def sound(self, name):
+		# The sound if it has loaded yet, otherwise None.
+		return self.sounds.get(name)
+
+	def read_song(self, index):
+		start = time.perf_counter()
+		with open(self.music_list[index], 'rb') as f:
+			data = f.read()
+		with self.lock:
+			self.prefetched[index] = data
+		self.timings['read music{}'.format(index)] = (time.perf_counter() - start) * 1000
+
+	def prefetch(self, index):
+		# Reads song index into memory on another thread so play_music(index) does not touch the disk.
+		if index not in self.prefetched:
+			threading.Thread(target = self.read_song, args = (index,), daemon = True).start()
+
+	def play_music(self, index):
+		self.wait()
+		start = time.perf_counter()
+		with self.lock:
+			data = self.prefetched.get(index)
+		if data != None:
+			pg.mixer.music.load(io.BytesIO(data), 'ogg')
+		else:
+			pg.mixer.music.load(self.music_list[index])
+		pg.mixer.music.play(loops=-1)
+		self.timings['start music{}'.format(index)] = (time.perf_counter() - start) * 1000
+		with self.lock: # only keep the song that is playing and the next one in memory
+			for old in [i for i in self.prefetched if i != index]:
+				del self.prefetched[old]
+		self.prefetch((index + 1) % len(self.music_list))
+
+	def mark(self, name):
+		# Records how long after startup something happened, like the first title frame.
+		if name not in self.timings:
+			self.timings[name] = (time.perf_counter() - self.started) * 1000
+
+	def report(self):
+		return '\n'.join('{:<24}{:8.1f} ms'.format(name, ms) for name, ms in self.timings.items())
@@ -0,0 +1,168 @@
+# Sound effect mixing for tetrisApp.
+# Effects used to go to two fixed channels, so every key repeat cut off whatever was playing there, a line clear could
+# cut off the level up and the mixer ran with a 2048 sample buffer (46 ms at 44.1 kHz before a sound is even heard).
+# audioMixer plays them on a pool of voices instead:
+#	a free voice is used if there is one, otherwise the lowest priority voice that is playing (the oldest of those) is
+#	taken over, if they are all more important than the new sound it is not played
+#	an effect plays on at most its own number of voices at once, past that it restarts its oldest one
+#	an effect triggered again less than its gap after the last time is skipped, so holding a key does not machine gun
+# config['audio_buffer'] sets the mixer's buffer. latency() measures how long a sound really takes to start:
+#	python audio.py latency --buffer 256 512 1024 2048
+#	python audio.py stress		rotates every 25 ms with locks and clears, shows what was played, skipped and taken over
+import argparse
+import sys
+import time
+from os import path
+import pygame as pg
+
+FREQUENCY = 44100
+VOICES = 8
+# name: (priority, gap in ms, voices), effects not in here get DEFAULT_RULE
+EFFECT_RULES = {
+	'rotate':	(1, 40, 1),
+	'set':		(2, 30, 2),
+	'line':		(3, 0, 2),
+	'double':	(3, 0, 2),
+	'tripple':	(3, 0, 2),
+	'tetris':	(4, 0, 2),
+	'levelup':	(5, 0, 1),
+}
+DEFAULT_RULE = (1, 0, 2)
+
+def init_mixer(buffer = 512, frequency = FREQUENCY):
+	# Has to run before pg.init(). Stereo output, the voices are mixing channels not speakers.
+	pg.mixer.pre_init(frequency, -16, 2, buffer)
+
+class audioMixer(object):
+	# sounds is anything with sound(name) returning a pg.mixer.Sound or None while it is loading (an assetManager).
+	def __init__(self, sounds, voices = VOICES, rules = EFFECT_RULES):
+		self.sounds = sounds
+		self.rules = rules
+		pg.mixer.set_num_channels(max(voices, pg.mixer.get_num_channels()))
+		self.channels = [pg.mixer.Channel(i) for i in range(voices)]
+		self.playing = [None] * voices # (name, priority, started) of what was last started on each voice
+		self.last = {} # name: when it was last played
+		self.counts = {'played': 0, 'skipped': 0, 'taken over': 0, 'not played': 0}
+
+	def play(self, name, now = None):
+		# Returns True if the sound was started. now is in seconds, time.perf_counter() if not given.
+		sound = self.sounds.sound(name)
+		if sound == None: # still loading
+			return False
+		if now == None:
+			now = time.perf_counter()
+		priority, gap, voices = self.rules.get(name, DEFAULT_RULE)
+		last = self.last.get(name)
+		if last != None and (now - last) * 1000 < gap:
+			self.counts['skipped'] += 1
+			return False
+		voice = self.pick_voice(name, priority, voices)
+		if voice == None:
+			self.counts['not played'] += 1
+			return False
+		if self.channels[voice].get_busy():
+			self.counts['taken over'] += 1
+		self.channels[voice].play(sound)
+		self.playing[voice] = (name, priority, now)
+		self.last[name] = now
+		self.counts['played'] += 1
+		return True
+
+	def pick_voice(self, name, priority, voices):
+		# A voice something else started playing on (another tetrisApp, pg.mixer.Channel(i).play) counts as priority
+		# -1, so it can always be taken over.
+		playing = [voice if voice != None else (None, -1, 0) for voice in self.playing]
+		busy = [i for i, channel in enumerate(self.channels) if channel.get_busy()]
+		same = [i for i in busy if playing[i][0] == name] # never one of those
+		if len(same) >= voices:
+			return min(same, key = lambda i: playing[i][2])
+		for i, channel in enumerate(self.channels):
+			if i not in busy:
+				return i
+		weaker = [i for i in busy if playing[i][1] <= priority]
+		if not weaker:
+			return None
+		return min(weaker, key = lambda i: playing[i][1:])
+
+	def stop(self):
+		for channel in self.channels:
+			channel.stop()
+
+	def report(self):
+		return ', '.join('{} {}'.format(name, count) for name, count in self.counts.items())
+
+def latency(count = 20, channel = VOICES):
+	# Plays a 1 ms click count times on a free channel and times how long until the mixer has played it through. That
+	# is the wait for the mixer to pick the sound up (up to one buffer) plus the click, the buffer it was mixed into
+	# then still has to play out of the sound card, so that buffer's length is added on.
+	# Returns (pick up ms, buffer ms, total ms), averages. Needs pg.mixer initialised, the buffer is worked out from the
+	# pick up times because pygame does not say which size SDL really gave it. channel is the mixer channel to click on,
+	# by default the first one past an audioMixer's voices so it does not play over the game's sounds.
+	frequency, size, outputs = pg.mixer.get_init()
+	frames = max(1, frequency // 1000)
+	click = pg.mixer.Sound(buffer = bytes(frames * outputs * abs(size) // 8))
+	pg.mixer.set_num_channels(max(channel + 1, pg.mixer.get_num_channels()))
+	channel = pg.mixer.Channel(channel)
+	click_ms = frames * 1000.0 / frequency
+	times = []
+	for i in range(count):
+		time.sleep(0.003 * (i % 7)) # not always at the same point of the mixer's cycle
+		start = time.perf_counter()
+		channel.play(click)
+		while channel.get_busy():
+			time.sleep(0.0002)
+			if time.perf_counter() - start > 1:
+				return None # no audio device is mixing
+		times.append((time.perf_counter() - start) * 1000 - click_ms)
+	pickup = sum(times) / len(times)
+	buffer = max(times) # the worst wait is a whole buffer period
+	return pickup, buffer, pickup + buffer
+
+class fakeAssets(object):
+	def __init__(self, sounds):
+		self.sounds = sounds
+
+	def sound(self, name):
+		return self.sounds.get(name)
+
+def stress(seconds = 2.0, repeat_ms = 25):
+	# Key repeat rotating every repeat_ms, a lock every 10 of those and a clear every 40, in real time.
+	import Tetris
+	sounds = dict((name, pg.mixer.Sound(path.join(Tetris.snd_folder, filename))) for name, filename in Tetris.EFFECTS_SOUNDS.items())
+	mixer = audioMixer(fakeAssets(sounds))
+	start = time.perf_counter()
+	i = 0
+	while time.perf_counter() - start < seconds:
+		mixer.play('rotate')
+		if i % 10 == 9:
+			mixer.play('set')
+		if i % 40 == 39:
+			mixer.play(('line', 'double', 'tripple', 'tetris')[i // 40 % 4])
+		i += 1
+		time.sleep(repeat_ms / 1000.0)
+	mixer.stop()
+	return mixer.report()
+
+def main():
+	parser = argparse.ArgumentParser(description = 'Tetris Flip sound effect mixing')
+	parser.add_argument('command', choices = ['latency', 'stress'])
+	parser.add_argument('--buffer', type = int, nargs = '+', default = [512], help = 'mixer buffer sizes in samples')
+	parser.add_argument('--count', type = int, default = 20, help = 'clicks to time')
+	args = parser.parse_args()
+	for buffer in args.buffer:
+		init_mixer(buffer)
+		pg.mixer.init()
+		if args.command == 'latency':
+			result = latency(args.count)
+			if result == None:
+				print('buffer {}: the mixer is not running, is there a sound device?'.format(buffer))
+			else:
+				print('buffer {:5} ({:.1f} ms): picked up after {:.1f} ms, buffer {:.1f} ms, about {:.1f} ms to the speakers'.format(
+					buffer, buffer * 1000.0 / FREQUENCY, *result))
+		else:
+			print('buffer {}: {}'.format(buffer, stress()))
+		pg.mixer.quit()
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,174 @@
+# Runs many games at once with NumPy, for training placement bots against this game's rules.
+# All N boards live in one (N, rows, cols) uint8 array of colour values, and collision, locking, line clears, scoring
+# and levelling are done for the whole batch with array operations instead of one tetrisEngine at a time.
+#
+# It is placement based: an action picks where the current stone ends up, as an index into PLACEMENTS[stone_id],
+# a list of (orientation, x) covering every orientation of the rules' stones (flips included) at every column it
+# fits. The stone is then dropped straight down and locked, like holding space and then letting it set.
+# LEGAL[stone_id] says which indexes are real placements for that stone, legal_actions() gives it per board.
+# The board size, stones, spawn row, scoring, bonus lines for doubles and up, lines per level and the game over rules
+# are the same as tetrisEngine's, from an engine.gameRules (the normal game if none is given).
+#
+#	env = batchEngine(4096, seed = 1)
+#	env = batchEngine(4096, seed = 1, rules = gameRules(cols = 20, rows = 40))
+#	obs = env.reset()
+#	obs, reward, done, info = env.step(actions)
+#
+# obs is env.cells itself, not a copy, so it changes with the next step. Finished boards are reset straight away
+# (their final score is in info['final_score']) so every step gets a full batch of live games.
+import numpy as np
+from engine import gameRules
+
+def stone_tables(rules):
+	# Cell coordinates of every orientation plus the placement tables described above. A stone with fewer cells than
+	# the biggest one repeats its last cell, which changes nothing when it is dropped or locked.
+	orientations = rules.orientations
+	cols = rules.cols
+	stones = len(orientations)
+	most = max(len(shapes) for shapes in orientations)
+	most_cells = max(sum(1 for row in shape for val in row if val) for shapes in orientations for shape in shapes)
+	cell_y = np.zeros((stones, most, most_cells), dtype = np.int64)
+	cell_x = np.zeros((stones, most, most_cells), dtype = np.int64)
+	values = np.zeros(stones, dtype = np.uint8)
+	spawn_x = np.zeros(stones, dtype = np.int64)
+	placements = []
+	for stone_id, shapes in enumerate(orientations):
+		spawn_x[stone_id] = rules.spawn(stone_id)[1]
+		places = []
+		for orientation, shape in enumerate(shapes):
+			cells = [(cy, cx, val) for cy, row in enumerate(shape) for cx, val in enumerate(row) if val]
+			cells += cells[-1:] * (most_cells - len(cells))
+			for i, (cy, cx, val) in enumerate(cells):
+				cell_y[stone_id, orientation, i] = cy
+				cell_x[stone_id, orientation, i] = cx
+				values[stone_id] = val
+			left = min(cx for cy, cx, val in cells)
+			right = max(cx for cy, cx, val in cells)
+			places += [(orientation, x) for x in range(-left, cols - right)]
+		placements.append(places)
+	actions = max(len(places) for places in placements)
+	place_orientation = np.zeros((stones, actions), dtype = np.int64)
+	place_x = np.zeros((stones, actions), dtype = np.int64)
+	legal = np.zeros((stones, actions), dtype = bool)
+	for stone_id, places in enumerate(placements):
+		for i, (orientation, x) in enumerate(places):
+			place_orientation[stone_id, i] = orientation
+			place_x[stone_id, i] = x
+			legal[stone_id, i] = True
+	return cell_y, cell_x, values, spawn_x, placements, place_orientation, place_x, legal
+
+class batchEngine(object):
+	def __init__(self, n, seed = None, randomizer = 'uniform', start_level = 0, rules = None):
+		self.n = n
+		self.rules = rules if rules != None else gameRules()
+		self.cols = self.rules.cols
+		self.rows = self.rules.rows
+		self.kinds = len(self.rules.orientations)
+		# points and bonus lines by rows cleared, capped at the most the scoring table knows like gameRules.score()
+		most = self.rules.most_rows
+		self.scores = np.array([0] + [self.rules.line_scores[rows] for rows in range(1, most + 1)])
+		self.bonus_lines = np.array([0] + [self.rules.bonus_lines.get(rows, 0) for rows in range(1, most + 1)])
+		self.start_level = start_level
+		self.randomizer = randomizer
+		self.rng = np.random.default_rng(seed)
+		(self.cell_y, self.cell_x, self.values, self.spawn_x, self.placements,
+			self.place_orientation, self.place_x, self.legal) = stone_tables(self.rules)
+		self.actions = self.legal.shape[1]
+		self.cells = np.zeros((n, self.rows, self.cols), dtype = np.uint8)
+		self.stone = np.zeros(n, dtype = np.int64)
+		self.next_stone = np.zeros(n, dtype = np.int64)
+		self.score = np.zeros(n, dtype = np.int64)
+		self.level = np.zeros(n, dtype = np.int64)
+		self.lines = np.zeros(n, dtype = np.int64)
+		self.lines_required = np.zeros(n, dtype = np.int64)
+		self.pieces = np.zeros(n, dtype = np.int64)
+		self.bags = np.zeros((n, self.kinds), dtype = np.int64)
+		self.bag_pos = np.full(n, self.kinds, dtype = np.int64)
+		self.all = np.arange(n)
+
+	def draw(self, envs):
+		if self.randomizer == 'uniform':
+			return self.rng.integers(0, self.kinds, len(envs))
+		empty = envs[self.bag_pos[envs] >= self.kinds]
+		if len(empty):
+			self.bags[empty] = self.rng.permuted(np.tile(np.arange(self.kinds), (len(empty), 1)), axis = 1)
+			self.bag_pos[empty] = 0
+		stones = self.bags[envs, self.bag_pos[envs]]
+		self.bag_pos[envs] += 1
+		return stones
+
+	def reset(self, envs = None):
+		envs = self.all if envs is None else envs
+		self.cells[envs] = 0
+		self.score[envs] = 0
+		self.level[envs] = self.start_level
+		self.lines[envs] = 0
+		self.lines_required[envs] = self.rules.lines_required(self.start_level)
+		self.pieces[envs] = 1
+		self.bag_pos[envs] = self.kinds
+		self.stone[envs] = self.draw(envs)
+		self.next_stone[envs] = self.draw(envs)
+		return self.cells
+
+	def legal_actions(self):
+		# (N, actions) bool, which action indexes are placements for each board's current stone.
+		return self.legal[self.stone]
+
+	def column_tops(self):
+		# Row of the highest filled cell in each column, self.rows for empty columns.
+		filled = self.cells != 0
+		return np.where(filled.any(1), filled.argmax(1), self.rows)
+
+	def step(self, actions):
+		# actions: one placement index per board. An index that is not a placement for that stone ends its game.
+		actions = np.clip(np.asarray(actions, dtype = np.int64), 0, self.actions - 1)
+		stone = self.stone
+		legal = self.legal[stone, actions]
+		orientation = self.place_orientation[stone, actions]
+		cell_y = self.cell_y[stone, orientation]
+		cell_x = np.clip(self.cell_x[stone, orientation] + self.place_x[stone, actions][:, None], 0, self.cols - 1)
+
+		# Drop: the stone stops one row above the highest filled cell under any of its cells.
+		tops = np.take_along_axis(self.column_tops(), cell_x, 1)
+		land = (tops - cell_y).min(1) - 1
+		cell_y = cell_y + land[:, None]
+		on_board = legal[:, None] & (cell_y >= 0)
+		envs = np.broadcast_to(self.all[:, None], cell_y.shape)
+		self.cells[envs[on_board], cell_y[on_board], cell_x[on_board]] = np.broadcast_to(self.values[stone][:, None], cell_y.shape)[on_board]
+		gameover = ~legal | (land < 0) # like tetrisEngine, any of the stone's rows still above the board ends it
+
+		# The next stone spawns before the full rows go, so like tetrisEngine it is tested against the board as it is now.
+		next_stone = self.next_stone
+		spawn_y = self.cell_y[next_stone, 0] + self.rules.spawn_y
+		spawn_x = self.cell_x[next_stone, 0] + self.spawn_x[next_stone][:, None]
+		in_board = spawn_y >= 0
+		blocked = in_board & (self.cells[envs, np.maximum(spawn_y, 0), spawn_x] != 0)
+		gameover |= blocked.any(1)
+
+		full = (self.cells != 0).all(2)
+		cleared = full.sum(1)
+		clearing = np.nonzero(cleared)[0]
+		if len(clearing):
+			# Full rows sort to the top (keeping everything else in order) and are then emptied.
+			order = np.argsort(~full[clearing], axis = 1, kind = 'stable')
+			boards = np.take_along_axis(self.cells[clearing], order[:, :, None], axis = 1)
+			boards[np.arange(self.rows)[None, :] < cleared[clearing][:, None]] = 0
+			self.cells[clearing] = boards
+
+		counted = np.minimum(cleared, self.rules.most_rows)
+		reward = self.scores[counted] * (self.level + 1)
+		self.score += reward
+		self.lines += cleared + self.bonus_lines[counted]
+		level_up = self.lines >= self.lines_required
+		self.level += level_up
+		self.lines[level_up] = 0
+		self.lines_required = (self.level + 1) * self.rules.lines_per_level
+		self.pieces += 1
+
+		self.stone = next_stone
+		self.next_stone = self.draw(self.all)
+		info = {'cleared': cleared, 'final_score': np.where(gameover, self.score, 0)}
+		done = np.nonzero(gameover)[0]
+		if len(done):
+			self.reset(done)
+		return self.cells, reward, gameover, info
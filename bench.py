@@ -0,0 +1,257 @@
+# Benchmarks for the engine and the renderer's hot paths, runs without a screen or sound card (SDL dummy drivers).
+#	python bench.py --save			measure and store the numbers as the baseline (bench_baseline.json)
+#	python bench.py				measure and compare with the baseline, exits with 1 if anything got slower
+#	python bench.py --only draw --threshold 5
+# What is measured:
+#	engine.pieces/s		stones placed per second through tetrisEngine.step() with scripted moves
+#	collides/s		collision tests per second on random boards
+#	clear_lines/s		line clears per second (four full rows each)
+#	landing_y/s		where a stone dropped from the top of random boards lands, from the column index
+#	draw_matrix ms		drawing the locked cells, per board fill level and cell size
+#	draw ms / draw_dirty ms	a whole frame with render = 'full' and render = 'dirty' (the stone moving one cell)
+#	area ...		how those scale with the board size (AREAS) in a fixed AREA_WINDOW window: engine pieces/s, full and
+#				dirty frames, and lock ms, a dirty frame after a stone was set in the bottom rows
+# Each is run for a fixed number of repeats and the best one is kept, which is the least noisy on a busy machine.
+# Baselines belong to one machine, compare them on the hardware they were made on.
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from os import path
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+from engine import config, gameRules, tetrisEngine, listBoard, ORIENTATIONS, LEFT, RIGHT, DROP, INSTA_FALL, ROTATE_CW, HFLIP
+from bitboard import bitBoard
+
+BOARDS = {'list': listBoard, 'bit': bitBoard}
+FILLS = (0, 25, 50, 75) # percent of the rows with rubbish in them
+CELL_SIZES = (10, 20, 40)
+AREAS = ((10, 20), (20, 40), (50, 100), (100, 200)) # cols, rows
+AREA_WINDOW = (1280, 1024)
+REPEATS = 5
+
+def best_time(func, repeats = REPEATS):
+	# Fastest of repeats calls of func, in seconds.
+	best = None
+	for i in range(repeats):
+		start = time.perf_counter()
+		func()
+		took = time.perf_counter() - start
+		if best == None or took < best:
+			best = took
+	return best
+
+def random_board(board_class, fill, rng, rules = None):
+	# A board with the bottom fill% of rows randomly filled, one gap per row so none of them are full.
+	board = board_class(rules)
+	rows = board.height * fill // 100
+	for y in range(board.height - rows, board.height):
+		gap = rng.randrange(board.cols)
+		row = [[rng.randrange(1, 8) if x != gap and rng.random() < 0.8 else 0 for x in range(board.cols)]]
+		board.join(row, 0, y)
+	return board
+
+def bench_engine(board_class, pieces = 2000, rules = None):
+	rng = random.Random(1)
+	script = [(rng.randrange(3), rng.choice((ROTATE_CW, HFLIP)), rng.randrange(-4, 5)) for i in range(pieces)]
+	def run():
+		engine = tetrisEngine(0, 1, 'uniform', board_class, rules)
+		step = engine.step
+		for turns, turn, moves in script:
+			for i in range(turns):
+				step(turn)
+			for i in range(abs(moves)):
+				step(LEFT if moves < 0 else RIGHT)
+			step(INSTA_FALL)
+			step(DROP)
+			engine.events = []
+			if engine.gameover:
+				engine.init_game()
+	return pieces / best_time(run)
+
+def bench_collides(board_class, calls = 20000):
+	rng = random.Random(2)
+	boards = [random_board(board_class, fill, rng) for fill in FILLS]
+	tests = []
+	for i in range(calls):
+		board = rng.choice(boards)
+		stone_id = rng.randrange(len(ORIENTATIONS))
+		orientation = rng.randrange(len(ORIENTATIONS[stone_id]))
+		tests.append((board.collides, board.piece(stone_id, orientation), rng.randrange(-2, board.cols), rng.randrange(-3, board.height)))
+	def run():
+		for collides, piece, x, y in tests:
+			collides(piece, x, y)
+	return calls / best_time(run)
+
+def bench_landing(board_class, calls = 20000):
+	rng = random.Random(3)
+	boards = [random_board(board_class, fill, rng) for fill in FILLS]
+	tests = []
+	while len(tests) < calls:
+		board = rng.choice(boards)
+		stone_id = rng.randrange(len(ORIENTATIONS))
+		orientation = rng.randrange(len(ORIENTATIONS[stone_id]))
+		x = rng.randrange(-2, board.cols)
+		if not board.collides(board.piece(stone_id, orientation), x, -3):
+			tests.append((board.landing_y, stone_id, orientation, x))
+	def run():
+		for landing_y, stone_id, orientation, x in tests:
+			landing_y(stone_id, orientation, x, -3)
+	return calls / best_time(run)
+
+def bench_clear_lines(board_class, clears = 500):
+	def run():
+		board = board_class()
+		full = [[1] * board.cols]
+		for i in range(clears):
+			for y in range(board.height - 4, board.height):
+				board.join(full, 0, y)
+			board.clear_lines(range(board.height - 4, board.height))
+	return clears / best_time(run)
+
+def bench_draw(frames = 60):
+	# Returns {name: ms} for every fill level and cell size.
+	import pygame as pg
+	import Tetris
+	results = {}
+	cell_size = config['cell_size']
+	render = config['render']
+	pg.init()
+	for size in CELL_SIZES:
+		config['cell_size'] = size
+		pg.display.quit() # a new window for each size
+		app = Tetris.tetrisApp(show_title = False)
+		app.clock = pg.time.Clock()
+		rules = app.rules
+		pg.display.set_mode((rules.cols * size + Tetris.HUD_CELLS * size + 2, rules.rows * size + 2), app.flags) # whatever the desktop size
+		app.layout()
+		for fill in FILLS:
+			app.engine.init_game()
+			app.engine.board = random_board(bitBoard, fill, random.Random(fill))
+			matrix = app.engine.board.matrix[:-1]
+			label = '[cell {} fill {}%]'.format(size, fill)
+			results['draw_matrix ms' + label] = best_time(lambda: [app.draw_matrix(matrix, (0, 0)) for i in range(frames)]) * 1000 / frames
+			config['render'] = 'full'
+			results['draw ms' + label] = best_time(lambda: [app.render() for i in range(frames)]) * 1000 / frames
+			config['render'] = 'dirty'
+			app.redraw_all = True
+			app.render()
+			def dirty_frames():
+				for i in range(frames):
+					app.engine.stone_x = i % 2 + 3 # the stone moving back and forth
+					app.engine.stone_y = 5
+					app.render()
+			results['draw_dirty ms' + label] = best_time(dirty_frames) * 1000 / frames
+	config['cell_size'] = cell_size
+	config['render'] = render
+	return results
+
+def bench_areas(frames = 30):
+	# Returns {name: (value, unit, higher is better)} for every board size in AREAS, half filled, drawn in the same window.
+	import pygame as pg
+	import Tetris
+	results = {}
+	render = config['render']
+	pg.init()
+	for cols, rows in AREAS:
+		rules = gameRules(cols, rows)
+		label = '[area {}x{}]'.format(cols, rows)
+		results['area engine.pieces/s' + label] = (bench_engine(bitBoard, 500, rules), 'pieces/s', True)
+		pg.display.quit()
+		app = Tetris.tetrisApp(show_title = False, rules = rules)
+		app.clock = pg.time.Clock()
+		pg.display.set_mode(AREA_WINDOW, app.flags)
+		app.layout()
+		app.engine.init_game()
+		board = app.engine.board = random_board(bitBoard, 50, random.Random(cols), rules)
+		config['render'] = 'full'
+		results['area draw ms' + label] = (best_time(lambda: [app.render() for i in range(frames)]) * 1000 / frames, 'ms', False)
+		config['render'] = 'dirty'
+		app.redraw_all = True
+		app.render()
+		def dirty_frames():
+			for i in range(frames):
+				app.engine.stone_x = i % 2 + 3
+				app.engine.stone_y = 5
+				app.render()
+		results['area draw_dirty ms' + label] = (best_time(dirty_frames) * 1000 / frames, 'ms', False)
+		def lock_frames():
+			for i in range(frames):
+				board.changed(rows - 4, rows) # what join() marks when a stone lands on the floor
+				app.render()
+		results['area lock ms' + label] = (best_time(lock_frames) * 1000 / frames, 'ms', False)
+	config['render'] = render
+	return results
+
+def measure(only = None):
+	# {name: (value, unit, higher is better)}
+	results = {}
+	def want(name):
+		return only == None or only in name
+	for name, board_class in BOARDS.items():
+		if want('engine'):
+			results['engine.pieces/s[{}]'.format(name)] = (bench_engine(board_class), 'pieces/s', True)
+		if want('collides'):
+			results['collides/s[{}]'.format(name)] = (bench_collides(board_class), 'calls/s', True)
+		if want('landing_y'):
+			results['landing_y/s[{}]'.format(name)] = (bench_landing(board_class), 'calls/s', True)
+		if want('clear_lines'):
+			results['clear_lines/s[{}]'.format(name)] = (bench_clear_lines(board_class), 'clears/s', True)
+	if only == None or 'draw' in only:
+		for name, ms in bench_draw().items():
+			if want(name):
+				results[name] = (ms, 'ms', False)
+	if only == None or 'area' in only:
+		for name, result in bench_areas().items():
+			if want(name):
+				results[name] = result
+	return results
+
+def compare(results, baseline, threshold):
+	# Prints every result next to its baseline and returns the names that are more than threshold% worse.
+	slower = []
+	for name, (value, unit, higher) in sorted(results.items()):
+		line = '{:<40}{:14.3f} {:<9}'.format(name, value, unit)
+		base = baseline.get(name)
+		if base != None:
+			change = (value - base['value']) / base['value'] * 100
+			worse = -change if higher else change
+			line += '{:+8.1f}%'.format(change)
+			if worse > threshold:
+				slower.append(name)
+				line += '  SLOWER'
+		print(line)
+	return slower
+
+def main():
+	parser = argparse.ArgumentParser(description = 'Tetris Flip benchmarks')
+	parser.add_argument('--baseline', default = path.join(path.dirname(path.abspath(__file__)), 'bench_baseline.json'))
+	parser.add_argument('--save', action = 'store_true', help = 'store the results as the new baseline')
+	parser.add_argument('--threshold', type = float, default = 10, help = 'percent worse than the baseline that counts as a regression')
+	parser.add_argument('--only', help = 'only run benchmarks with this in their name')
+	args = parser.parse_args()
+
+	results = measure(args.only)
+	baseline = {}
+	if path.isfile(args.baseline):
+		with open(args.baseline) as f:
+			baseline = json.load(f)
+	slower = compare(results, baseline, args.threshold)
+	if args.save:
+		baseline.update((name, {'value': value, 'unit': unit, 'higher_is_better': higher})
+			for name, (value, unit, higher) in results.items())
+		with open(args.baseline, 'w') as f:
+			json.dump(baseline, f, indent = 1, sort_keys = True)
+		print('saved', args.baseline)
+		return 0
+	if slower:
+		print('{} benchmark(s) more than {}% slower than the baseline'.format(len(slower), args.threshold))
+		return 1
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
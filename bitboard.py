@@ -0,0 +1,162 @@
+# Bitboard version of the board for tetrisEngine.
+# Each row is stored as one int with a bit per cell, so testing a stone against the board is an AND per stone row
+# instead of a python loop over every cell, and a row is full when it equals FULL.
+# The row ints also carry the walls: PAD bits of 1s on both sides of the playfield, so a stone poking past either
+# edge collides without any extra bounds checks. Column c of the board is bit c + PAD.
+# Colours are kept in a normal matrix next to the bits because the renderer still needs them.
+from engine import ORIENTATIONS, GARBAGE_COLOR, MAX_STONE, gameRules, listBoard
+
+PAD = MAX_STONE # wide enough for the widest stone to hang off either side
+TOP = MAX_STONE # rows of open air above the board so stones can spawn above it
+
+def row_masks(shape):
+	# Turns a stone matrix into ((row, mask), ...) for its non empty rows, bit cx set for each filled cell.
+	masks = []
+	for cy, row in enumerate(shape):
+		mask = 0
+		for cx, val in enumerate(row):
+			if val:
+				mask |= 1 << cx
+		if mask:
+			masks.append((cy, mask))
+	return tuple(masks)
+
+def piece_masks(orientations):
+	# masks[stone_id][orientation] for a piece set, made once per set.
+	masks = MASKS_BY_SET.get(orientations)
+	if masks == None:
+		masks = MASKS_BY_SET[orientations] = tuple(tuple(row_masks(shape) for shape in shapes) for shapes in orientations)
+	return masks
+
+MASKS_BY_SET = {}
+# MASKS[stone_id][orientation] lines up with engine.ORIENTATIONS.
+MASKS = piece_masks(ORIENTATIONS)
+
+class bitBoard(object):
+	# Python ints have no size limit, so a row of a 100 column board is still one AND.
+	# Like listBoard, colour rows are copied before they change so snapshot() can share them, the bit rows are ints.
+	def __init__(self, rules = None, state = None):
+		self.rules = rules if rules != None else gameRules()
+		self.masks = piece_masks(self.rules.orientations)
+		self.cols = self.rules.cols
+		self.height = self.rules.rows
+		self.changes = None
+		self.walls = ((1 << PAD) - 1) | (((1 << PAD) - 1) << (self.cols + PAD))
+		self.full = (1 << (self.cols + 2 * PAD)) - 1
+		self.solid = self.full # the sentinel rows below the board
+		if state != None:
+			self.restore(state)
+			return
+		self.top = self.height # the highest row with anything in it
+		self.rows = [self.walls] * (TOP + self.height) + [self.solid] * TOP
+		self.matrix = [[0 for x in range(self.cols)] for y in range(self.height)]
+		self.matrix += [[1 for x in range(self.cols)]]
+		self.index_columns()
+
+	def snapshot(self):
+		return (tuple(self.rows), tuple(self.matrix), self.top, tuple(self.col_top), tuple(self.col_cells))
+
+	def restore(self, state):
+		rows, matrix, self.top, col_top, col_cells = state
+		self.rows = list(rows)
+		self.matrix = list(matrix)
+		self.col_top = list(col_top)
+		self.col_cells = list(col_cells)
+		self.changed(0, self.height)
+
+	def piece(self, stone_id, orientation):
+		return self.masks[stone_id][orientation]
+
+	changed = listBoard.changed
+	take_changes = listBoard.take_changes
+	index_columns = listBoard.index_columns
+	index_clear = listBoard.index_clear
+	index_garbage = listBoard.index_garbage
+	column_heights = listBoard.column_heights
+	holes = listBoard.holes
+	landing_y = listBoard.landing_y
+
+	def collides(self, piece, x, y):
+		shift = x + PAD
+		if shift < 0:
+			return True
+		rows = self.rows
+		y += TOP
+		try:
+			for cy, mask in piece:
+				if rows[y + cy] & (mask << shift):
+					return True
+		except IndexError:
+			return True
+		return False
+
+	def collision_point(self, piece, x, y):
+		# Same answer as check_collision_side: the first cell (in reading order) that hits something.
+		# Like the list version, rows above the board wrap around to the bottom of the board because of python's
+		# negative indexing, the rotation wall kicks in tetrisEngine were tuned against that so it is kept.
+		shift = x + PAD
+		if shift < 0:
+			for cy, mask in piece:
+				return ((mask & -mask).bit_length() - 1, cy)
+		rows = self.rows
+		for cy, mask in piece:
+			by = y + cy
+			if by < 0:
+				by += self.height + 1
+			if by < 0 or by > self.height:
+				row = self.solid
+			else:
+				row = rows[by + TOP]
+			hit = row & (mask << shift)
+			if hit:
+				return ((hit & -hit).bit_length() - 1 - shift, cy)
+		return False
+
+	def join(self, shape, x, y):
+		first = max(y, 0)
+		self.changed(first, min(y + len(shape), self.height))
+		self.top = min(self.top, first)
+		inside = True
+		rows = self.rows
+		col_top = self.col_top
+		for cy, row in enumerate(shape):
+			by = y + cy
+			if by < 0:
+				inside = False
+				continue
+			if by < self.height:
+				self.matrix[by] = self.matrix[by][:] # the old row may be in a snapshot
+			for cx, val in enumerate(row):
+				if val and 0 <= cx + x < self.cols and by < self.height:
+					self.matrix[by][cx + x] = val
+					rows[by + TOP] |= 1 << (cx + x + PAD)
+					self.col_cells[cx + x] += 1
+					if by < col_top[cx + x]:
+						col_top[cx + x] = by
+		return inside
+
+	def clear_lines(self, rows):
+		# Only the rows the last stone landed in can have filled up, so only those are tested.
+		full = [y for y in rows if self.rows[y + TOP] == self.full]
+		if not full:
+			return 0, full
+		self.changed(self.top, full[-1] + 1)
+		# Only the rows from the top of the stack down to the last full one move, the rest stay where they are.
+		top = self.top
+		kept = [y for y in range(top, full[-1] + 1) if y not in full]
+		self.rows[TOP + top:TOP + full[-1] + 1] = [self.walls] * len(full) + [self.rows[y + TOP] for y in kept]
+		self.matrix[top:full[-1] + 1] = [[0 for x in range(self.cols)] for y in full] + [self.matrix[y] for y in kept]
+		self.top = min(top + len(full), self.height)
+		self.index_clear(full)
+		return len(full), full
+
+	def add_garbage(self, count, gap, color = GARBAGE_COLOR):
+		lost = any(row != self.walls for row in self.rows[TOP:TOP + count])
+		row = self.full & ~(1 << (gap + PAD))
+		self.rows[TOP:TOP + self.height] = self.rows[TOP + count:TOP + self.height] + [row] * count
+		colors = [color if x != gap else 0 for x in range(self.cols)]
+		self.matrix[:self.height] = self.matrix[count:self.height] + [colors[:] for y in range(count)]
+		self.top = max(self.top - count, 0)
+		self.changed(self.top, self.height)
+		self.index_garbage(count, gap, lost)
+		return not lost
@@ -0,0 +1,93 @@
+# Simple computer players for headless games (see tournament.py).
+# A bot's play(engine) places the current stone through engine.step() like a player would, so flips, wall kicks,
+# scoring and game over are all the engine's. The simple ones pick (turns, x): the turns to make (0 cw, 1 ccw,
+# 2 hflip, 3 vflip, like rotate_stone) and the column to slide to, 'search' is the placement search in ai.py.
+# Every bot is built with a seed so a game played with the same stone seed and bot seed comes out the same.
+import random
+from ai import placementAI, TURN_ACTIONS
+from engine import TURNS, LEFT, RIGHT, DROP, INSTA_FALL
+
+def turn_paths(stone_turns):
+	# Shortest list of turns from the spawn orientation to each orientation of a stone, stone_turns is its TURNS entry.
+	paths = {0: []}
+	queue = [0]
+	for orientation in queue:
+		for turn, new_orientation in enumerate(stone_turns[orientation]):
+			if new_orientation not in paths:
+				paths[new_orientation] = paths[orientation] + [turn]
+				queue.append(new_orientation)
+	return paths
+
+def piece_turn_paths(turns):
+	# paths[stone_id] for a piece set's turns (gameRules.turns), made once per set.
+	paths = TURN_PATHS_BY_SET.get(turns)
+	if paths == None:
+		paths = TURN_PATHS_BY_SET[turns] = tuple(turn_paths(stone_turns) for stone_turns in turns)
+	return paths
+
+TURN_PATHS_BY_SET = {}
+TURN_PATHS = piece_turn_paths(TURNS)
+
+def drop_options(engine):
+	# (turns, x, landing row of the stone's bottom) for every orientation and column reachable by turning at the
+	# spawn point and then sliding straight across, with the engine's own stones.
+	board = engine.board
+	rules = engine.rules
+	options = []
+	for orientation, turns in piece_turn_paths(rules.turns)[engine.stone_id].items():
+		shape = rules.orientations[engine.stone_id][orientation]
+		piece = board.piece(engine.stone_id, orientation)
+		bottom = max(cy for cy, row in enumerate(shape) if any(row))
+		for x in range(-len(shape[0]), board.cols):
+			if not board.collides(piece, x, engine.stone_y):
+				options.append((turns, x, board.landing_y(engine.stone_id, orientation, x, engine.stone_y) + bottom))
+	return options
+
+def play(engine, turns, x):
+	# Makes the turns, slides to column x (as far as it gets) and locks the stone.
+	step = engine.step
+	for turn in turns:
+		step(TURN_ACTIONS[turn])
+	while engine.stone_x < x and step(RIGHT):
+		pass
+	while engine.stone_x > x and step(LEFT):
+		pass
+	step(INSTA_FALL)
+	step(DROP)
+
+class dropBot(object):
+	def __init__(self, seed = None):
+		self.rng = random.Random(seed)
+
+	def play(self, engine):
+		turns, x = self.choose(engine)
+		play(engine, turns, x)
+
+class randomBot(dropBot):
+	# Drops each stone in a random reachable spot, a floor for the other bots.
+	def choose(self, engine):
+		options = drop_options(engine)
+		if not options:
+			return [], engine.stone_x
+		turns, x, bottom = self.rng.choice(options)
+		return turns, x
+
+class lowestBot(dropBot):
+	# Puts each stone where its bottom lands lowest, ties broken at random.
+	def choose(self, engine):
+		options = drop_options(engine)
+		if not options:
+			return [], engine.stone_x
+		lowest = max(bottom for turns, x, bottom in options)
+		turns, x, bottom = self.rng.choice([option for option in options if option[2] == lowest])
+		return turns, x
+
+def searchBot(seed = None):
+	# One stone deep so a tournament of them finishes, placementAI has no randomness of its own.
+	return placementAI(depth = 1)
+
+BOTS = {
+	'random':	randomBot,
+	'lowest':	lowestBot,
+	'search':	searchBot,
+}
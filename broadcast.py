@@ -0,0 +1,540 @@
+# Live games for spectators: a game sends a stream of small messages about what happens in it, a relay fans the
+# streams out to any number of viewers (viewer.py draws them side by side).
+#	python broadcast.py relay --port 7778			then	python Tetris.py --broadcast host:7778
+#	PYGAME_HIDE_SUPPORT_PROMPT=1 python Tetris.py --broadcast - | python broadcast.py relay --stdin
+#								the same through a pipe, without pygame's hello on stdout
+#	python viewer.py --host host --port 7778
+#	python broadcast.py selftest --games 16			games, a relay and viewers in one process, checks every
+#								viewer ends up with every board
+# A stream starts with PUBLISH and a KEYFRAME (the whole board and stone), then one message per change: a new stone,
+# a move, a turn (rotation or flip), a lock, cleared rows with the new score, a level up, rubbish rows and game over.
+# Viewers work out the board from the locks the same way the engine does. Every KEYFRAME_EVERY messages, on a new
+# game and after an undo a new keyframe is sent, so the relay only has to keep each game's last keyframe and the
+# messages since. A viewer that joins late gets those and is up to date straight away.
+# Backpressure: a game never waits on the network, streamWriter drops what it cannot send and the game sends a
+# keyframe once it can again. The relay sends each viewer everything that came in during one pass of its event loop
+# as one write. A viewer whose connection has more than high_water bytes waiting is skipped until it is below
+# low_water, then it is sent the keyframes and backlogs of every game instead of what it missed.
+# Messages are framed like versus.py's, length:H kind:B payload, so a board can have up to MAX_CELLS (65512) cells,
+# gameStream refuses bigger ones. The relay adds game:H in front of every payload it sends on. Streams use the normal
+# stones.
+#	PUBLISH	game -> relay, name (utf-8)
+#	WATCH	viewer -> relay
+#	JOIN	relay -> viewer, game:H name
+#	END	relay -> viewer, game:H, the game's stream closed
+#	RESET	relay -> viewer, forget every game, a lagging viewer's catch up follows
+#	KEYFRAME	KEY_HEAD then cols * rows colour bytes, row by row
+#	SPAWN	stone_id:B orientation:B x:h y:h next_id:B
+#	MOVE	x:h y:h
+#	TURN	orientation:B x:h y:h
+#	LOCK	stone_id:B orientation:B x:h y:h
+#	LINES	rows:B top_row:B score:I lines_left:H
+#	LEVEL	level:H lines_left:H
+#	GARBAGE	rows:B gap:B
+#	GAMEOVER
+import argparse
+import asyncio
+import os
+import queue
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+from engine import tetrisEngine, gameRules, ORIENTATIONS, LEFT, RIGHT, DROP, INSTA_FALL, ROTATE_CW, ROTATE_CCW, HFLIP, VFLIP
+from bitboard import bitBoard
+from versus import pack, read_message, MESSAGE, PORT
+
+RELAY_PORT = PORT + 1
+KEYFRAME_EVERY = 500 # messages
+LAG_CHECK = 0.05 # seconds between looks at lagging viewers when nothing else comes in
+
+PUBLISH, WATCH, JOIN, END, KEYFRAME, SPAWN, MOVE, TURN, LOCK, LINES, LEVEL, GARBAGE, GAMEOVER, RESET = range(1, 15)
+STREAM_KINDS = (KEYFRAME, SPAWN, MOVE, TURN, LOCK, LINES, LEVEL, GARBAGE, GAMEOVER)
+GAME = struct.Struct('<H')
+# cols, rows, stone_id, orientation, x, y, next_id, score, level, lines_left, gameover
+KEY_HEAD = struct.Struct('<HHBBhhBIHHB')
+MAX_CELLS = 0xffff - 1 - GAME.size - KEY_HEAD.size # the biggest board a KEYFRAME still fits in once the relay adds game:H
+SPAWN_MSG = struct.Struct('<BBhhB')
+MOVE_MSG = struct.Struct('<hh')
+TURN_MSG = struct.Struct('<Bhh')
+LOCK_MSG = struct.Struct('<BBhh')
+LINES_MSG = struct.Struct('<BBIH')
+LEVEL_MSG = struct.Struct('<HH')
+GARBAGE_MSG = struct.Struct('<BB')
+
+class gameStream(object):
+	# Turns one tetrisEngine into a stream. update(events) has to be called after every action with the events the
+	# engine reported for it (tetrisApp does it in handle_events), write(data) sends the bytes on and returns False if
+	# it had to drop them. Raises ValueError for a board with more than MAX_CELLS cells.
+	def __init__(self, engine, write, name = 'player'):
+		if engine.board.cols * engine.board.height > MAX_CELLS:
+			raise ValueError('a {}x{} board is too big to broadcast, at most {} cells'.format(engine.board.cols, engine.board.height, MAX_CELLS))
+		self.engine = engine
+		self.write = write
+		self.resync = False
+		self.write(pack(PUBLISH, name.encode('utf-8')))
+		self.keyframe()
+
+	def send(self, data):
+		if self.write(data) == False:
+			self.resync = True
+
+	def keyframe(self):
+		engine = self.engine
+		board = engine.board
+		head = KEY_HEAD.pack(board.cols, board.height, engine.stone_id, engine.orientation, engine.stone_x,
+			engine.stone_y, engine.next_id, engine.score, engine.level, engine.lines_left, engine.gameover)
+		self.stone = (engine.pieces, engine.stone_id, engine.orientation, engine.stone_x, engine.stone_y)
+		self.sent = 0
+		self.resync = False
+		self.send(pack(KEYFRAME, head + bytes(val for row in board.matrix[:board.height] for val in row)))
+
+	def update(self, events):
+		engine = self.engine
+		if self.resync:
+			self.keyframe()
+			return
+		messages = []
+		for event in events:
+			if event[0] == 'set': # where the stone was last sent is where it locked, the drop that locks it does not move it
+				pieces, stone_id, orientation, x, y = self.stone
+				messages.append(pack(LOCK, LOCK_MSG.pack(stone_id, orientation, x, y)))
+			elif event[0] == 'lines':
+				messages.append(pack(LINES, LINES_MSG.pack(event[1], event[2], engine.score, engine.lines_left)))
+			elif event[0] == 'levelup':
+				messages.append(pack(LEVEL, LEVEL_MSG.pack(engine.level, engine.lines_left)))
+			elif event[0] == 'garbage':
+				messages.append(pack(GARBAGE, GARBAGE_MSG.pack(event[1], event[2])))
+			elif event[0] == 'gameover':
+				messages.append(pack(GAMEOVER))
+		stone = (engine.pieces, engine.stone_id, engine.orientation, engine.stone_x, engine.stone_y)
+		if stone != self.stone:
+			if stone[0] != self.stone[0]:
+				messages.append(pack(SPAWN, SPAWN_MSG.pack(engine.stone_id, engine.orientation, engine.stone_x, engine.stone_y, engine.next_id)))
+			elif stone[2] != self.stone[2]:
+				messages.append(pack(TURN, TURN_MSG.pack(engine.orientation, engine.stone_x, engine.stone_y)))
+			else:
+				messages.append(pack(MOVE, MOVE_MSG.pack(engine.stone_x, engine.stone_y)))
+			self.stone = stone
+		if messages:
+			self.send(b''.join(messages))
+			self.sent += len(messages)
+			if self.sent >= KEYFRAME_EVERY:
+				self.keyframe()
+
+class streamWriter(object):
+	# Hands the stream to send (a socket's sendall or a pipe's write) on its own thread, so the game never waits on it.
+	# write() drops the data and returns False once max_waiting writes are queued up.
+	def __init__(self, send, max_waiting = 256):
+		self.send = send
+		self.queue = queue.Queue(max_waiting)
+		self.thread = threading.Thread(target = self.run, daemon = True)
+		self.thread.start()
+
+	def write(self, data):
+		try:
+			self.queue.put_nowait(data)
+			return True
+		except queue.Full:
+			return False
+
+	def run(self):
+		while True:
+			data = self.queue.get()
+			if data == None:
+				break
+			try:
+				self.send(data)
+			except (OSError, ValueError):
+				break
+
+	def close(self, timeout = 1.0):
+		# Sends what is queued, waiting at most timeout seconds.
+		try:
+			self.queue.put(None, timeout = timeout)
+		except queue.Full:
+			return
+		self.thread.join(timeout)
+
+def open_writer(target):
+	# A streamWriter to a relay at 'host[:port]', or to stdout for '-'.
+	if target == '-':
+		# The stream gets stdout to itself, anything printed later goes to stderr.
+		out = open(os.dup(sys.stdout.fileno()), 'wb')
+		sys.stdout.flush()
+		os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+		def send(data):
+			out.write(data)
+			out.flush()
+		return streamWriter(send)
+	host, port = (target.split(':') + [RELAY_PORT])[:2]
+	connection = socket.create_connection((host, int(port)))
+	connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+	return streamWriter(connection.sendall)
+
+class watchedGame(object):
+	# A game as a viewer knows it from its stream, with the attributes of tetrisEngine that drawing one needs.
+	def __init__(self, name):
+		self.name = name
+		self.board = None # until the first keyframe
+		self.stone_id = self.orientation = self.next_id = 0
+		self.stone_x = self.stone_y = 0
+		self.score = self.level = self.lines_left = 0
+		self.gameover = False
+		self.version = 0 # goes up with every message, to tell when to draw it again
+
+	@property
+	def stone(self):
+		return ORIENTATIONS[self.stone_id][self.orientation]
+
+	def apply(self, kind, payload, pos = 0):
+		# One stream message, its payload from pos on.
+		self.version += 1
+		if kind == KEYFRAME:
+			(cols, rows, self.stone_id, self.orientation, self.stone_x, self.stone_y, self.next_id, self.score,
+				self.level, self.lines_left, gameover) = KEY_HEAD.unpack_from(payload, pos)
+			self.gameover = bool(gameover)
+			pos += KEY_HEAD.size
+			self.board = bitBoard(gameRules(cols, rows))
+			for y in range(rows):
+				row = payload[pos + y * cols:pos + (y + 1) * cols]
+				if any(row):
+					self.board.join([list(row)], 0, y)
+			self.board.changed(0, rows)
+		elif self.board == None:
+			return # joined in the middle, the keyframe is coming
+		elif kind == SPAWN:
+			self.stone_id, self.orientation, self.stone_x, self.stone_y, self.next_id = SPAWN_MSG.unpack_from(payload, pos)
+		elif kind == MOVE:
+			self.stone_x, self.stone_y = MOVE_MSG.unpack_from(payload, pos)
+		elif kind == TURN:
+			self.orientation, self.stone_x, self.stone_y = TURN_MSG.unpack_from(payload, pos)
+		elif kind == LOCK:
+			# The same as tetrisEngine.drop(): join it and clear the rows it landed in.
+			stone_id, orientation, x, y = LOCK_MSG.unpack_from(payload, pos)
+			shape = ORIENTATIONS[stone_id][orientation]
+			board = self.board
+			board.join(shape, x, y)
+			board.clear_lines(range(max(y, 0), min(y + len(shape), board.height)))
+		elif kind == LINES:
+			rows, top_row, self.score, self.lines_left = LINES_MSG.unpack_from(payload, pos)
+		elif kind == LEVEL:
+			self.level, self.lines_left = LEVEL_MSG.unpack_from(payload, pos)
+		elif kind == GARBAGE:
+			self.board.add_garbage(*GARBAGE_MSG.unpack_from(payload, pos))
+		elif kind == GAMEOVER:
+			self.gameover = True
+
+def read_messages(data):
+	# Splits a run of whole messages into (kind, payload) pairs.
+	pos = 0
+	messages = []
+	while pos < len(data):
+		size, kind = MESSAGE.unpack_from(data, pos)
+		messages.append((kind, data[pos + MESSAGE.size:pos + MESSAGE.size + size - 1]))
+		pos += MESSAGE.size + size - 1
+	return messages
+
+class relayGame(object):
+	def __init__(self, game, name):
+		self.game = game
+		self.join = pack(JOIN, GAME.pack(game) + name.encode('utf-8'))
+		self.backlog = [self.join] # from the last keyframe on, what a viewer needs to catch up
+
+class relayViewer(object):
+	def __init__(self, writer):
+		self.writer = writer
+		self.lagging = False
+
+class broadcastRelay(object):
+	# send_buffer shrinks the sockets' own buffers to the viewers, so a slow one shows up in high_water sooner.
+	def __init__(self, high_water = 1 << 20, low_water = 64 << 10, send_buffer = None):
+		self.high_water = high_water
+		self.low_water = low_water
+		self.send_buffer = send_buffer
+		self.games = {}
+		self.viewers = []
+		self.next_game = 0
+		self.pending = [] # messages that came in since the last flush
+		self.flushing = False
+		self.resyncs = 0
+
+	async def handle(self, reader, writer):
+		try:
+			kind, payload = await read_message(reader)
+			if kind == PUBLISH:
+				await self.publish(reader, payload.decode('utf-8', 'replace'))
+			elif kind == WATCH:
+				await self.watch(reader, writer)
+		except (asyncio.IncompleteReadError, ConnectionError):
+			pass
+		finally:
+			writer.close()
+
+	async def publish(self, reader, name):
+		game = relayGame(self.next_game, name)
+		self.next_game = (self.next_game + 1) & 0xffff
+		self.games[game.game] = game
+		self.forward(game.join)
+		try:
+			while True:
+				kind, payload = await read_message(reader)
+				if kind not in STREAM_KINDS:
+					continue
+				data = pack(kind, GAME.pack(game.game) + payload)
+				if kind == KEYFRAME:
+					game.backlog = [game.join, data]
+				else:
+					game.backlog.append(data)
+				self.forward(data)
+		except (asyncio.IncompleteReadError, ConnectionError):
+			pass
+		finally:
+			del self.games[game.game]
+			self.forward(pack(END, GAME.pack(game.game)))
+
+	async def watch(self, reader, writer):
+		viewer = relayViewer(writer)
+		if self.send_buffer != None:
+			writer.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer)
+		writer.write(self.catch_up())
+		self.viewers.append(viewer)
+		try:
+			while await reader.read(4096): # viewers do not say anything, this waits for them to hang up
+				pass
+		finally:
+			self.viewers.remove(viewer)
+
+	def catch_up(self):
+		# Everything a new viewer needs: the last keyframe of every game and what happened since.
+		return b''.join(b''.join(game.backlog) for game in self.games.values())
+
+	def forward(self, data):
+		# Queues data for every viewer, sent together at the end of this pass of the event loop.
+		self.pending.append(data)
+		if not self.flushing:
+			self.flushing = True
+			asyncio.get_running_loop().call_soon(self.flush)
+
+	def flush(self):
+		self.flushing = False
+		data = b''.join(self.pending)
+		self.pending = []
+		catch_up = None
+		for viewer in self.viewers:
+			writer = viewer.writer
+			if writer.is_closing():
+				continue
+			waiting = writer.transport.get_write_buffer_size()
+			if viewer.lagging:
+				if waiting > self.low_water:
+					continue
+				# The backlogs already have data in them
+				if catch_up == None:
+					catch_up = pack(RESET) + self.catch_up()
+				viewer.lagging = False
+				self.resyncs += 1
+				writer.write(catch_up)
+			elif waiting > self.high_water:
+				viewer.lagging = True
+			else:
+				writer.write(data)
+		if not self.flushing and any(viewer.lagging for viewer in self.viewers):
+			self.flushing = True # the games may have gone quiet, so look again later anyway
+			asyncio.get_running_loop().call_later(LAG_CHECK, self.flush)
+
+	async def serve(self, host = '0.0.0.0', port = RELAY_PORT, stdin = False, started = None):
+		server = await asyncio.start_server(self.handle, host, port)
+		if started != None:
+			started(server)
+		if stdin: # one game piped in
+			reader = asyncio.StreamReader()
+			loop = asyncio.get_running_loop()
+			await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin.buffer)
+			asyncio.ensure_future(self.handle_pipe(reader))
+		async with server:
+			await server.serve_forever()
+
+	async def handle_pipe(self, reader):
+		try:
+			kind, payload = await read_message(reader)
+			if kind == PUBLISH:
+				await self.publish(reader, payload.decode('utf-8', 'replace'))
+		except asyncio.IncompleteReadError:
+			pass
+
+class streamWatcher(object):
+	# The viewer side of the relay: after connect(), receive() keeps self.games ({game: watchedGame}) up to date.
+	# on_message(kind, game) is called after each message if it is set.
+	def __init__(self, on_message = None):
+		self.games = {}
+		self.on_message = on_message
+		self.bytes_received = 0
+
+	async def connect(self, host, port = RELAY_PORT, receive_buffer = None):
+		# receive_buffer shrinks the socket's buffer, selftest uses it to make a slow viewer.
+		if receive_buffer == None:
+			self.reader, self.writer = await asyncio.open_connection(host, port)
+		else:
+			connection = socket.socket()
+			connection.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+			connection.setblocking(False)
+			await asyncio.get_running_loop().sock_connect(connection, (host, port))
+			self.reader, self.writer = await asyncio.open_connection(sock = connection, limit = receive_buffer)
+		self.writer.write(pack(WATCH))
+
+	async def receive(self):
+		try:
+			while True:
+				kind, payload = await read_message(self.reader)
+				self.bytes_received += len(payload) + MESSAGE.size
+				self.apply(kind, payload)
+		except (asyncio.IncompleteReadError, ConnectionError):
+			pass
+
+	def apply(self, kind, payload):
+		game = GAME.unpack_from(payload)[0] if kind != RESET else None
+		if kind == RESET:
+			self.games = {}
+		elif kind == JOIN:
+			self.games[game] = watchedGame(payload[GAME.size:].decode('utf-8', 'replace'))
+		elif kind == END:
+			self.games.pop(game, None)
+		elif game in self.games:
+			self.games[game].apply(kind, payload, GAME.size)
+		if self.on_message != None:
+			self.on_message(kind, game)
+
+class threadedWatcher(streamWatcher):
+	# streamWatcher on its own thread, for viewer.py. The messages wait in self.inbox until the drawing thread calls
+	# apply_pending(), so the games only change between frames. start() raises what connect() raised if it could not
+	# connect.
+	def start(self, host, port = RELAY_PORT):
+		self.inbox = queue.SimpleQueue()
+		connected = threading.Event()
+		failed = []
+		def run():
+			loop = asyncio.new_event_loop()
+			try:
+				loop.run_until_complete(self.connect(host, port))
+			except Exception as e:
+				failed.append(e)
+				return
+			finally:
+				connected.set()
+			loop.run_until_complete(self.receive_into_inbox())
+		threading.Thread(target = run, daemon = True).start()
+		connected.wait()
+		if failed:
+			raise failed[0]
+
+	async def receive_into_inbox(self):
+		try:
+			while True:
+				message = await read_message(self.reader)
+				self.bytes_received += len(message[1]) + MESSAGE.size
+				self.inbox.put(message)
+		except (asyncio.IncompleteReadError, ConnectionError):
+			pass
+
+	def apply_pending(self):
+		# Applies what came in since the last call, returns how many messages that was.
+		count = 0
+		while True:
+			try:
+				kind, payload = self.inbox.get_nowait()
+			except queue.Empty:
+				return count
+			self.apply(kind, payload)
+			count += 1
+
+ACTIONS = [LEFT, RIGHT, DROP, DROP, DROP, INSTA_FALL, ROTATE_CW, ROTATE_CCW, HFLIP, VFLIP]
+
+async def random_game(name, host, port, rng, seconds):
+	# A headless game pressing random keys, streamed to the relay. Returns the engine and the number of games played.
+	reader, writer = await asyncio.open_connection(host, port)
+	engine = tetrisEngine(0, rng.getrandbits(32), 'uniform', bitBoard)
+	stream = gameStream(engine, writer.write, name)
+	games = 1
+	end = time.perf_counter() + seconds
+	while time.perf_counter() < end:
+		if engine.gameover:
+			engine.init_game()
+			stream.keyframe()
+			games += 1
+		engine.step(rng.choice(ACTIONS))
+		if rng.random() < 0.005:
+			engine.add_garbage(rng.randrange(1, 3), rng.randrange(engine.board.cols))
+		events = engine.events
+		engine.events = []
+		stream.update(events)
+		await asyncio.sleep(rng.uniform(0, 0.01))
+	return engine, writer, games
+
+async def selftest(games, seconds):
+	# A relay, games playing random keys and three viewers: one from the start, one that joins halfway and one that
+	# stops reading for a while so the relay has to skip it and catch it up. Then every viewer's copy of every game
+	# is checked against the game.
+	relay = broadcastRelay(high_water = 8 << 10, low_water = 2 << 10, send_buffer = 4096)
+	started = asyncio.Event()
+	ports = []
+	def on_start(server):
+		ports.append(server.sockets[0].getsockname()[1])
+		started.set()
+	serving = asyncio.ensure_future(relay.serve('127.0.0.1', 0, started = on_start))
+	await started.wait()
+	port = ports[0]
+	watchers = [streamWatcher(), streamWatcher(), streamWatcher()]
+	await watchers[0].connect('127.0.0.1', port)
+	await watchers[2].connect('127.0.0.1', port, receive_buffer = 1024)
+	receivers = [asyncio.ensure_future(watchers[0].receive())]
+	start = time.perf_counter()
+	players = asyncio.gather(*[random_game('game{}'.format(i), '127.0.0.1', port, random.Random(i), seconds) for i in range(games)])
+	await asyncio.sleep(seconds / 2)
+	await watchers[1].connect('127.0.0.1', port)
+	receivers.append(asyncio.ensure_future(watchers[1].receive()))
+	receivers.append(asyncio.ensure_future(watchers[2].receive())) # the slow one has not read anything until now
+	results = await players
+	played = time.perf_counter() - start
+	await asyncio.sleep(0.5) # the last messages
+	checked = bad = 0
+	for watcher in watchers:
+		by_name = dict((game.name, game) for game in watcher.games.values())
+		for i, (engine, writer, played_games) in enumerate(results):
+			game = by_name.get('game{}'.format(i))
+			checked += 1
+			if game == None or game.board == None or game.board.matrix != engine.board.matrix or \
+					(game.stone_id, game.orientation, game.stone_x, game.stone_y, game.score, game.level, game.lines_left, game.gameover) != \
+					(engine.stone_id, engine.orientation, engine.stone_x, engine.stone_y, engine.score, engine.level, engine.lines_left, engine.gameover):
+				bad += 1
+	received = watchers[0].bytes_received
+	print('{} games ({} played), {:.1f}s: {} boards checked, {} different, {} catch ups, {:.0f} bytes/s per game to a viewer'.format(
+		games, sum(result[2] for result in results), played, checked, bad, relay.resyncs, received / played / games))
+	for engine, writer, played_games in results:
+		writer.close()
+	for watcher in watchers:
+		watcher.writer.close()
+	await asyncio.sleep(0.2)
+	serving.cancel()
+	for receiver in receivers:
+		receiver.cancel()
+	return 1 if bad else 0
+
+def main():
+	parser = argparse.ArgumentParser(description = 'Tetris Flip broadcast relay')
+	parser.add_argument('command', choices = ['relay', 'selftest'])
+	parser.add_argument('--port', type = int, default = RELAY_PORT)
+	parser.add_argument('--stdin', action = 'store_true', help = 'also relay the game piped in (Tetris.py --broadcast -)')
+	parser.add_argument('--games', type = int, default = 16, help = 'games for selftest')
+	parser.add_argument('--seconds', type = float, default = 5)
+	args = parser.parse_args()
+	if args.command == 'relay':
+		print('relaying on port', args.port, file = sys.stderr)
+		asyncio.run(broadcastRelay().serve('0.0.0.0', args.port, args.stdin))
+		return 0
+	return asyncio.run(selftest(args.games, args.seconds))
+
+if __name__ == '__main__':
+	sys.exit(main())
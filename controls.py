@@ -0,0 +1,130 @@
+# Key and gamepad bindings for tetrisApp.
+# Keys, gamepad buttons and d-pad directions are all looked up once into plain dicts of {code: action name} so a key
+# press is a single dict lookup. Holding left, right or down repeats on the game clock instead of SDL's key repeat:
+# the first repeat comes das ms after the press and then one every arr ms.
+# The bindings can be changed with a controls.json next to Tetris.py, anything left out keeps its default, e.g.
+#	{"keys": {"j": "left", "l": "right"}, "buttons": {"4": "hflip"}, "das": 170, "arr": 50}
+# Key names are the pygame names without the K_ (LEFT, SPACE, a, ...), unknown ones are skipped with a warning. das and
+# arr are at least 1 ms.
+import json
+import sys
+from os import path
+import pygame as pg
+from engine import LEFT, RIGHT, DROP, INSTA_FALL, ROTATE_CW, ROTATE_CCW, HFLIP, VFLIP
+
+# Actions that map straight onto a tetrisEngine action, the rest (quit, pause, start, profile, undo) are handled by
+# tetrisApp.
+ENGINE_ACTIONS = {
+	'left':		LEFT,
+	'right':	RIGHT,
+	'drop':		DROP,
+	'insta_fall':	INSTA_FALL,
+	'rotate_cw':	ROTATE_CW,
+	'rotate_ccw':	ROTATE_CCW,
+	'hflip':	HFLIP,
+	'vflip':	VFLIP,
+}
+REPEATING = ('left', 'right', 'drop')
+
+DEFAULT_KEYS = {
+	'ESCAPE':	'quit',
+	'LEFT':		'left',
+	'RIGHT':	'right',
+	'UP':		'rotate_ccw',
+	'RCTRL':	'rotate_cw',
+	'DOWN':		'drop',
+	'p':		'pause',
+	'SPACE':	'insta_fall',
+	'a':		'rotate_ccw',
+	'd':		'rotate_cw',
+	'w':		'vflip',
+	's':		'hflip',
+	'F3':		'profile',
+	'BACKSPACE':	'undo',
+}
+DEFAULT_BUTTONS = {
+	0:	'rotate_cw',
+	1:	'hflip',
+	2:	'rotate_ccw',
+	3:	'vflip',
+	5:	'insta_fall',
+	6:	'undo',
+	7:	'start',
+	8:	'quit',
+	9:	'start',
+	10:	'quit',
+}
+DEFAULT_HATS = {
+	(-1, 0):	'left',
+	(1, 0):		'right',
+	(0, -1):	'drop',
+}
+
+class inputMap(object):
+	def __init__(self, filename = None, das = 250, arr = 25):
+		keys = dict(DEFAULT_KEYS)
+		buttons = dict(DEFAULT_BUTTONS)
+		self.das = das
+		self.arr = arr
+		if filename != None and path.isfile(filename):
+			with open(filename) as f:
+				settings = json.load(f)
+			keys.update(settings.get('keys', {}))
+			buttons.update({int(button): action for button, action in settings.get('buttons', {}).items()})
+			self.das = settings.get('das', self.das)
+			self.arr = settings.get('arr', self.arr)
+		self.das = max(1, self.das)
+		self.arr = max(1, self.arr) # repeats() would never catch up with 0
+		self.keys = {}
+		for name, action in keys.items():
+			key = getattr(pg, 'K_' + name, None)
+			if key == None:
+				print('{}: there is no key called {}, skipping it'.format(filename, name), file = sys.stderr)
+				continue
+			self.keys[key] = action
+		self.buttons = buttons
+		self.hats = dict(DEFAULT_HATS)
+		self.held = {} # action: time of its next repeat
+		self.hat_action = None
+
+	def press(self, action, now):
+		if action in REPEATING:
+			self.held[action] = now + self.das
+		return action
+
+	def release(self, action):
+		self.held.pop(action, None)
+
+	def key_down(self, key, now):
+		action = self.keys.get(key)
+		if action != None:
+			return self.press(action, now)
+
+	def key_up(self, key):
+		self.release(self.keys.get(key))
+
+	def button_down(self, button, now):
+		action = self.buttons.get(button)
+		if action != None:
+			return self.press(action, now)
+
+	def button_up(self, button):
+		self.release(self.buttons.get(button))
+
+	def hat_motion(self, value, now):
+		if self.hat_action != None:
+			self.release(self.hat_action)
+		self.hat_action = self.hats.get(tuple(value))
+		if self.hat_action != None:
+			return self.press(self.hat_action, now)
+
+	def repeats(self, now):
+		# Returns every auto repeat that has come due by now, oldest first.
+		due = []
+		for action, when in self.held.items():
+			while when <= now:
+				due.append((when, action))
+				when += self.arr
+			self.held[action] = when
+		due.sort()
+		return [action for when, action in due]
@@ -0,0 +1,691 @@
+# Headless game core for Tetris Flip.
+# Everything that decides what happens in a game lives here: the board, the current and next stone, scoring,
+# levels and the line rules. There is no pygame in this file so it runs without a display or sound card and can be
+# stepped as fast as python allows for bots, simulations and tests. tetrisApp in Tetris.py just draws it.
+import random
+from collections import namedtuple
+
+# The configuration
+config = {
+	'cell_size':	20,
+	'cols':		10,
+	'rows':		20,
+	'delay':	750,
+	'maxfps':	60, # frames drawn per second, 0 draws as fast as possible
+	'tick_rate':	240, # game updates per second, gravity and auto repeat are timed on these
+	'low_latency':	False, # read the controls right before every tick instead of once per frame
+	'render':	'dirty', # 'dirty' only updates the parts of the screen that changed, 'full' redraws everything each frame
+	'scaling':	'native', # 'native' fits cell_size to the window, 'sdl' draws at cell_size and lets SDL stretch it
+	'fullscreen':	False,
+	'load_times':	False,
+	'seed':		None, # None picks a new seed for every game
+	'randomizer':	'uniform', # or 'bag'
+	'ghost':	True, # show where the stone would land
+	'practice':	False, # undo is allowed, games are not kept in the scores or recorded
+	'record':	None, # folder to save replays in
+	'profile':	None, # file to save frame timings in, see profiler.py
+	'audio_buffer':	512, # samples per mixer buffer, smaller starts sounds sooner but may crackle, see audio.py
+	'scores':	None, # SQLite file to keep finished games in, see scores.py
+	'broadcast':	None, # 'host[:port]' of a broadcast.py relay to stream the games to, '-' for stdout
+	'player':	'player' # the name they are kept under
+}
+
+GARBAGE_COLOR = 11 # colour of the rows added by add_garbage
+
+# Define the shapes of the single parts
+tetris_shapes = [
+	[[0, 0, 0, 0],
+	 [10, 10, 10, 10],
+	 [0, 0, 0, 0]],
+
+	[[2, 2],
+	 [2, 2]],
+
+	[[0, 0, 0],
+	 [8, 8, 8],
+	 [0, 8, 0]],
+
+	[[0, 0, 0],
+	 [0, 3, 3],
+	 [3, 3, 0]],
+
+	[[0, 0, 0],
+	 [1, 1, 0],
+	 [0, 1, 1]],
+
+	[[4, 0, 0],
+	 [4, 4, 4],
+	 [0, 0, 0]],
+
+	[[0, 0, 0],
+	 [5, 5, 5],
+	 [5, 0, 0]],
+
+]
+
+# Actions understood by tetrisEngine.step()
+NOOP = 0
+LEFT = 1
+RIGHT = 2
+DROP = 3
+INSTA_FALL = 4
+ROTATE_CW = 5
+ROTATE_CCW = 6
+HFLIP = 7
+VFLIP = 8
+
+def rotate_clockwise(shape):
+	# Rotates shape counterclockwise three times to rotate it clockwise.
+	for i in range(0, 3):
+		shape = rotate_counterclockwise(shape)
+	return shape
+
+def rotate_counterclockwise(shape):
+	return [[shape[y][x]
+			 for y in range(len(shape))]
+			for x in range(len(shape[0]) - 1, -1, -1)]
+
+def vflip(shape):
+	return [shape[y] for y in range(len(shape) - 1, -1, -1)]
+
+def hflip(shape):
+	new_shape = []
+	height = len(shape)
+	width = len(shape[0])
+	for j in range(0, height):
+		new_row = []
+		for i in range(width - 1, -1, -1):
+			new_row.append(shape[j][i])
+		new_shape.append(new_row)
+	return new_shape
+
+def check_collision(board, boarder, shape, offset, top = 3):
+	# top is how many rows of air the boarder has above the board (see create_boarder).
+	off_x, off_y = offset
+	for cy, row in enumerate(shape):
+		for cx, cell in enumerate(row):
+			try:
+				if cy + off_y >= 0:
+					if (cell and board[cy + off_y][cx + off_x]) or (cell and boarder[cy + off_y + top][cx + off_x + 1]):
+						return True
+				else:
+					if (cell and boarder[cy + off_y + top][cx + off_x + 1]):
+						return True
+			except IndexError:
+				return True
+	return False
+
+def check_collision_side(board, boarder, shape, offset, top = 3):
+	off_x, off_y = offset
+	for cy, row in enumerate(shape):
+		for cx, cell in enumerate(row):
+			try:
+				if (cell and board[ cy + off_y][ cx + off_x]) or (cell and boarder[ cy + off_y + top][ cx + off_x + 1]):
+					return (cx, cy)
+			except IndexError:
+				return (cx, cy)
+	return False
+
+# Every orientation each stone can reach, worked out once here instead of on every key press.
+# ORIENTATIONS[stone_id] is a tuple of the distinct shape matrices (tuples of tuples, so nothing can change them) and
+# TURNS[stone_id][orientation][turn] is the orientation you end up in after rotate_stone(turn)
+# (turn 0 clockwise, 1 counterclockwise, 2 horizontal flip, 3 vertical flip). Orientation 0 is the spawn shape.
+TURN_FUNCTIONS = (rotate_clockwise, rotate_counterclockwise, hflip, vflip)
+
+# Piece randomizers. Each game gets its own, seeded, so a game can be played again exactly from its seed.
+# count is how many different stones there are. state() is kept until the next stone is dealt, the random state is
+# 625 numbers and a game snapshot is taken far more often than that.
+class uniformPieces(object):
+	# Every stone is equally likely every time, like the original game.
+	def __init__(self, seed, count = len(tetris_shapes)):
+		self.rng = random.Random(seed)
+		self.count = count
+		self.saved = None
+
+	def next(self):
+		self.saved = None
+		return self.rng.randrange(self.count)
+
+	def state(self):
+		if self.saved == None:
+			self.saved = self.rng.getstate()
+		return self.saved
+
+	def restore(self, state):
+		self.rng.setstate(state)
+		self.saved = state
+
+class bagPieces(object):
+	# 7-bag: each run of seven stones is one of each, shuffled.
+	def __init__(self, seed, count = len(tetris_shapes)):
+		self.rng = random.Random(seed)
+		self.count = count
+		self.bag = []
+		self.saved = None
+
+	def next(self):
+		self.saved = None
+		if not self.bag:
+			self.bag = list(range(self.count))
+			self.rng.shuffle(self.bag)
+		return self.bag.pop()
+
+	def state(self):
+		if self.saved == None:
+			self.saved = (self.rng.getstate(), tuple(self.bag))
+		return self.saved
+
+	def restore(self, state):
+		self.rng.setstate(state[0])
+		self.bag = list(state[1])
+		self.saved = state
+
+RANDOMIZERS = {'uniform': uniformPieces, 'bag': bagPieces}
+
+def build_orientations(shape):
+	freeze = lambda m: tuple(tuple(row) for row in m)
+	shapes = [freeze(shape)]
+	turns = []
+	i = 0
+	while i < len(shapes):
+		row = []
+		for turn in TURN_FUNCTIONS:
+			new_shape = freeze(turn(shapes[i]))
+			if new_shape not in shapes:
+				shapes.append(new_shape)
+			row.append(shapes.index(new_shape))
+		turns.append(tuple(row))
+		i += 1
+	return tuple(shapes), tuple(turns)
+
+def build_piece_set(shapes):
+	# (ORIENTATIONS, TURNS) for a list of stone matrices.
+	orientations = []
+	turns = []
+	for shape in shapes:
+		stone_shapes, stone_turns = build_orientations(shape)
+		orientations.append(stone_shapes)
+		turns.append(stone_turns)
+	return tuple(orientations), tuple(turns)
+
+ORIENTATIONS, TURNS = build_piece_set(tetris_shapes)
+
+def column_bottoms(shape):
+	# ((cx, lowest filled cy), ...) for each column of a stone matrix with anything in it.
+	return tuple((cx, max(cy for cy, row in enumerate(shape) if row[cx])) for cx in range(len(shape[0]))
+		if any(row[cx] for row in shape))
+
+def piece_profiles(orientations):
+	# profiles[stone_id][orientation], the column_bottoms of every orientation.
+	return tuple(tuple(column_bottoms(shape) for shape in shapes) for shapes in orientations)
+
+PROFILES = piece_profiles(ORIENTATIONS)
+
+LINE_SCORES = {1: 40, 2: 100, 3: 300, 4: 1200} # points for rows cleared at once, times level + 1
+BONUS_LINES = {2: 1, 3: 2, 4: 4} # extra lines towards the next level for clearing several rows at once
+MAX_STONE = 4 # stones have to fit in 4x4, the boards' walls and air above are that deep
+
+class gameRules(object):
+	# Everything about one game that used to come from the module globals: the board size, where stones spawn, the
+	# scoring table, the level curve and the set of stones. Anything left out is the normal game, with the board size
+	# and first delay read from config when the rules are made. tetrisEngine and its board take one, for example
+	# tetrisEngine(rules = gameRules(cols = 100, rows = 200)) for a mega board.
+	# shapes is a list of stone matrices like tetris_shapes. spawn_y is the row the top of a new stone starts on.
+	# The delay starts at delay - level * delay_step and goes down by delay_step every level up, by late_delay_step
+	# once the level is late_level or more, and never below min_delay.
+	def __init__(self, cols = None, rows = None, shapes = None, spawn_y = -3, delay = None, delay_step = 60,
+			late_level = 10, late_delay_step = 20, min_delay = 50, lines_per_level = 5, line_scores = LINE_SCORES,
+			bonus_lines = BONUS_LINES):
+		self.cols = cols if cols != None else config['cols']
+		self.rows = rows if rows != None else config['rows']
+		self.shapes = shapes if shapes != None else tetris_shapes
+		if shapes == None:
+			self.orientations, self.turns, self.profiles = ORIENTATIONS, TURNS, PROFILES
+		else:
+			self.orientations, self.turns = build_piece_set(shapes)
+			self.profiles = piece_profiles(self.orientations)
+		if any(len(shape) > MAX_STONE or len(shape[0]) > MAX_STONE for shape in self.shapes):
+			raise ValueError('stones have to fit in {0}x{0}'.format(MAX_STONE))
+		if not -MAX_STONE <= spawn_y < self.rows:
+			raise ValueError('spawn_y has to be between {} and {}'.format(-MAX_STONE, self.rows - 1))
+		self.spawn_y = spawn_y
+		self.delay = delay if delay != None else config['delay']
+		self.delay_step = delay_step
+		self.late_level = late_level
+		self.late_delay_step = late_delay_step
+		self.min_delay = min_delay
+		self.lines_per_level = lines_per_level
+		self.line_scores = line_scores
+		self.bonus_lines = bonus_lines
+		self.most_rows = max(line_scores)
+
+	def spawn(self, stone_id):
+		# Where a new stone starts: (orientation, x, y), centred at the top.
+		return 0, int(self.cols / 2 - len(self.orientations[stone_id][0][0]) / 2), self.spawn_y
+
+	def start_delay(self, level):
+		return self.delay - level * self.delay_step
+
+	def next_delay(self, delay, level):
+		# The delay after levelling up to level.
+		delay -= self.late_delay_step if level >= self.late_level else self.delay_step
+		return max(delay, self.min_delay)
+
+	def lines_required(self, level):
+		return (level + 1) * self.lines_per_level
+
+	def score(self, rows_removed, level):
+		# (points, lines towards the next level) for clearing rows_removed rows at once.
+		if not rows_removed:
+			return 0, 0
+		rows = min(rows_removed, self.most_rows)
+		return self.line_scores[rows] * (level + 1), rows_removed + self.bonus_lines.get(rows, 0)
+
+def new_board(cols = None, rows = None):
+	cols = cols if cols != None else config['cols']
+	rows = rows if rows != None else config['rows']
+	board = [ [ 0 for x in range(cols) ]
+			for y in range(rows) ]
+	board += [[ 1 for x in range(cols)]]
+	return board
+
+def create_boarder(board, top = 3):
+	boarder = [] # creates a matrix of zeros the size of the board surrounded but padded with 1s except for on top to use for collision detection.
+	for j in range(0, len(board) + top + 1):
+		new_row = []
+		for i in range(0, len(board[0]) + 2):
+			if (j == len(board) + top) or (i in [0, len(board[0])+1]):
+				val = 1
+			else:
+				val = 0
+			new_row.append(val)
+		boarder.append(new_row)
+	return boarder
+
+# Everything about a game at one moment, made by tetrisEngine.snapshot(). The board is in whatever form its class
+# keeps it (see snapshot() on the boards) and shares its rows with the live board, so taking one copies the lists of
+# row references, never the rows themselves: the boards never change a row in place, they put a changed copy there.
+gameSnapshot = namedtuple('gameSnapshot', ('game_seed', 'generator', 'frame', 'gameover', 'flips', 'pieces',
+	'total_lines', 'board', 'level', 'score', 'delay', 'lines', 'lines_required', 'lines_left', 'stone_id',
+	'orientation', 'stone_x', 'stone_y', 'next_id'))
+
+class listBoard(object):
+	# The original board: a list of rows of colour values with a sentinel row of 1s at the bottom, plus the padded
+	# boarder matrix used for the wall checks. Every board type has the same methods so the engine can use any of them.
+	# piece() looks up whatever that board wants for collision tests of a stone orientation, here just its matrix.
+	# For drawing only what changed, every board also keeps self.top, the highest row with anything in it (height when
+	# it is empty), and take_changes() gives the rows changed since it was last called.
+	# It also keeps an index of the columns, updated as stones join and rows go rather than searched for:
+	# col_top[x] is the highest row with anything in column x (height when it is empty) and col_cells[x] how many of
+	# its cells are taken, so the empty cells below the top, the holes, are height - col_top[x] - col_cells[x].
+	# landing_y() uses it to find where a stone lands by looking at the columns under it instead of at every row.
+	# Rows are never changed in place, a row that changes is copied first, so snapshot() can share them. state is a
+	# snapshot() to start from instead of an empty board.
+	def __init__(self, rules = None, state = None):
+		self.rules = rules if rules != None else gameRules()
+		self.cols = self.rules.cols
+		self.height = self.rules.rows
+		self.air = MAX_STONE # rows of air in the boarder above the board
+		self.changes = None
+		if state != None:
+			self.restore(state)
+		else:
+			self.matrix = new_board(self.cols, self.height)
+			self.filled = [0] * self.height # how many cells of each row are taken, a row is full at self.cols
+			self.top = self.height
+			self.index_columns()
+		self.boarder = create_boarder(self.matrix, self.air)
+
+	def snapshot(self):
+		return (tuple(self.matrix), tuple(self.filled), self.top, tuple(self.col_top), tuple(self.col_cells))
+
+	def restore(self, state):
+		matrix, filled, self.top, col_top, col_cells = state
+		self.matrix = list(matrix)
+		self.filled = list(filled)
+		self.col_top = list(col_top)
+		self.col_cells = list(col_cells)
+		self.changed(0, self.height)
+
+	def piece(self, stone_id, orientation):
+		return self.rules.orientations[stone_id][orientation]
+
+	def collides(self, piece, x, y):
+		return check_collision(self.matrix, self.boarder, piece, (x, y), self.air)
+
+	def collision_point(self, piece, x, y):
+		return check_collision_side(self.matrix, self.boarder, piece, (x, y), self.air)
+
+	def changed(self, first, last):
+		# Rows first to last - 1 have to be drawn again.
+		if self.changes == None:
+			self.changes = (first, last)
+		else:
+			self.changes = (min(first, self.changes[0]), max(last, self.changes[1]))
+
+	def take_changes(self):
+		# (first, last) of the rows changed since the last call, or None.
+		changes = self.changes
+		self.changes = None
+		return changes
+
+	def index_columns(self):
+		# Works out col_top and col_cells from the matrix, the board keeps them up to date from then on.
+		self.col_top = [self.height] * self.cols
+		self.col_cells = [0] * self.cols
+		for y in range(self.height - 1, -1, -1):
+			for x, val in enumerate(self.matrix[y]):
+				if val:
+					self.col_top[x] = y
+					self.col_cells[x] += 1
+
+	def index_clear(self, full):
+		# Moves the column index down past the rows in full (top first), once they are gone from the matrix.
+		count = len(full)
+		col_top = self.col_top
+		matrix = self.matrix
+		for x in range(self.cols):
+			self.col_cells[x] -= count
+			if col_top[x] < full[0]:
+				col_top[x] += count
+			else: # its top cell went with the first full row, nothing is above it so look down from there
+				y = full[0] + count
+				while y < self.height and not matrix[y][x]:
+					y += 1
+				col_top[x] = y
+
+	def index_garbage(self, count, gap, lost):
+		# The column index after add_garbage() pushed count rows in under everything.
+		if lost: # cells went off the top, count again
+			self.index_columns()
+			return
+		for x in range(self.cols):
+			if x != gap:
+				self.col_top[x] -= count
+				self.col_cells[x] += count
+			elif self.col_top[x] < self.height:
+				self.col_top[x] -= count
+
+	def column_heights(self):
+		return [self.height - top for top in self.col_top]
+
+	def holes(self):
+		# Empty cells with something above them in their column.
+		return sum(self.height - top - cells for top, cells in zip(self.col_top, self.col_cells))
+
+	def landing_y(self, stone_id, orientation, x, y):
+		# The row the stone's top ends on if it falls straight down from (x, y), where it has to fit. If the stone is
+		# above every column under it that is straight from the column tops, one column at a time. If it has been
+		# tucked in under something it falls a row at a time like before.
+		col_top = self.col_top
+		land = self.height
+		for cx, bottom in self.rules.profiles[stone_id][orientation]:
+			land = min(land, col_top[x + cx] - bottom - 1)
+		if land >= y:
+			return land
+		piece = self.piece(stone_id, orientation)
+		while not self.collides(piece, x, y + 1):
+			y += 1
+		return y
+
+	def join(self, shape, x, y):
+		# Adds the stone to the board with its top row at y. Returns False if part of it is above the board.
+		first = max(y, 0)
+		last = min(y + len(shape), self.height)
+		self.changed(first, last)
+		self.top = min(self.top, first)
+		for by in range(first, last): # copies, the old rows may be in a snapshot
+			self.matrix[by] = self.matrix[by][:]
+		inside = True
+		for cy, row in enumerate(shape):
+			for cx, val in enumerate(row):
+				if (cy + y >= 0):
+					try:
+						self.matrix[cy + y][cx + x] += val
+						if val and cy + y < self.height:
+							self.filled[cy + y] += 1
+							self.col_cells[cx + x] += 1
+							self.col_top[cx + x] = min(self.col_top[cx + x], cy + y)
+					except IndexError:
+						pass
+				else:
+					inside = False
+		return inside
+
+	def clear_lines(self, rows):
+		# Removes the full rows among rows (the ones the last stone landed in), all in one go.
+		# Returns how many went and which ones, top first (for the clear animation).
+		full = [y for y in rows if self.filled[y] == self.cols]
+		if not full:
+			return 0, full
+		self.changed(self.top, full[-1] + 1) # everything from the top of the stack down to the last one moves
+		kept = [y for y in range(self.height) if y not in full]
+		self.matrix = [[0 for x in range(self.cols)] for y in full] + [self.matrix[y] for y in kept] + self.matrix[self.height:]
+		self.filled = [0] * len(full) + [self.filled[y] for y in kept]
+		self.top = min(self.top + len(full), self.height)
+		self.index_clear(full)
+		return len(full), full
+
+	def add_garbage(self, count, gap, color = GARBAGE_COLOR):
+		# Pushes the board up count rows and fills the new bottom rows except for column gap (versus mode).
+		# Returns False if that pushed anything off the top.
+		lost = any(self.filled[:count])
+		row = [color if x != gap else 0 for x in range(self.cols)]
+		self.matrix = self.matrix[count:self.height] + [row[:] for y in range(count)] + self.matrix[self.height:]
+		self.filled = self.filled[count:] + [self.cols - 1] * count
+		self.top = max(self.top - count, 0)
+		self.changed(self.top, self.height)
+		self.index_garbage(count, gap, lost)
+		return not lost
+
+class tetrisEngine(object):
+	# The whole game state and rules with no display, sound or clock attached.
+	# Call step() with one of the action constants above to advance it. Gravity is just a DROP action, so whoever
+	# owns the engine decides when it happens (tetrisApp uses self.delay, a bot can drop as fast as it likes).
+	# Things the front end might want to react to (sounds, animations, music) are appended to self.events as tuples:
+	#   ('rotate',) ('set',) ('lines', rows_removed, top_row, rows) ('levelup', level) ('garbage', rows, gap) ('gameover',)
+	# Stones are just a stone_id and an orientation into ORIENTATIONS, self.stone and self.next_stone give the matrices.
+	# Every game is seeded: with seed = None each new game picks a fresh seed (kept in self.game_seed), otherwise
+	# every game uses the given one. randomizer is a key of RANDOMIZERS.
+	# board_class picks the board type, listBoard here or bitBoard from bitboard.py.
+	# If self.recorder is set, every action that reaches the game is passed to recorder.record(self.frame, action),
+	# the owner of the engine counts self.frame (see replay.py).
+	# rules is a gameRules, the normal game if left out. With a snapshot (see snapshot()) the engine carries on from it
+	# instead of starting a new game.
+	def __init__(self, start_level = 0, seed = None, randomizer = 'uniform', board_class = listBoard, rules = None,
+			snapshot = None):
+		self.rules = rules if rules != None else gameRules()
+		self.seed = seed
+		self.randomizer = randomizer
+		self.board_class = board_class
+		self.recorder = None
+		self.start_level = start_level
+		self.events = []
+		self.actions = {
+			NOOP:		lambda: False,
+			LEFT:		lambda: self.move(-1),
+			RIGHT:		lambda: self.move(+1),
+			DROP:		self.drop,
+			INSTA_FALL:	self.insta_fall,
+			ROTATE_CW:	lambda: self.rotate_stone(0),
+			ROTATE_CCW:	lambda: self.rotate_stone(1),
+			HFLIP:		lambda: self.rotate_stone(2),
+			VFLIP:		lambda: self.rotate_stone(3),
+		}
+		if snapshot != None:
+			self.generator = self.board = None
+			self.restore(snapshot)
+		else:
+			self.init_game()
+
+	def snapshot(self):
+		# The game as it is now, as a gameSnapshot. Events, the recorder and paused are not part of it.
+		return gameSnapshot(self.game_seed, self.generator.state(), self.frame, self.gameover, self.flips, self.pieces,
+			self.total_lines, self.board.snapshot(), self.level, self.score, self.delay, self.lines,
+			self.lines_required, self.lines_left, self.stone_id, self.orientation, self.stone_x, self.stone_y,
+			self.next_id)
+
+	def restore(self, snapshot):
+		# Puts the game back to snapshot, which has to come from an engine with the same rules, randomizer and board type.
+		(self.game_seed, generator, self.frame, self.gameover, self.flips, self.pieces, self.total_lines, board,
+			self.level, self.score, self.delay, self.lines, self.lines_required, self.lines_left, self.stone_id,
+			self.orientation, self.stone_x, self.stone_y, self.next_id) = snapshot
+		if self.generator == None:
+			self.generator = RANDOMIZERS[self.randomizer](self.game_seed, len(self.rules.shapes))
+		self.generator.restore(generator)
+		if self.board == None:
+			self.board = self.board_class(self.rules, board)
+		else:
+			self.board.restore(board)
+		self.piece = self.board.piece(self.stone_id, self.orientation)
+		self.paused = False
+
+	def branch(self, snapshot = None):
+		# A new engine carrying on from snapshot (the game as it is now if left out), for trying things out without
+		# touching this one. Both share the board rows they have not changed.
+		return tetrisEngine(self.start_level, self.seed, self.randomizer, self.board_class, self.rules,
+			snapshot if snapshot != None else self.snapshot())
+
+	def init_game(self):
+		self.game_seed = self.seed if self.seed != None else random.getrandbits(32)
+		self.generator = RANDOMIZERS[self.randomizer](self.game_seed, len(self.rules.shapes))
+		self.frame = 0
+		self.gameover = False
+		self.paused = False
+		self.flips = 0
+		self.pieces = 0
+		self.total_lines = 0 # self.lines starts over every level, this does not
+		self.board = self.board_class(self.rules)
+		self.level = self.start_level
+		self.score = 0
+		self.next_id = None
+		self.level_up(1)
+		self.new_stone()
+
+	@property
+	def stone(self):
+		return self.rules.orientations[self.stone_id][self.orientation]
+
+	@property
+	def next_stone(self):
+		return self.rules.orientations[self.next_id][0]
+
+	def step(self, action):
+		# Applies one action and returns True if it changed anything.
+		if self.recorder != None and not self.gameover and not self.paused:
+			self.recorder.record(self.frame, action)
+		return self.actions[action]()
+
+	def level_up(self, newgame = 0):
+		if not newgame:
+			self.level += 1
+			self.delay = self.rules.next_delay(self.delay, self.level)
+			self.events.append(('levelup', self.level))
+		else:
+			self.delay = self.rules.start_delay(self.level)
+		self.lines = 0
+		self.lines_required = self.lines_left = self.rules.lines_required(self.level)
+
+	def new_stone(self):
+		if self.next_id != None:
+			self.stone_id = self.next_id
+		else:
+			self.stone_id = self.generator.next()
+		self.orientation, self.stone_x, self.stone_y = self.rules.spawn(self.stone_id)
+		self.piece = self.board.piece(self.stone_id, self.orientation)
+
+		self.next_id = self.generator.next()
+		self.pieces += 1
+
+		if self.board.collides(self.piece, self.stone_x, self.stone_y):
+			self.gameover = True
+
+	def move(self, delta_x):
+		if not self.gameover and not self.paused:
+			new_x = self.stone_x + delta_x
+			if not self.board.collides(self.piece, new_x, self.stone_y):
+				self.stone_x = new_x
+				return True
+		return False
+
+	def landing_y(self):
+		# The row the falling stone would end on with an insta fall, where the ghost is drawn.
+		return self.board.landing_y(self.stone_id, self.orientation, self.stone_x, self.stone_y)
+
+	def insta_fall(self):
+		# Slides the stone down to where it would land. Like before it does not lock it, the next drop does that.
+		if not self.gameover and not self.paused:
+			self.stone_y = self.landing_y()
+			return True
+		return False
+
+	def drop(self):
+		if not self.gameover and not self.paused:
+			self.stone_y += 1
+			if self.board.collides(self.piece, self.stone_x, self.stone_y):
+				self.events.append(('set',))
+				top = self.stone_y - 1
+				bottom = min(top + len(self.stone), self.board.height)
+				if not self.board.join(self.stone, self.stone_x, top):
+					self.gameover = True
+				self.new_stone()
+				rows_removed, cleared = self.board.clear_lines(range(max(top, 0), bottom))
+				self.total_lines += rows_removed
+				points, lines = self.rules.score(rows_removed, self.level)
+				self.score += points
+				self.lines += lines
+				if rows_removed:
+					self.events.append(('lines', rows_removed, cleared[0], tuple(cleared)))
+
+				self.lines_left = self.lines_required - self.lines
+				if self.lines_left < 0:
+					self.lines_left = 0
+				if self.lines_left <= 0:
+					self.level_up()
+				if self.gameover:
+					self.events.append(('gameover',))
+			return True
+		return False
+
+	def rotate_stone(self, turn):
+		# turn: 0 clockwise, 1 counterclockwise, 2 horizontal flip, 3 vertical flip.
+		# The 'rotate' event only comes with a turn that happened, so a blocked one makes no sound.
+		if not self.gameover and not self.paused:
+			if turn in (2, 3):
+				self.flips += 1
+			orientation = self.rules.turns[self.stone_id][self.orientation][turn]
+			new_piece = self.board.piece(self.stone_id, orientation)
+			if not self.board.collides(new_piece, self.stone_x, self.stone_y):
+				self.orientation, self.piece = orientation, new_piece
+				self.events.append(('rotate',))
+				return True
+			else:
+				col_point = self.board.collision_point(new_piece, self.stone_x, self.stone_y)
+				if col_point[0] == 2:
+					if not self.board.collides(new_piece, self.stone_x - 1, self.stone_y):
+						self.orientation, self.piece = orientation, new_piece
+						self.move(-1)
+						self.events.append(('rotate',))
+						return True
+				if col_point[0] == 0:
+					if not self.board.collides(new_piece, self.stone_x + 1, self.stone_y):
+						self.orientation, self.piece = orientation, new_piece
+						self.move(1)
+						self.events.append(('rotate',))
+						return True
+		return False
+
+	def add_garbage(self, count, gap):
+		# Rubbish rows from the other player in versus mode, all full but for column gap. The falling stone is pushed
+		# up with the board if it would end up inside it.
+		if self.gameover or count <= 0:
+			return
+		inside = self.board.add_garbage(count, gap)
+		for i in range(count):
+			if not self.board.collides(self.piece, self.stone_x, self.stone_y):
+				break
+			self.stone_y -= 1
+		self.events.append(('garbage', count, gap))
+		if not inside or self.board.collides(self.piece, self.stone_x, self.stone_y):
+			self.gameover = True
+			self.events.append(('gameover',))
@@ -0,0 +1,137 @@
+# Frame profiler for tetrisApp (F3 or Tetris.py --profile FILE).
+# While it is on, the phases of each frame (input events, the game update, drops, drawing, text and waiting on the
+# clock) are timed with perf_counter_ns and check_collision/collides and pg.draw.rect calls are counted. It works by
+# wrapping those functions when it is switched on and putting the originals back when it is switched off, so when
+# it is off nothing is slowed down at all.
+# The side panel shows the rolling FPS and the 50th/99th percentile of how long each frame was busy (not waiting on
+# the clock). The recorded frames can be written out as a Chrome trace (.json, open it in chrome://tracing or
+# ui.perfetto.dev) or as a CSV with one line per frame.
+import csv
+import json
+import time
+from collections import deque
+
+class frameProfiler(object):
+	def __init__(self, max_frames = 3600, window = 120):
+		self.enabled = False
+		self.frames = deque(maxlen = max_frames) # (start ns, frame ns, spans, counts) of the recorded frames
+		self.window = deque(maxlen = window) # (frame ns, busy ns) for the overlay
+		self.patches = []
+		self.phases = []
+		self.counters = []
+		self.frame_start = None
+		self.spans = [] # (phase, start ns, ns) of the frame so far
+		self.counts = {}
+		self.summary = []
+
+	def time_calls(self, owner, name, phase):
+		# Times every call to owner.name (or owner[name] for a dict) as phase while the profiler is on.
+		self.wrap(owner, name, phase, self.timed)
+		if phase not in self.phases:
+			self.phases.append(phase)
+
+	def count_calls(self, owner, name, counter):
+		self.wrap(owner, name, counter, self.counted)
+		if counter not in self.counters:
+			self.counters.append(counter)
+
+	def wrap(self, owner, name, label, wrapper):
+		if isinstance(owner, dict):
+			original = owner[name]
+			owner[name] = wrapper(label, original)
+			self.patches.append((owner, name, original, True))
+		else:
+			own = name in getattr(owner, '__dict__', {})
+			original = getattr(owner, name)
+			setattr(owner, name, wrapper(label, original))
+			self.patches.append((owner, name, original, own))
+
+	def timed(self, phase, func):
+		spans = self.spans
+		clock = time.perf_counter_ns
+		def timed_call(*args, **kwargs):
+			start = clock()
+			try:
+				return func(*args, **kwargs)
+			finally:
+				spans.append((phase, start, clock() - start))
+		return timed_call
+
+	def counted(self, counter, func):
+		counts = self.counts
+		def counted_call(*args, **kwargs):
+			counts[counter] = counts.get(counter, 0) + 1
+			return func(*args, **kwargs)
+		return counted_call
+
+	def start(self):
+		self.enabled = True
+		self.frame_start = None
+
+	def stop(self):
+		# Puts back everything that was wrapped, newest first so wrappers of wrappers come off in order.
+		for owner, name, original, own in reversed(self.patches):
+			if isinstance(owner, dict):
+				owner[name] = original
+			elif own:
+				setattr(owner, name, original)
+			else:
+				delattr(owner, name)
+		self.patches = []
+		self.enabled = False
+
+	def next_frame(self):
+		# Call once at the top of every frame.
+		now = time.perf_counter_ns()
+		if self.frame_start != None:
+			waited = sum(ns for phase, start, ns in self.spans if phase == 'tick')
+			frame = now - self.frame_start
+			self.frames.append((self.frame_start, frame, list(self.spans), dict(self.counts)))
+			self.window.append((frame, frame - waited))
+			if len(self.frames) % 10 == 0:
+				self.update_summary()
+		self.frame_start = now
+		del self.spans[:]
+		self.counts.clear()
+
+	def update_summary(self):
+		frames = sorted(frame for frame, busy in self.window)
+		busy = sorted(busy for frame, busy in self.window)
+		p50 = busy[len(busy) // 2] / 1e6
+		p99 = busy[min(len(busy) - 1, len(busy) * 99 // 100)] / 1e6
+		fps = len(frames) * 1e9 / sum(frames)
+		last = self.frames[-1][3]
+		self.summary = [
+			'FPS {:.1f}'.format(fps),
+			'busy p50 {:.1f}ms'.format(p50),
+			'busy p99 {:.1f}ms'.format(p99),
+		] + ['{} {}'.format(counter, last.get(counter, 0)) for counter in self.counters]
+
+	def phase_totals(self, spans):
+		totals = dict((phase, 0) for phase in self.phases)
+		for phase, start, ns in spans:
+			totals[phase] += ns
+		return totals
+
+	def save(self, filename):
+		# Writes the recorded frames, as CSV if filename ends in .csv and as a Chrome trace otherwise.
+		if filename.endswith('.csv'):
+			with open(filename, 'w', newline = '') as f:
+				writer = csv.writer(f)
+				writer.writerow(['frame', 'start_ms', 'frame_ms'] + [phase + '_ms' for phase in self.phases] + self.counters)
+				first = self.frames[0][0] if self.frames else 0
+				for i, (start, frame, spans, counts) in enumerate(self.frames):
+					totals = self.phase_totals(spans)
+					writer.writerow([i, '{:.3f}'.format((start - first) / 1e6), '{:.3f}'.format(frame / 1e6)] +
+						['{:.3f}'.format(totals[phase] / 1e6) for phase in self.phases] +
+						[counts.get(counter, 0) for counter in self.counters])
+			return
+		events = []
+		for i, (start, frame, spans, counts) in enumerate(self.frames):
+			events.append({'name': 'frame', 'ph': 'X', 'ts': start / 1e3, 'dur': frame / 1e3, 'pid': 1, 'tid': 1, 'args': {'frame': i}})
+			for phase, span_start, ns in spans:
+				events.append({'name': phase, 'ph': 'X', 'ts': span_start / 1e3, 'dur': ns / 1e3, 'pid': 1, 'tid': 1})
+			events.append({'name': 'calls', 'ph': 'C', 'ts': start / 1e3, 'pid': 1, 'tid': 1,
+				'args': dict((counter, counts.get(counter, 0)) for counter in self.counters)})
+		with open(filename, 'w') as f:
+			json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,73 @@
+# Cached drawing helpers for tetrisApp.
+# A cell used to cost three pg.draw.rect calls (and two border colour calculations) every frame. Now each colour's
+# bevelled cell is drawn once into a small Surface and the board is drawn by blitting those.
+from collections import OrderedDict
+import pygame as pg
+
+def border_color(color, coldelta = 50):
+	bordercolor = [0, 0, 0]
+	for i in range(0, 3):
+		bordercolor[i] = color[i] - coldelta
+		if bordercolor[i] < 0: bordercolor[i] = 0
+		elif bordercolor[i] > 255: bordercolor[i] = 255
+	return bordercolor
+
+def draw_cell(surface, color, x, y, cell_size):
+	# The bevel is 4 pixels at the usual 20 pixel cells and keeps that proportion at other sizes.
+	bevel = max(1, cell_size // 5)
+	pg.draw.rect(surface, color, pg.Rect(x, y, cell_size, cell_size), 0)
+	pg.draw.rect(surface, border_color(color), pg.Rect(x, y, cell_size, cell_size), max(1, cell_size // 20))
+	pg.draw.rect(surface, border_color(color, 30), pg.Rect(x + bevel, y + bevel, cell_size - bevel - 1, cell_size - bevel - 1), 0)
+
+def draw_ghost_cell(surface, color, x, y, cell_size):
+	# A dark cell outlined in the colour, for the ghost stone.
+	pg.draw.rect(surface, [c // 5 for c in color], pg.Rect(x, y, cell_size, cell_size), 0)
+	pg.draw.rect(surface, border_color(color, 30), pg.Rect(x, y, cell_size, cell_size), max(1, cell_size // 10))
+
+class tileAtlas(object):
+	# One ready drawn cell per colour index, tiles[val] lines up with COLORS. Once there is a window they are converted
+	# to its pixel format so blitting them is a straight copy. With ghost = True the cells are ghost cells.
+	def __init__(self, colors, cell_size, ghost = False):
+		self.cell_size = cell_size
+		self.tiles = []
+		draw = draw_ghost_cell if ghost else draw_cell
+		for color in colors:
+			tile = pg.Surface((cell_size, cell_size))
+			draw(tile, color, 0, 0, cell_size)
+			if pg.display.get_surface() != None:
+				tile = tile.convert()
+			self.tiles.append(tile)
+
+	def draw_matrix(self, surface, matrix, x, y):
+		# Blits every non zero cell of matrix with its top left corner at pixel (x, y).
+		tiles = self.tiles
+		cell_size = self.cell_size
+		surface.blits([(tiles[val], (x + cx * cell_size, y + cy * cell_size))
+			for cy, row in enumerate(matrix) for cx, val in enumerate(row) if val], False)
+
+class textCache(object):
+	# Keeps one pg.font.Font per size and the most recently rendered text surfaces, so drawing the same label again
+	# (the HUD does every frame) is just a dict lookup. Once there are more than max_surfaces the least recently used
+	# one is dropped.
+	def __init__(self, font_name, max_surfaces = 128):
+		self.font_name = font_name
+		self.max_surfaces = max_surfaces
+		self.fonts = {}
+		self.surfaces = OrderedDict()
+
+	def font(self, size):
+		font = self.fonts.get(size)
+		if font == None:
+			font = self.fonts[size] = pg.font.Font(self.font_name, size)
+		return font
+
+	def render(self, text, size, color):
+		key = (text, size, tuple(color))
+		surface = self.surfaces.get(key)
+		if surface == None:
+			surface = self.surfaces[key] = self.font(size).render(text, True, color)
+			if len(self.surfaces) > self.max_surfaces:
+				self.surfaces.popitem(last = False)
+		else:
+			self.surfaces.move_to_end(key)
+		return surface
@@ -0,0 +1,154 @@
+# Replays: record a game as its seed plus the (frame, action) pairs that reached the engine, then play it back.
+# Since the engine only changes through step() and the stones come from the seeded randomizer, feeding the same
+# actions to a fresh engine gives back the same game, gravity included (it is recorded as DROP actions).
+#
+# File layout (little endian):
+#	b'TFR' version:B seed:I start_level:B randomizer:B cols:H rows:H tick_rate:H
+#	one varint per action: (frames since the previous action << 4) | action, ended by a 0
+#	score:Q level:H lines:H pieces:I flips:I frames:I	(what the game ended with, for verifying it)
+# A frame is one game tick, tick_rate of them a second. Version 1 files have no tick_rate, they were drawn frames at
+# 30 a second.
+#
+# From the command line:
+#	python replay.py verify replays/		re-simulate every .tfr file and check it ends the way it was recorded
+#	python replay.py info game.tfr
+# Tetris.py --replay game.tfr --speed 4 shows one on screen.
+import argparse
+import struct
+import sys
+import time
+from os import path, listdir
+from engine import config, tetrisEngine, gameRules, RANDOMIZERS, NOOP
+from bitboard import bitBoard
+
+MAGIC = b'TFR'
+VERSION = 2
+HEADER = struct.Struct('<3sBIBBHHH')
+HEADER_V1 = struct.Struct('<3sBIBBHH')
+FOOTER = struct.Struct('<QHHIII')
+RANDOMIZER_IDS = sorted(RANDOMIZERS)
+
+def write_varint(out, value):
+	while value > 0x7f:
+		out.append((value & 0x7f) | 0x80)
+		value >>= 7
+	out.append(value)
+
+def read_varint(data, pos):
+	value = 0
+	shift = 0
+	while True:
+		byte = data[pos]
+		pos += 1
+		value |= (byte & 0x7f) << shift
+		if byte < 0x80:
+			return value, pos
+		shift += 7
+
+class replayRecorder(object):
+	# Set engine.recorder to one of these (after engine.init_game(), it takes the seed from the game) and save() it
+	# once the game is over.
+	def __init__(self, engine):
+		self.engine = engine
+		self.seed = engine.game_seed
+		self.start_level = engine.start_level
+		self.randomizer = engine.randomizer
+		self.data = bytearray()
+		self.last_frame = 0
+
+	def record(self, frame, action):
+		if action == NOOP: # does nothing, and a 0 byte ends the list
+			return
+		write_varint(self.data, ((frame - self.last_frame) << 4) | action)
+		self.last_frame = frame
+
+	def to_bytes(self):
+		engine = self.engine
+		out = bytearray(HEADER.pack(MAGIC, VERSION, self.seed, self.start_level,
+			RANDOMIZER_IDS.index(self.randomizer), engine.rules.cols, engine.rules.rows, config['tick_rate']))
+		out += self.data
+		out.append(0)
+		out += FOOTER.pack(engine.score, engine.level, engine.lines, engine.pieces, engine.flips, engine.frame)
+		return bytes(out)
+
+	def save(self, filename):
+		with open(filename, 'wb') as f:
+			f.write(self.to_bytes())
+
+class replay(object):
+	def __init__(self, data):
+		magic, version = data[:3], data[3]
+		if magic != MAGIC or version not in (1, VERSION):
+			raise ValueError('not a version 1 or {} replay'.format(VERSION))
+		if version == 1:
+			magic, version, self.seed, self.start_level, randomizer, self.cols, self.rows = HEADER_V1.unpack_from(data)
+			self.tick_rate = 30
+			pos = HEADER_V1.size
+		else:
+			magic, version, self.seed, self.start_level, randomizer, self.cols, self.rows, self.tick_rate = HEADER.unpack_from(data)
+			pos = HEADER.size
+		self.randomizer = RANDOMIZER_IDS[randomizer]
+		self.actions = []
+		frame = 0
+		while True:
+			value, pos = read_varint(data, pos)
+			if value == 0:
+				break
+			frame += value >> 4
+			self.actions.append((frame, value & 0xf))
+		self.score, self.level, self.lines, self.pieces, self.flips, self.frames = FOOTER.unpack_from(data, pos)
+
+	@classmethod
+	def load(cls, filename):
+		with open(filename, 'rb') as f:
+			return cls(f.read())
+
+	def new_engine(self, board_class = bitBoard):
+		# Only the board size is recorded, the rest of the rules are the normal ones.
+		return tetrisEngine(self.start_level, self.seed, self.randomizer, board_class, gameRules(self.cols, self.rows))
+
+	def simulate(self, board_class = bitBoard):
+		# Plays the whole thing back with no display as fast as it goes and returns the finished engine.
+		engine = self.new_engine(board_class)
+		step = engine.step
+		for frame, action in self.actions:
+			engine.frame = frame
+			step(action)
+			engine.events = []
+		engine.frame = self.frames
+		return engine
+
+	def verify(self, board_class = bitBoard):
+		# True if playing it back ends with the score, level, lines, stones and flips that were recorded.
+		engine = self.simulate(board_class)
+		return (engine.score, engine.level, engine.lines, engine.pieces, engine.flips) == \
+			(self.score, self.level, self.lines, self.pieces, self.flips)
+
+def replay_files(name):
+	if path.isdir(name):
+		return sorted(path.join(name, f) for f in listdir(name) if f.endswith('.tfr'))
+	return [name]
+
+def main():
+	parser = argparse.ArgumentParser(description = 'Check or inspect Tetris Flip replays')
+	parser.add_argument('command', choices = ['verify', 'info'])
+	parser.add_argument('replays', nargs = '+', help = '.tfr files or folders of them')
+	args = parser.parse_args()
+	files = [f for name in args.replays for f in replay_files(name)]
+	if args.command == 'info':
+		for filename in files:
+			r = replay.load(filename)
+			print('{}: seed {} {} start level {}, {} actions over {:.1f}s, score {} level {} pieces {} flips {}'.format(
+				filename, r.seed, r.randomizer, r.start_level, len(r.actions), r.frames / float(r.tick_rate), r.score, r.level, r.pieces, r.flips))
+		return 0
+	start = time.perf_counter()
+	bad = 0
+	for filename in files:
+		if not replay.load(filename).verify():
+			bad += 1
+			print('MISMATCH', filename)
+	print('{} replays checked in {:.2f}s, {} mismatched'.format(len(files), time.perf_counter() - start, bad))
+	return 1 if bad else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,151 @@
+# High scores and statistics of finished games, kept in an SQLite file.
+#	python scores.py top --level 0 -n 10		the best games started at level 0
+#	python scores.py best --player demo		personal bests, one per start level
+#	python scores.py stats				games played, averages and the highest level reached
+# Every game is a row in games. Two small tables are kept up to date as games are added so the common questions do
+# not have to look at the games at all: bests has each player's best game per start level and totals has running sums
+# per player and start level. A personal best is then one primary key lookup and top N is a walk down the
+# (start_level, score) index that stops after N rows, however many games there are.
+# So the file does not grow forever when the demo or tournament.py bots play millions of games, prune() (run every
+# prune_every games) deletes games that are neither among the keep_top best of their start level nor among the
+# keep_recent newest. bests and totals are not pruned, they stay exact. SQLite reuses the freed pages.
+import argparse
+import sqlite3
+import sys
+import time
+
+FIELDS = ('player', 'score', 'start_level', 'level', 'lines', 'flips', 'pieces', 'duration_ms', 'seed', 'played')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS games (
+	id INTEGER PRIMARY KEY, player TEXT NOT NULL, score INTEGER NOT NULL, start_level INTEGER NOT NULL,
+	level INTEGER, lines INTEGER, flips INTEGER, pieces INTEGER, duration_ms INTEGER, seed INTEGER, played INTEGER);
+CREATE INDEX IF NOT EXISTS games_by_score ON games (start_level, score DESC);
+CREATE TABLE IF NOT EXISTS bests (
+	player TEXT NOT NULL, start_level INTEGER NOT NULL, score INTEGER NOT NULL, level INTEGER, lines INTEGER,
+	flips INTEGER, pieces INTEGER, duration_ms INTEGER, seed INTEGER, played INTEGER,
+	PRIMARY KEY (player, start_level)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS totals (
+	player TEXT NOT NULL, start_level INTEGER NOT NULL, games INTEGER, score INTEGER, lines INTEGER, flips INTEGER,
+	pieces INTEGER, duration_ms INTEGER, max_level INTEGER,
+	PRIMARY KEY (player, start_level)) WITHOUT ROWID;
+'''
+
+INSERT_GAME = 'INSERT INTO games ({}) VALUES ({})'.format(', '.join(FIELDS), ', '.join('?' * len(FIELDS)))
+UPDATE_BEST = '''INSERT INTO bests ({}) VALUES ({})
+	ON CONFLICT (player, start_level) DO UPDATE SET {} WHERE excluded.score > bests.score'''.format(
+	', '.join(FIELDS), ', '.join('?' * len(FIELDS)), ', '.join('{0} = excluded.{0}'.format(field) for field in FIELDS[1:]))
+UPDATE_TOTALS = '''INSERT INTO totals VALUES (?, ?, 1, ?, ?, ?, ?, ?, ?)
+	ON CONFLICT (player, start_level) DO UPDATE SET games = games + 1, score = score + excluded.score,
+	lines = lines + excluded.lines, flips = flips + excluded.flips, pieces = pieces + excluded.pieces,
+	duration_ms = duration_ms + excluded.duration_ms, max_level = max(max_level, excluded.max_level)'''
+
+def game_record(engine, player, duration_ms = None):
+	# What is stored about the finished game engine is holding. duration_ms is how long it took in game time.
+	return {
+		'player':	player,
+		'score':	engine.score,
+		'start_level':	engine.start_level,
+		'level':	engine.level,
+		'lines':	engine.total_lines,
+		'flips':	engine.flips,
+		'pieces':	engine.pieces,
+		'duration_ms':	None if duration_ms == None else int(duration_ms),
+		'seed':		engine.game_seed,
+	}
+
+class scoreStore(object):
+	def __init__(self, filename, keep_top = 1000, keep_recent = 100000, prune_every = 10000):
+		self.keep_top = keep_top
+		self.keep_recent = keep_recent
+		self.prune_every = prune_every
+		self.added = 0 # games since the last prune
+		self.db = sqlite3.connect(filename)
+		self.db.row_factory = sqlite3.Row
+		self.db.execute('PRAGMA journal_mode = WAL') # a commit is one append to the log, not a rewrite of the pages
+		self.db.execute('PRAGMA synchronous = NORMAL')
+		self.db.executescript(SCHEMA)
+
+	def add(self, game):
+		self.add_many([game])
+
+	def add_many(self, games):
+		# games are dicts like game_record() makes, all added in one transaction.
+		now = int(time.time())
+		rows = [tuple(game.get(field) for field in FIELDS[:-1]) + (game.get('played') or now,) for game in games]
+		totals = [(game['player'], game['start_level'], game['score'], game.get('lines') or 0, game.get('flips') or 0,
+			game.get('pieces') or 0, game.get('duration_ms') or 0, game.get('level') or 0) for game in games]
+		with self.db:
+			self.db.executemany(INSERT_GAME, rows)
+			self.db.executemany(UPDATE_BEST, rows)
+			self.db.executemany(UPDATE_TOTALS, totals)
+		self.added += len(rows)
+		if self.added >= self.prune_every:
+			self.prune()
+
+	def top(self, start_level, n = 10):
+		# The n best games started at start_level, best first.
+		return self.db.execute('SELECT * FROM games WHERE start_level = ? ORDER BY score DESC LIMIT ?', (start_level, n)).fetchall()
+
+	def best(self, player, start_level = None):
+		# player's best game at start_level, or a list of their best per start level.
+		if start_level != None:
+			return self.db.execute('SELECT * FROM bests WHERE player = ? AND start_level = ?', (player, start_level)).fetchone()
+		return self.db.execute('SELECT * FROM bests WHERE player = ? ORDER BY start_level', (player,)).fetchall()
+
+	def stats(self, player = None):
+		if player != None:
+			return self.db.execute('SELECT * FROM totals WHERE player = ? ORDER BY start_level', (player,)).fetchall()
+		return self.db.execute('SELECT * FROM totals ORDER BY player, start_level').fetchall()
+
+	def count(self):
+		return self.db.execute('SELECT count(*) FROM games').fetchone()[0]
+
+	def prune(self):
+		# Deletes the games that are not among the keep_top best of their start level or the keep_recent newest.
+		self.added = 0
+		newest = self.db.execute('SELECT max(id) FROM games').fetchone()[0]
+		if newest == None or newest <= self.keep_recent:
+			return
+		levels = [row[0] for row in self.db.execute('SELECT DISTINCT start_level FROM totals')]
+		with self.db:
+			for start_level in levels:
+				# Score of the keep_top-th best game, found on the index. Ties with it are kept too.
+				row = self.db.execute('SELECT score FROM games WHERE start_level = ? ORDER BY score DESC LIMIT 1 OFFSET ?',
+					(start_level, self.keep_top - 1)).fetchone()
+				if row != None:
+					self.db.execute('DELETE FROM games WHERE start_level = ? AND score < ? AND id <= ?',
+						(start_level, row[0], newest - self.keep_recent))
+
+	def close(self):
+		self.db.close()
+
+def main():
+	parser = argparse.ArgumentParser(description = 'Tetris Flip high scores')
+	parser.add_argument('command', choices = ['top', 'best', 'stats', 'prune'])
+	parser.add_argument('--file', default = 'scores.db')
+	parser.add_argument('--level', type = int, default = 0, help = 'start level for top')
+	parser.add_argument('-n', type = int, default = 10)
+	parser.add_argument('--player', default = None, help = 'for best and stats')
+	args = parser.parse_args()
+	store = scoreStore(args.file)
+	if args.command == 'top':
+		for i, game in enumerate(store.top(args.level, args.n)):
+			print('{:3}. {:<12}{:10} level {:2} lines {:5} flips {:5} seed {}'.format(i + 1, game['player'], game['score'],
+				game['level'], game['lines'], game['flips'], game['seed']))
+	elif args.command == 'best':
+		for game in store.best(args.player or 'player'):
+			print('start level {:2}: {:10} level {:2} lines {:5} seed {}'.format(game['start_level'], game['score'],
+				game['level'], game['lines'], game['seed']))
+	elif args.command == 'stats':
+		for row in store.stats(args.player):
+			print('{:<12}start level {:2}: {:8} games, mean score {:10.1f}, mean lines {:7.1f}, highest level {}'.format(
+				row['player'], row['start_level'], row['games'], row['score'] / row['games'], row['lines'] / row['games'], row['max_level']))
+	else:
+		store.prune()
+		print(store.count(), 'games kept')
+	store.close()
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,81 @@
+# Undo and what-if branches, built on tetrisEngine.snapshot() and restore().
+# A snapshot is a gameSnapshot (engine.py), an immutable tuple of the game's numbers plus the board's lists of rows.
+# The boards copy a row before they change it, so the rows are shared between the live board and every snapshot
+# that has them: keeping one per stone costs a list of row references each, not a copy of the board.
+#	python snapshot.py whatif game.tfr --stone 40 --bot search --pieces 100
+# plays the replay up to its 40th stone, lets the bot carry on from there on a branch with the same stones the player
+# got, and compares the two.
+import argparse
+import sys
+from collections import deque
+from bitboard import bitBoard
+from bots import BOTS
+from replay import replay
+
+class gameHistory(object):
+	# The last limit things pushed, oldest first, for undo. tetrisApp pushes (snapshot, song) at every new stone.
+	def __init__(self, limit = 1000):
+		self.entries = deque(maxlen = limit)
+
+	def __len__(self):
+		return len(self.entries)
+
+	def clear(self):
+		self.entries.clear()
+
+	def push(self, entry):
+		self.entries.append(entry)
+
+	def undo(self, steps = 1):
+		# Drops the newest steps entries and returns the one left on top, None if there is nothing. The oldest one is
+		# never dropped, undoing past it goes back to it.
+		if not self.entries:
+			return None
+		for i in range(min(steps, len(self.entries) - 1)):
+			self.entries.pop()
+		return self.entries[-1]
+
+def play_to(engine, actions, stone):
+	# Steps engine through the replay's actions until its stone-th stone appears, returns the actions left over.
+	for i, (frame, action) in enumerate(actions):
+		if engine.pieces >= stone or engine.gameover:
+			return actions[i:]
+		engine.frame = frame
+		engine.step(action)
+		engine.events = []
+	return []
+
+def whatif(filename, stone, bot_name, pieces, seed = 0):
+	r = replay.load(filename)
+	engine = r.new_engine(bitBoard)
+	rest = play_to(engine, r.actions, stone)
+	if engine.gameover or engine.pieces < stone:
+		print('{}: the game ended before stone {}'.format(filename, stone))
+		return
+	branch = engine.branch()
+	start = (engine.score, engine.total_lines)
+	play_to(engine, rest, stone + pieces)
+	bot = BOTS[bot_name](seed)
+	while not branch.gameover and branch.pieces < stone + pieces:
+		bot.play(branch)
+		branch.events = []
+	print(filename)
+	for name, game in (('player', engine), (bot_name, branch)):
+		print('{:<8} from stone {} to {}: {:+6} points {:+4} lines{}'.format(name, stone, game.pieces,
+			game.score - start[0], game.total_lines - start[1], ', game over' if game.gameover else ''))
+
+def main():
+	parser = argparse.ArgumentParser(description = 'Branch Tetris Flip games from a snapshot')
+	parser.add_argument('command', choices = ['whatif'])
+	parser.add_argument('replays', nargs = '+', help = '.tfr files')
+	parser.add_argument('--stone', type = int, default = 1, help = 'branch when this stone appears')
+	parser.add_argument('--pieces', type = int, default = 100, help = 'how many stones to compare')
+	parser.add_argument('--bot', choices = sorted(BOTS), default = 'search', help = 'the bot that plays the branch')
+	parser.add_argument('--seed', type = int, default = 0, help = 'for the bot')
+	args = parser.parse_args()
+	for filename in args.replays:
+		whatif(filename, args.stone, args.bot, args.pieces, args.seed)
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
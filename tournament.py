@@ -0,0 +1,131 @@
+# Bot tournaments: plays lots of headless games across a process pool and sums up how they went, for tuning the
+# level curve and scoring against the bots in bots.py.
+#	python tournament.py --bot lowest --games 10000 --seed 1 --out results.json --games-out games.jsonl
+# Game i uses seed + i for both its stones and its bot, so the same command gives the same numbers with any number of
+# workers. Workers send each game back as soon as it is over (--games-out writes them one JSON line each) and the
+# summary in --out has percentiles of score, lines, level reached, pieces placed and flips.
+# Games are independent and only a small dict comes back per game, so it scales with the number of cores.
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+from engine import tetrisEngine
+from bitboard import bitBoard
+from bots import BOTS
+from scores import scoreStore
+
+STATS = ('score', 'lines', 'level', 'pieces', 'flips')
+PERCENTILES = (1, 10, 25, 50, 75, 90, 99)
+
+def play_game(task):
+	# Runs in a worker. task is (game number, seed, bot name, start level, randomizer, max pieces).
+	game, seed, bot_name, start_level, randomizer, max_pieces = task
+	engine = tetrisEngine(start_level, seed, randomizer, bitBoard)
+	bot = BOTS[bot_name](seed)
+	while not engine.gameover and engine.pieces < max_pieces:
+		bot.play(engine)
+		engine.events = []
+	return {
+		'game':		game,
+		'seed':		seed,
+		'score':	engine.score,
+		'lines':	engine.total_lines,
+		'level':	engine.level,
+		'pieces':	engine.pieces,
+		'flips':	engine.flips,
+		'gameover':	engine.gameover,
+	}
+
+def percentile(values, p):
+	# values sorted, straight line between the two nearest ranks.
+	pos = (len(values) - 1) * p / 100.0
+	low = int(pos)
+	high = min(low + 1, len(values) - 1)
+	return values[low] + (values[high] - values[low]) * (pos - low)
+
+def summarize(results):
+	stats = {}
+	for name in STATS:
+		values = sorted(result[name] for result in results)
+		summary = {'mean': sum(values) / float(len(values)), 'min': values[0], 'max': values[-1]}
+		for p in PERCENTILES:
+			summary['p{}'.format(p)] = percentile(values, p)
+		stats[name] = summary
+	return stats
+
+def run(bot, games, seed = 0, workers = None, start_level = 0, randomizer = 'uniform', max_pieces = 10000, on_result = None):
+	# Plays the games and returns the list of per game results, in the order they finished.
+	# on_result(result) is called in the parent as each one comes in.
+	workers = workers or multiprocessing.cpu_count()
+	tasks = [(game, (seed + game) & 0xffffffff, bot, start_level, randomizer, max_pieces) for game in range(games)]
+	chunksize = max(1, min(16, games // (workers * 8))) # fewer round trips, still streams and balances well
+	results = []
+	with multiprocessing.Pool(workers) as pool:
+		for result in pool.imap_unordered(play_game, tasks, chunksize):
+			results.append(result)
+			if on_result != None:
+				on_result(result)
+	return results
+
+def main():
+	parser = argparse.ArgumentParser(description = 'Play bot games on every core and collect statistics')
+	parser.add_argument('--bot', choices = sorted(BOTS), default = 'lowest')
+	parser.add_argument('--games', type = int, default = 1000)
+	parser.add_argument('--seed', type = int, default = 0, help = 'game i is played with seed + i')
+	parser.add_argument('--workers', type = int, default = None, help = 'processes to use, default every core')
+	parser.add_argument('--level', type = int, default = 0, help = 'start level')
+	parser.add_argument('--bag', action = 'store_true', help = 'use the 7 bag randomizer')
+	parser.add_argument('--max-pieces', type = int, default = 10000, help = 'stop a game after this many stones')
+	parser.add_argument('--out', default = None, help = 'write the summary here as JSON')
+	parser.add_argument('--games-out', default = None, help = 'write every game here as it finishes, one JSON line each')
+	parser.add_argument('--scores', default = None, help = 'also keep every game in this SQLite score file (see scores.py)')
+	args = parser.parse_args()
+
+	randomizer = 'bag' if args.bag else 'uniform'
+	games_file = open(args.games_out, 'w') if args.games_out else None
+	store = scoreStore(args.scores) if args.scores else None
+	batch = []
+	def on_result(result):
+		if games_file != None:
+			games_file.write(json.dumps(result) + '\n')
+		if store != None:
+			batch.append(dict(result, player = args.bot, start_level = args.level))
+			if len(batch) == 1000: # one transaction per thousand games
+				store.add_many(batch)
+				del batch[:]
+	start = time.perf_counter()
+	try:
+		results = run(args.bot, args.games, args.seed, args.workers, args.level, randomizer, args.max_pieces, on_result)
+	finally:
+		if games_file != None:
+			games_file.close()
+		if store != None:
+			store.add_many(batch)
+			store.close()
+	seconds = time.perf_counter() - start
+
+	summary = {
+		'bot':		args.bot,
+		'games':	len(results),
+		'seed':		args.seed,
+		'start_level':	args.level,
+		'randomizer':	randomizer,
+		'max_pieces':	args.max_pieces,
+		'workers':	args.workers or multiprocessing.cpu_count(),
+		'seconds':	seconds,
+		'games_per_second': len(results) / seconds,
+		'stats':	summarize(results),
+	}
+	if args.out:
+		with open(args.out, 'w') as f:
+			json.dump(summary, f, indent = 1)
+	for name in STATS:
+		stat = summary['stats'][name]
+		print('{:<8} mean {:10.1f}  p10 {:10.1f}  p50 {:10.1f}  p90 {:10.1f}  max {:10}'.format(
+			name, stat['mean'], stat['p10'], stat['p50'], stat['p90'], stat['max']))
+	print('{} games in {:.2f}s on {} workers'.format(len(results), seconds, summary['workers']))
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,498 @@
+# Head to head games over the network.
+# The server runs every game itself (one tetrisEngine per player, both players get the same stones), clients only
+# send the actions their player makes. Clearing two or more rows sends rubbish rows to the other player, one for a
+# double, two for a triple and four for a tetris. After every server tick each player whose game changed is sent to
+# everyone in the match as a small binary update: the falling stone, the HUD numbers, what happened (for sounds) and
+# only the board rows that changed since the last update, each as a bitmask of its filled cells.
+# One asyncio loop ticks every match, so a single process runs hundreds of them.
+#	python versus.py serve --port 7777		--board 30x60 for bigger boards, every match is played on it
+#	python Tetris.py --connect host:7777		play
+#	python versus.py bots --host host --clients 50	headless clients that press random keys, for load testing
+#	python versus.py selftest --matches 100	a server and clients over localhost, checks the boards arrive intact
+# Messages are a little endian length:H then kind:B and the payload.
+#	HELLO	client -> server, name (utf-8)
+#	INPUT	client -> server, action:B
+#	WELCOME	server -> client, player:B players:B seed:I cols:H rows:H
+#	STATE	server -> client, STATE_HEAD then each changed row as ROW (row:H length:B) and its mask, length bytes
+#		little endian, so a row can be as wide as the board is
+#	OVER	server -> client, winner:B
+import argparse
+import asyncio
+import random
+import struct
+import sys
+import threading
+import time
+from engine import config, tetrisEngine, gameRules, listBoard, ORIENTATIONS, LEFT, RIGHT, DROP, INSTA_FALL, ROTATE_CW, ROTATE_CCW, HFLIP, VFLIP
+from bitboard import bitBoard, PAD, TOP
+
+PORT = 7777
+TICK_RATE = 60 # server updates per second
+GARBAGE = {2: 1, 3: 2, 4: 4} # rows cleared: rubbish rows sent
+REMOTE_COLOR = 7 # colour the locked cells of a remote board are drawn in, only which cells are filled is sent
+
+HELLO, INPUT, WELCOME, STATE, OVER = range(1, 6)
+MESSAGE = struct.Struct('<HB')
+WELCOME_MSG = struct.Struct('<BBIHH')
+# player, frame, stone_id, orientation, x, y, next_id, score, level, lines_left, event flags, rows cleared (bit i for
+# top row + i, a clear can skip rows), top row,
+# rubbish rows received, changed rows
+STATE_HEAD = struct.Struct('<BIBBhhBIHHBBHBH')
+ROW = struct.Struct('<HB')
+FLAG_ROTATE, FLAG_SET, FLAG_LEVELUP, FLAG_GAMEOVER, FLAG_LINES, FLAG_GARBAGE = 1, 2, 4, 8, 16, 32
+
+def pack(kind, payload = b''):
+	return MESSAGE.pack(len(payload) + 1, kind) + payload
+
+async def read_message(reader):
+	size, kind = MESSAGE.unpack(await reader.readexactly(MESSAGE.size))
+	return kind, await reader.readexactly(size - 1)
+
+def pack_row(y, mask):
+	return ROW.pack(y, (mask.bit_length() + 7) // 8) + mask.to_bytes((mask.bit_length() + 7) // 8, 'little')
+
+def unpack_row(payload, pos):
+	# (row, mask, position after it)
+	y, length = ROW.unpack_from(payload, pos)
+	pos += ROW.size
+	return y, int.from_bytes(payload[pos:pos + length], 'little'), pos + length
+
+def board_masks(board):
+	# The filled cells of each row of a bitBoard, bit x for column x.
+	cols = (1 << board.cols) - 1
+	return [(row >> PAD) & cols for row in board.rows[TOP:TOP + board.height]]
+
+class serverPlayer(object):
+	def __init__(self, writer, name):
+		self.writer = writer
+		self.name = name
+		self.index = None
+		self.engine = None
+		self.match = None
+		self.ready = asyncio.Event()
+		self.last_drop = 0.0
+		self.sent_rows = None # what everyone was last sent of each row, from the start of the match
+		self.sent_head = None
+		self.flags = 0
+		self.cleared = (0, 0)
+		self.garbage = 0
+
+	def collect_events(self):
+		# Folds the engine's events into what goes out with the next update.
+		for event in self.engine.events:
+			if event[0] == 'rotate':
+				self.flags |= FLAG_ROTATE
+			elif event[0] == 'set':
+				self.flags |= FLAG_SET
+			elif event[0] == 'levelup':
+				self.flags |= FLAG_LEVELUP
+			elif event[0] == 'gameover':
+				self.flags |= FLAG_GAMEOVER
+			elif event[0] == 'lines':
+				self.flags |= FLAG_LINES
+				self.cleared = (sum(1 << (y - event[2]) for y in event[3]), event[2])
+			elif event[0] == 'garbage':
+				self.flags |= FLAG_GARBAGE
+				self.garbage += event[1]
+		events = self.engine.events
+		self.engine.events = []
+		return events
+
+	def update(self, frame):
+		# The STATE message for this player if anything changed since the last one, else None.
+		engine = self.engine
+		masks = board_masks(engine.board)
+		changed = [(y, mask) for y, mask in enumerate(masks) if mask != self.sent_rows[y]]
+		head = (engine.stone_id, engine.orientation, engine.stone_x, engine.stone_y, engine.next_id,
+			engine.score, engine.level, engine.lines_left)
+		if not changed and head == self.sent_head and not self.flags:
+			return None
+		for y, mask in changed:
+			self.sent_rows[y] = mask
+		self.sent_head = head
+		payload = STATE_HEAD.pack(self.index, frame, *(head + (self.flags, self.cleared[0], self.cleared[1], min(self.garbage, 255), len(changed))))
+		payload += b''.join(pack_row(y, mask) for y, mask in changed)
+		self.flags = 0
+		self.garbage = 0
+		return pack(STATE, payload)
+
+class match(object):
+	def __init__(self, players, seed):
+		self.players = players
+		self.rng = random.Random(seed)
+		self.frame = 0
+		self.over = False
+
+	def start(self, now):
+		for player in self.players:
+			player.last_drop = now
+			board = player.engine.board
+			player.writer.write(pack(WELCOME, WELCOME_MSG.pack(player.index, len(self.players), player.engine.game_seed, board.cols, board.height)))
+
+	def act(self, player, action):
+		if not self.over:
+			player.engine.step(action)
+			self.after(player)
+
+	def after(self, player):
+		for event in player.collect_events():
+			if event[0] == 'lines' and event[1] in GARBAGE:
+				gap = self.rng.randrange(player.engine.board.cols)
+				for other in self.players:
+					if other is not player:
+						other.engine.add_garbage(GARBAGE[event[1]], gap)
+						other.collect_events()
+
+	def tick(self, now):
+		# Gravity, then everyone gets the updates. Returns False once the match is over.
+		self.frame += 1
+		for player in self.players:
+			engine = player.engine
+			if now - player.last_drop >= engine.delay:
+				player.last_drop += engine.delay
+				self.act(player, DROP)
+		self.broadcast()
+		alive = [player for player in self.players if not player.engine.gameover]
+		if len(alive) <= 1 and not self.over:
+			self.over = True
+			winner = alive[0].index if alive else 255
+			self.send_all(pack(OVER, bytes([winner])))
+			for player in self.players:
+				player.writer.close()
+		return not self.over
+
+	def broadcast(self):
+		messages = [player.update(self.frame) for player in self.players]
+		data = b''.join(message for message in messages if message != None)
+		if data:
+			self.send_all(data)
+
+	def send_all(self, data):
+		for player in self.players:
+			if not player.writer.is_closing():
+				player.writer.write(data)
+
+class versusServer(object):
+	# keep_finished keeps the matches that are over in self.finished, for checking them afterwards. rules is the
+	# engine.gameRules every match is played with, the clients get its board size when the match starts. Only the
+	# normal stones can be sent, so the rules have to use those.
+	def __init__(self, players_per_match = 2, keep_finished = False, rules = None):
+		self.rules = rules if rules != None else gameRules()
+		if self.rules.orientations is not ORIENTATIONS:
+			raise ValueError('versus games are played with the normal stones')
+		self.players_per_match = players_per_match
+		self.keep_finished = keep_finished
+		self.waiting = []
+		self.matches = []
+		self.finished = []
+		self.running = True
+
+	async def handle(self, reader, writer):
+		# One per connected client: waits for a match, then passes its inputs on until it disconnects.
+		player = None
+		try:
+			kind, payload = await read_message(reader)
+			if kind != HELLO:
+				return
+			player = serverPlayer(writer, payload.decode('utf-8', 'replace'))
+			self.waiting.append(player)
+			if len(self.waiting) == self.players_per_match:
+				self.start_match()
+			await player.ready.wait()
+			while True:
+				kind, payload = await read_message(reader)
+				if kind == INPUT and payload and payload[0] <= VFLIP:
+					player.match.act(player, payload[0])
+		except (asyncio.IncompleteReadError, ConnectionError):
+			pass
+		finally:
+			if player in self.waiting:
+				self.waiting.remove(player)
+			elif player != None and player.match != None and not player.engine.gameover: # leaving is losing
+				player.engine.gameover = True
+			writer.close()
+
+	def start_match(self):
+		seed = random.getrandbits(32)
+		players = self.waiting
+		self.waiting = []
+		for index, player in enumerate(players):
+			player.index = index
+			player.engine = tetrisEngine(0, seed, 'uniform', bitBoard, self.rules)
+			player.sent_rows = [None] * self.rules.rows
+		new_match = match(players, seed)
+		new_match.start(asyncio.get_running_loop().time() * 1000)
+		self.matches.append(new_match)
+		for player in players:
+			player.match = new_match
+			player.ready.set()
+
+	async def ticker(self):
+		loop = asyncio.get_running_loop()
+		interval = 1.0 / TICK_RATE
+		next_tick = loop.time()
+		while True:
+			if self.running:
+				now = loop.time() * 1000
+				running = []
+				for m in self.matches:
+					if m.tick(now):
+						running.append(m)
+					elif self.keep_finished:
+						self.finished.append(m)
+				self.matches = running
+			next_tick += interval
+			await asyncio.sleep(max(0, next_tick - loop.time()))
+
+	async def serve(self, host = '0.0.0.0', port = PORT, started = None):
+		server = await asyncio.start_server(self.handle, host, port)
+		if started != None:
+			started(server)
+		ticker = asyncio.ensure_future(self.ticker())
+		try:
+			async with server:
+				await server.serve_forever()
+		finally:
+			ticker.cancel()
+
+class remoteBoard(object):
+	def __init__(self, cols, rows):
+		self.cols = cols
+		self.height = rows
+		self.top = 0 # not worked out, drawing just starts at the top
+		self.changes = None
+		self.masks = [0] * rows
+		self.matrix = [[0] * cols for y in range(rows)] + [[1] * cols]
+
+	changed = listBoard.changed
+	take_changes = listBoard.take_changes
+
+	def set_row(self, y, mask):
+		self.masks[y] = mask
+		self.matrix[y] = [REMOTE_COLOR if mask >> x & 1 else 0 for x in range(self.cols)]
+		self.changed(y, y + 1)
+
+class remoteGame(object):
+	# One player's game as the server last described it. It has the parts of tetrisEngine that tetrisApp draws and
+	# plays sounds from, and step() sends the action to the server (for your own game, send is None for the others).
+	def __init__(self, cols, rows, send = None):
+		self.board = remoteBoard(cols, rows)
+		self.send = send
+		self.events = [] # appended to on the network thread, take them with take_events()
+		self.lock = threading.Lock()
+		self.frame = 0
+		self.server_frame = 0
+		self.stone_id = self.next_id = self.orientation = 0
+		self.stone_x = self.stone_y = 0
+		self.score = self.level = self.lines_left = 0
+		self.pieces = 0
+		self.start_level = 0
+		self.delay = config['delay']
+		self.gameover = False
+		self.paused = False
+		self.version = 0 # goes up with every update, to tell when to draw it again
+		self.actions = dict((action, lambda action = action: self.step(action)) for action in range(VFLIP + 1))
+
+	@property
+	def stone(self):
+		return ORIENTATIONS[self.stone_id][self.orientation]
+
+	@property
+	def next_stone(self):
+		return ORIENTATIONS[self.next_id][0]
+
+	def init_game(self):
+		pass # the server starts the games
+
+	def landing_y(self):
+		return None # the board is the server's, so no ghost
+
+	def step(self, action):
+		if self.send != None and not self.gameover:
+			self.send(action)
+		return False
+
+	def apply(self, payload):
+		(player, self.server_frame, stone_id, self.orientation, self.stone_x, self.stone_y, self.next_id, self.score,
+			self.level, self.lines_left, flags, cleared, top_row, garbage, changed) = STATE_HEAD.unpack_from(payload)
+		if stone_id != self.stone_id or flags & FLAG_SET:
+			self.pieces += 1
+		self.stone_id = stone_id
+		pos = STATE_HEAD.size
+		for i in range(changed):
+			y, mask, pos = unpack_row(payload, pos)
+			self.board.set_row(y, mask)
+		events = []
+		if changed:
+			events.append(('board',))
+		if flags & FLAG_ROTATE:
+			events.append(('rotate',))
+		if flags & FLAG_SET:
+			events.append(('set',))
+		if flags & FLAG_LINES:
+			rows = tuple(top_row + i for i in range(8) if cleared & (1 << i))
+			events.append(('lines', len(rows), top_row, rows))
+		if flags & FLAG_LEVELUP:
+			events.append(('levelup', self.level))
+		if flags & FLAG_GARBAGE:
+			events.append(('garbage', garbage))
+		if flags & FLAG_GAMEOVER:
+			self.gameover = True
+			events.append(('gameover',))
+		with self.lock:
+			self.events += events
+		self.version += 1
+
+	def take_events(self):
+		with self.lock:
+			events = self.events
+			self.events = []
+		return events
+
+class versusClient(object):
+	# The network side of a player. After connect() self.games has a remoteGame per player and self.me is yours.
+	def __init__(self, name = 'player'):
+		self.name = name
+		self.games = []
+		self.me = None
+		self.winner = None
+		self.writer = None
+		self.bytes_received = 0
+
+	async def connect(self, host, port = PORT):
+		reader, self.writer = await asyncio.open_connection(host, port)
+		self.reader = reader
+		self.writer.write(pack(HELLO, self.name.encode('utf-8')))
+		kind, payload = await read_message(reader)
+		self.me, players, self.seed, cols, rows = WELCOME_MSG.unpack(payload)
+		self.games = [remoteGame(cols, rows, self.send if i == self.me else None) for i in range(players)]
+
+	def send(self, action):
+		self.writer.write(pack(INPUT, bytes([action])))
+
+	async def receive(self):
+		# Applies updates until the match is over or the connection goes.
+		try:
+			while True:
+				kind, payload = await read_message(self.reader)
+				self.bytes_received += len(payload) + MESSAGE.size
+				if kind == STATE:
+					self.games[payload[0]].apply(payload)
+				elif kind == OVER:
+					self.winner = payload[0]
+					for game in self.games:
+						game.gameover = True
+					break
+		except (asyncio.IncompleteReadError, ConnectionError):
+			for game in self.games:
+				game.gameover = True
+		self.writer.close()
+
+class threadedClient(versusClient):
+	# versusClient on its own thread and event loop, for tetrisApp. send() can be called from the game's thread.
+	# start() raises what connect() raised (OSError, ConnectionError) if it could not connect.
+	def start(self, host, port = PORT):
+		connected = threading.Event()
+		failed = []
+		def run():
+			self.loop = asyncio.new_event_loop()
+			try:
+				self.loop.run_until_complete(self.connect(host, port))
+			except Exception as e:
+				failed.append(e)
+				return
+			finally:
+				connected.set()
+			self.loop.run_until_complete(self.receive())
+		threading.Thread(target = run, daemon = True).start()
+		connected.wait()
+		if failed:
+			raise failed[0]
+
+	def send(self, action):
+		self.loop.call_soon_threadsafe(versusClient.send, self, action)
+
+async def random_player(client, rng, seconds):
+	# Presses a random key every 50 to 150 ms for a headless client.
+	keys = [LEFT, RIGHT, DROP, INSTA_FALL, ROTATE_CW, ROTATE_CCW, HFLIP, VFLIP]
+	end = time.perf_counter() + seconds
+	while time.perf_counter() < end and not client.games[client.me].gameover:
+		client.send(rng.choice(keys))
+		await asyncio.sleep(rng.uniform(0.05, 0.15))
+
+async def run_bots(host, port, clients, seconds):
+	bots = [versusClient('bot{}'.format(i)) for i in range(clients)]
+	await asyncio.gather(*[bot.connect(host, port) for bot in bots])
+	receivers = [asyncio.ensure_future(bot.receive()) for bot in bots]
+	await asyncio.gather(*[random_player(bot, random.Random(i), seconds) for i, bot in enumerate(bots)])
+	return bots, receivers
+
+async def selftest(matches, seconds, rules = None):
+	# Runs a server and 2 * matches clients in this process, then stops the server's clock and checks that every
+	# client's copy of every board is the same as the server's.
+	server = versusServer(keep_finished = True, rules = rules)
+	started = asyncio.Event()
+	ports = []
+	def on_start(s):
+		ports.append(s.sockets[0].getsockname()[1])
+		started.set()
+	serving = asyncio.ensure_future(server.serve('127.0.0.1', 0, on_start))
+	await started.wait()
+	start = time.perf_counter()
+	bots, receivers = await run_bots('127.0.0.1', ports[0], matches * 2, seconds)
+	played = time.perf_counter() - start
+	await asyncio.sleep(0.2) # the last inputs
+	server.running = False
+	for m in server.matches:
+		m.broadcast()
+	await asyncio.sleep(0.5) # the last updates
+	seats = dict(((bot.seed, bot.me), bot) for bot in bots)
+	checked = bad = 0
+	for m in server.matches + server.finished:
+		for player in m.players:
+			masks = board_masks(player.engine.board)
+			for other in m.players:
+				bot = seats[(player.engine.game_seed, other.index)]
+				checked += 1
+				if bot.games[player.index].board.masks != masks:
+					bad += 1
+	received = sum(bot.bytes_received for bot in bots)
+	print('{} matches ({} finished), {} clients, {:.1f}s: {} boards checked, {} different, {:.0f} bytes/s per client'.format(
+		matches, len(server.finished), len(bots), played, checked, bad, received / played / len(bots)))
+	for bot in bots: # hang up first so the server's handlers finish on their own
+		bot.writer.close()
+	await asyncio.sleep(0.2)
+	serving.cancel()
+	for receiver in receivers:
+		receiver.cancel()
+	return 1 if bad else 0
+
+def main():
+	parser = argparse.ArgumentParser(description = 'Tetris Flip versus server')
+	parser.add_argument('command', choices = ['serve', 'bots', 'selftest'])
+	parser.add_argument('--host', default = '127.0.0.1')
+	parser.add_argument('--port', type = int, default = PORT)
+	parser.add_argument('--clients', type = int, default = 2, help = 'headless clients for bots')
+	parser.add_argument('--matches', type = int, default = 50, help = 'matches for selftest')
+	parser.add_argument('--seconds', type = float, default = 5)
+	parser.add_argument('--board', metavar = 'COLSxROWS', help = 'board size for serve and selftest, like 30x60')
+	args = parser.parse_args()
+	rules = None
+	if args.board:
+		cols, rows = args.board.lower().split('x')
+		rules = gameRules(int(cols), int(rows))
+	if args.command == 'serve':
+		print('serving on port', args.port)
+		asyncio.run(versusServer(rules = rules).serve('0.0.0.0', args.port))
+	elif args.command == 'bots':
+		async def bots():
+			clients, receivers = await run_bots(args.host, args.port, args.clients, args.seconds)
+			for receiver in receivers:
+				receiver.cancel()
+		asyncio.run(bots())
+	else:
+		return asyncio.run(selftest(args.matches, args.seconds, rules))
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
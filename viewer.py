@@ -0,0 +1,214 @@
+# Watches the games going through a broadcast.py relay, side by side in one window.
+#	python viewer.py --host host --port 7778
+#	python viewer.py --local 16 --fps 0 --frames 600	16 games played in this process, prints the frame rate
+# The window is split into a grid of tiles, one per game, with as many columns as gives the biggest cells. Like
+# tetrisApp.draw_dirty() each tile keeps its locked cells on a surface of its own that only changes where the board
+# does, and a frame just puts back what was under the old stone, draws the new one and updates those rects. A frame
+# with nothing new costs a few comparisons per game.
+import argparse
+import math
+import random
+import sys
+import time
+import pygame as pg
+from engine import tetrisEngine
+from bitboard import bitBoard
+from render import tileAtlas, textCache
+from broadcast import threadedWatcher, streamWatcher, gameStream, read_messages, ACTIONS, RELAY_PORT, PUBLISH, JOIN, GAME
+from Tetris import COLORS, BLACK, WHITE, RED, FONT_NAME, REDRAW_EVENTS, MIN_CELL
+
+MARGIN = 4 # pixels around each tile
+WINDOW = (1280, 720)
+
+class viewTile(object):
+	def __init__(self, game, rect):
+		self.game = game # the id, the watchedGame behind it can change
+		self.rect = rect
+		self.board = None # the board drawn on board_surface
+		self.stone = None # what was drawn last: (stone_id, orientation, x, y)
+		self.stone_rect = None
+		self.label = None
+
+class tiledViewer(object):
+	# Draws watcher.games (a streamWatcher's) onto the window.
+	def __init__(self, watcher):
+		self.watcher = watcher
+		self.font_name = pg.font.match_font(FONT_NAME)
+		self.text_cache = textCache(self.font_name)
+		self.atlases = {} # by cell size
+		self.tiles = []
+		self.redraw_all = True
+
+	def atlas(self, cell_size):
+		atlas = self.atlases.get(cell_size)
+		if atlas == None:
+			atlas = self.atlases[cell_size] = tileAtlas(COLORS, cell_size)
+		return atlas
+
+	def layout(self):
+		# One tile per game, in as many columns as makes the biggest cells for the biggest board.
+		self.window = pg.display.get_surface()
+		width, height = self.window.get_size()
+		games = self.watcher.games
+		ids = sorted(games)
+		self.label_height = max(12, min(24, height // 40))
+		cols, rows = 10, 20
+		for game in games.values():
+			if game.board != None:
+				cols, rows = max(cols, game.board.cols), max(rows, game.board.height)
+		best = (0, 1)
+		for columns in range(1, max(len(ids), 1) + 1):
+			tile_w = width // columns
+			tile_h = height // math.ceil(max(len(ids), 1) / columns)
+			cell_size = min((tile_w - 2 * MARGIN) // cols, (tile_h - 2 * MARGIN - self.label_height) // rows)
+			best = max(best, (cell_size, columns))
+		columns = best[1]
+		tile_w = width // columns
+		tile_h = height // math.ceil(max(len(ids), 1) / columns)
+		self.tiles = [viewTile(game, pg.Rect(i % columns * tile_w, i // columns * tile_h, tile_w, tile_h)) for i, game in enumerate(ids)]
+		self.layout_key = (tuple(ids), (width, height))
+		self.window.fill(BLACK)
+		self.redraw_all = True
+
+	def fit_board(self, tile, board):
+		# Sizes and places the board in its tile, under the label.
+		tile.board = board
+		inner = tile.rect.inflate(-2 * MARGIN, -2 * MARGIN)
+		tile.cell_size = max(MIN_CELL, min(inner.width // board.cols, (inner.height - self.label_height) // board.height))
+		tile.board_rect = pg.Rect(0, 0, board.cols * tile.cell_size, board.height * tile.cell_size)
+		tile.board_rect.midtop = (inner.centerx, inner.y + self.label_height)
+		tile.board_rect = tile.board_rect.clip(tile.rect)
+		tile.label_rect = pg.Rect(inner.x, inner.y, inner.width, self.label_height)
+		tile.board_surface = pg.Surface(tile.board_rect.size).convert()
+		tile.stone = tile.stone_rect = tile.label = None
+		self.window.fill(BLACK, tile.rect)
+
+	def draw(self):
+		# Draws what changed since the last call, returns the rects of the window that have to be updated.
+		if self.layout_key != (tuple(sorted(self.watcher.games)), self.window.get_size()):
+			self.layout()
+		dirty = []
+		games = self.watcher.games
+		window = self.window
+		for tile in self.tiles:
+			game = games.get(tile.game)
+			if game == None or game.board == None:
+				continue
+			board = game.board
+			if board is not tile.board:
+				self.fit_board(tile, board)
+				board.take_changes()
+				changes = (0, board.height)
+				dirty.append(tile.rect)
+			else:
+				changes = board.take_changes()
+			cell_size = tile.cell_size
+			atlas = self.atlas(cell_size)
+			if changes != None:
+				first, last = changes
+				area = pg.Rect(0, first * cell_size, tile.board_rect.width, (last - first) * cell_size)
+				tile.board_surface.fill(BLACK, area)
+				atlas.draw_matrix(tile.board_surface, board.matrix[first:last], 0, first * cell_size)
+				dirty.append(window.blit(tile.board_surface, tile.board_rect.move(0, area.y), area))
+			stone = (game.stone_id, game.orientation, game.stone_x, game.stone_y)
+			if stone != tile.stone or changes != None:
+				if tile.stone_rect != None:
+					dirty.append(window.blit(tile.board_surface, tile.stone_rect, tile.stone_rect.move(-tile.board_rect.x, -tile.board_rect.y)))
+				shape = game.stone
+				x = tile.board_rect.x + game.stone_x * cell_size
+				y = tile.board_rect.y + game.stone_y * cell_size
+				window.set_clip(tile.board_rect)
+				atlas.draw_matrix(window, shape, x, y)
+				window.set_clip(None)
+				tile.stone_rect = pg.Rect(x, y, len(shape[0]) * cell_size, len(shape) * cell_size).clip(tile.board_rect)
+				tile.stone = stone
+				dirty.append(tile.stone_rect)
+			label = (game.name, game.score, game.level, game.gameover)
+			if label != tile.label:
+				window.fill(BLACK, tile.label_rect)
+				text = '{}  {}  level {}{}'.format(game.name, game.score, game.level, '  game over' if game.gameover else '')
+				surface = self.text_cache.render(text, self.label_height - 2, RED if game.gameover else WHITE)
+				window.blit(surface, tile.label_rect, pg.Rect(0, 0, tile.label_rect.width, tile.label_rect.height))
+				tile.label = label
+				dirty.append(tile.label_rect)
+		if self.redraw_all:
+			self.redraw_all = False
+			return [window.get_rect()]
+		return dirty
+
+class localGames(object):
+	# count games pressing random keys, streamed into a streamWatcher in this process the same way a relay would.
+	def __init__(self, watcher, count, seed = 0):
+		self.rng = random.Random(seed)
+		self.engines = []
+		self.streams = []
+		for i in range(count):
+			engine = tetrisEngine(0, self.rng.getrandbits(32), 'uniform', bitBoard)
+			self.engines.append(engine)
+			self.streams.append(gameStream(engine, lambda data, game = i: self.deliver(watcher, game, data), 'local{}'.format(i)))
+
+	def deliver(self, watcher, game, data):
+		for kind, payload in read_messages(data):
+			watcher.apply(JOIN if kind == PUBLISH else kind, GAME.pack(game) + payload)
+		return True
+
+	def step(self):
+		for engine, stream in zip(self.engines, self.streams):
+			if engine.gameover:
+				engine.init_game()
+				stream.keyframe()
+			engine.step(self.rng.choice(ACTIONS))
+			events = engine.events
+			engine.events = []
+			stream.update(events)
+
+def main():
+	parser = argparse.ArgumentParser(description = 'Watch Tetris Flip games through a broadcast relay')
+	parser.add_argument('--host', default = '127.0.0.1')
+	parser.add_argument('--port', type = int, default = RELAY_PORT)
+	parser.add_argument('--local', type = int, metavar = 'N', help = 'watch N games played by random keys in this process instead')
+	parser.add_argument('--fps', type = int, default = 60, help = 'frames drawn per second, 0 for as many as possible')
+	parser.add_argument('--frames', type = int, help = 'quit after this many frames and print the frame rate')
+	parser.add_argument('--size', default = '{}x{}'.format(*WINDOW), metavar = 'WxH', help = 'window size')
+	args = parser.parse_args()
+	pg.init()
+	pg.display.set_mode([int(v) for v in args.size.lower().split('x')], pg.RESIZABLE)
+	pg.display.set_caption('tetris viewer')
+	if args.local != None:
+		watcher = streamWatcher()
+		local = localGames(watcher, args.local)
+	else:
+		watcher = threadedWatcher()
+		try:
+			watcher.start(args.host, args.port)
+		except OSError as e:
+			print('could not connect to the relay at {}:{}: {}'.format(args.host, args.port, e))
+			pg.quit()
+			return 1
+		local = None
+	viewer = tiledViewer(watcher)
+	viewer.layout()
+	clock = pg.time.Clock()
+	frames = 0
+	start = time.perf_counter()
+	while args.frames == None or frames < args.frames:
+		for event in pg.event.get():
+			if event.type == pg.QUIT or (event.type == pg.KEYDOWN and event.key == pg.K_ESCAPE):
+				args.frames = frames
+			elif event.type in REDRAW_EVENTS:
+				viewer.layout()
+		if local != None:
+			local.step()
+		else:
+			watcher.apply_pending()
+		pg.display.update(viewer.draw())
+		frames += 1
+		if args.fps:
+			clock.tick(args.fps)
+	seconds = time.perf_counter() - start
+	print('{} games, {} frames in {:.1f}s, {:.0f} fps'.format(len(watcher.games), frames, seconds, frames / seconds))
+	pg.quit()
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())